@@ -0,0 +1,120 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+from array import array
+
+from mp_deye_config import DeyeConfig
+from mp_deye_observation import Observation
+from mp_deye_sensor import Sensor
+
+class DeyeSensorWindow():
+    """
+    Rolling window over the last samples of one sensor, kept in a preallocated float array.
+
+    For power sensors the energy is integrated with the trapezoidal rule between subsequent
+    samples, in Wh since the last reset.
+    """
+
+    def __init__(self, sensor: Sensor, size: int, integrate: bool):
+        self.sensor = sensor
+        self.integrate = integrate
+        self.__samples = array('f', [0.0] * size)
+        self.__count = 0
+        self.__index = 0
+        self.energy_wh = 0.0
+        self.__last_value = None
+        self.__last_ticks = None
+
+    def add(self, value: float, ticks_ms: int):
+        self.__samples[self.__index] = value
+        self.__index = (self.__index + 1) % len(self.__samples)
+        if self.__count < len(self.__samples):
+            self.__count += 1
+        if self.integrate:
+            if self.__last_value is not None:
+                self.energy_wh += (self.__last_value + value) / 2 * (ticks_ms - self.__last_ticks) / 3600000
+            self.__last_value = value
+            self.__last_ticks = ticks_ms
+
+    def is_empty(self) -> bool:
+        return self.__count == 0
+
+    def min(self) -> float:
+        result = self.__samples[0]
+        for i in range(1, self.__count):
+            if self.__samples[i] < result:
+                result = self.__samples[i]
+        return result
+
+    def max(self) -> float:
+        result = self.__samples[0]
+        for i in range(1, self.__count):
+            if self.__samples[i] > result:
+                result = self.__samples[i]
+        return result
+
+    def mean(self) -> float:
+        total = 0.0
+        for i in range(self.__count):
+            total += self.__samples[i]
+        return total / self.__count
+
+    def reset_energy(self):
+        self.energy_wh = 0.0
+
+
+class DeyeAggregator():
+    """
+    Collects the observations of every poll cycle into per-sensor rolling windows and tells when
+    the window summaries (min, max, mean, energy) are due for publishing.
+    """
+
+    def __init__(self, config: DeyeConfig, sensors: list):
+        self.publish_every = config.aggregate_publish_every
+        self.windows = {}
+        for sensor in sensors:
+            if sensor.mqtt_topic_suffix and not sensor.is_status():
+                integrate = sensor.mqtt_topic_suffix in config.aggregate_integrate
+                self.windows[sensor] = DeyeSensorWindow(sensor, config.aggregate_window, integrate)
+        self.__samples = 0
+
+    def add(self, observations: list[Observation], ticks_ms: int):
+        for observation in observations:
+            window = self.windows.get(observation.sensor)
+            if window:
+                window.add(observation.value, ticks_ms)
+        self.__samples += 1
+
+    def is_due(self) -> bool:
+        return self.__samples >= self.publish_every
+
+    def summaries(self):
+        """
+        Yields (topic_suffix, value) of all window summaries and restarts the publishing period
+        """
+        self.__samples = 0
+        for sensor, window in self.windows.items():
+            if window.is_empty():
+                continue
+            suffix = sensor.mqtt_topic_suffix
+            yield (suffix + '/min', sensor.format_value(window.min()))
+            yield (suffix + '/max', sensor.format_value(window.max()))
+            yield (suffix + '/avg', sensor.format_value(window.mean()))
+            if window.integrate:
+                yield (suffix + '/energy_wh', '{:0.3f}'.format(window.energy_wh))
+                window.reset_energy()
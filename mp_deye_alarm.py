@@ -0,0 +1,79 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+from mp_deye_config import DeyeConfig
+from mp_deye_log import log
+
+
+class DeyeAlarmMonitor():
+    """
+    Tracks the values of the status and alarm sensors and reports their changes as events.
+
+    Between poll cycles the alarm registers are read every alarm_poll_interval seconds. While a fault
+    is active the interval drops to alarm_fast_interval and, once all faults cleared, doubles with
+    every read until it is back at the normal interval.
+    """
+
+    def __init__(self, config: DeyeConfig, sensors: list):
+        self.sensors = sorted([s for s in sensors if s.is_status()], key=lambda s: s.name)
+        self.normal_interval = config.alarm_poll_interval or config.data_read_inverval
+        self.fast_interval = min(config.alarm_fast_interval, self.normal_interval)
+        self.__interval = self.normal_interval
+        self.__values = {}
+
+    def update(self, registers: dict) -> list:
+        """
+        Reads the status and alarm sensors from the registers and returns (topic_suffix, value) of every change:
+        the new sensor value and the change event published to '<topic_suffix>/event'
+        """
+        messages = []
+        for sensor in self.sensors:
+            value = sensor.read_value(registers)
+            if value is None:
+                continue
+            old_value = self.__values.get(sensor)
+            if value == old_value:
+                continue
+            self.__values[sensor] = value
+            if not sensor.mqtt_topic_suffix:
+                continue
+            messages.append((sensor.mqtt_topic_suffix, sensor.format_value(value)))
+            if old_value is not None:
+                change = sensor.format_change(old_value, value)
+                log.warning("{}: {}", sensor.name, change)
+                messages.append((sensor.mqtt_topic_suffix + '/event', change))
+        if self.is_fault():
+            self.__interval = self.fast_interval
+        elif self.__interval < self.normal_interval:
+            self.__interval = min(self.__interval * 2, self.normal_interval)
+        return messages
+
+    def is_fault(self) -> bool:
+        """
+        Checks if any status or alarm sensor reported an active fault in its last reading
+        """
+        for sensor, value in self.__values.items():
+            if sensor.is_fault(value):
+                return True
+        return False
+
+    def interval(self) -> int:
+        """
+        Returns the seconds until the alarm registers should be read again
+        """
+        return self.__interval
@@ -0,0 +1,946 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+# Benchmarks running on a PC against the logger simulator (CPython or MicroPython unix port):
+#   python3 mp_deye_bench.py <benchmark> [args]
+#
+#   pipeline [delay_ms] [cycles] [protocol]
+#       Poll cycle latency against pipeline window size, logger response delay defaults to 300 ms
+#
+#   control [delay_ms] [steps]
+#       Reaction latency of the zero export control loop, from grid meter message to written power limit
+#
+#   replay [cycles] [protocol]
+#       Captures poll cycles from the simulator, replays the capture file at full speed (frames/s, decode time)
+#       and checks the replayed sensor values against the live ones
+#
+#   hotpath [update] [time] [tolerance_percent]
+#       Time (us/call) and allocations of CRC, frame build, response parse and sensor decode: bytes per call on
+#       MicroPython, the traced peak of one call on CPython. Allocations are compared against the committed
+#       bench_baseline.json, exits with 1 on a regression. Timings depend on the machine, 'time' compares them
+#       too, after 'update' recorded a new baseline on the tree before a change. Baselines are kept per
+#       implementation (CPython, MicroPython).
+#
+#   selfcheck [cases] [seed]
+#       Property checks: CRC and request frames bit-exact with reference implementations, build/parse
+#       round trips over random register blocks on every transport, corrupted frames rejected, socket round trips
+#       of reads and writes against the logger simulator on every transport including exception, short frame and
+#       CRC responses, logger discovery against the UDP and logger simulators, the MQTT session against the broker
+#       simulator (in-flight window, queue drops, retransmits, pings, reconnect backoff, broker restart), sensor
+#       decode matching the register formulas. Exits with 1 on the first failure.
+#
+#   log
+#       Cost of log calls below the log level (inline check, deferred logger, eager formatting)
+#       and of records kept in the RAM ring
+#
+#   gateway [logger counts] [delay_ms] [shards]
+#       One poll round of the asyncio gateway over e.g. '10,100,300' simulated loggers (CPython only),
+#       reports wall time, CPU time and per logger poll latency
+#
+#   planner [delay_ms] [cycles] [groups]
+#       Poll cycle of the sensors of e.g. 'hybrid' or 'string,micro' read with different block plans:
+#       requests, registers read, registers read without a sensor and cycle time
+#
+#   http [concurrency] [requests] [groups]
+#       Load test of the /metrics and /state endpoint serving one poll cycle: requests/s, latency,
+#       logger requests caused by the scrapes (expected 0) and server allocations per request
+#
+#   wifi [outages] [outage_ms]
+#       Wi-Fi link supervisor on the host network shim: recovery time after access point outages,
+#       reconnect of the MQTT session without restart, and the give up after a permanent outage
+#
+#   cycle [cycles] [groups]
+#       Peak heap above the idle baseline of the decode-to-publish part of a poll cycle (HTTP update, derived
+#       metrics, MQTT publication to the broker simulator) and its time, with a new observation list per cycle
+#       and with the preallocated observation slots of the daemon
+
+import sys
+
+import mp_deye_host
+mp_deye_host.install()
+
+import time
+
+from mp_deye_connector import DeyeConnector
+from mp_deye_modbus import DeyeModbus
+from mp_deye_power_control import DeyePowerController
+from mp_deye_sensors import register_blocks
+from mp_deye_simulator import DeyeLoggerSimulator
+
+SIMULATOR_PORT = 18899
+
+def bench_pipeline(args):
+    delay_ms = int(args[0]) if len(args) > 0 else 300
+    cycles = int(args[1]) if len(args) > 1 else 5
+    protocol = args[2] if len(args) > 2 else 'solarman_v5'
+    simulator = DeyeLoggerSimulator(protocol, port=SIMULATOR_PORT, delay_ms=delay_ms)
+    simulator.start_in_thread()
+    print(f"Poll cycle of {len(register_blocks)} register blocks, {protocol}, logger delay {delay_ms} ms")
+    print("window  cycle ms  requests")
+    try:
+        for window in range(1, len(register_blocks) + 1):
+            config = mp_deye_host.local_config(SIMULATOR_PORT, protocol)
+            config.logger.pipeline_window = window
+            modbus = DeyeModbus(config, DeyeConnector(config))
+            requests = simulator.requests
+            start = time.ticks_ms()
+            for _ in range(cycles):
+                result = modbus.read_blocks(register_blocks)
+                if not result.is_complete():
+                    print(f"Cycle incomplete: {result.status()}")
+            elapsed = time.ticks_diff(time.ticks_ms(), start)
+            print(f"{window:6d}  {elapsed / cycles:8.1f}  {(simulator.requests - requests) // cycles:8d}")
+    finally:
+        simulator.stop()
+
+def bench_control(args):
+    delay_ms = int(args[0]) if len(args) > 0 else 300
+    steps = int(args[1]) if len(args) > 1 else 10
+    simulator = DeyeLoggerSimulator(port=SIMULATOR_PORT, delay_ms=delay_ms)
+    simulator.start_in_thread()
+    config = mp_deye_host.local_config(SIMULATOR_PORT)
+    config.power_control.min_write_interval = 0
+    controller = DeyePowerController(config, DeyeModbus(config, DeyeConnector(config)))
+    rated = config.power_control.rated_power
+    latencies = []
+    try:
+        for step in range(steps):
+            # Alternate between export and import, the simulated inverter follows the written limit
+            grid_power = -200 if step % 2 == 0 else 150
+            start = time.ticks_ms()
+            message = '{:.0f}'.format(grid_power).encode()
+            if controller.limit_percent is not None:
+                simulator.registers[0x56] = controller.limit_percent * rated // 10
+            controller.on_grid_message(b'meter/grid_power', message)
+            latencies.append(time.ticks_diff(time.ticks_ms(), start))
+    finally:
+        simulator.stop()
+    latencies.sort()
+    print(f"Zero export reaction, logger delay {delay_ms} ms, {controller.writes} writes in {steps} steps")
+    print(f"latency ms: min {latencies[0]}, median {latencies[len(latencies) // 2]}, max {latencies[-1]}")
+
+def bench_replay(args):
+    import os
+    from mp_deye_replay import DeyeReplay
+    from mp_deye_sensors import sensor_list
+    cycles = int(args[0]) if len(args) > 0 else 200
+    protocol = args[1] if len(args) > 1 else 'solarman_v5'
+    capture_file = 'bench_capture.bin'
+    if capture_file in os.listdir():
+        os.remove(capture_file)
+    simulator = DeyeLoggerSimulator(protocol, port=SIMULATOR_PORT)
+    simulator.start_in_thread()
+    config = mp_deye_host.local_config(SIMULATOR_PORT, protocol)
+    config.logger.pipeline_window = len(register_blocks)
+    config.capture_file = capture_file
+    config.capture_max_bytes = 1 << 24
+    connector = DeyeConnector(config)
+    modbus = DeyeModbus(config, connector)
+    live = []
+    try:
+        for cycle in range(cycles):
+            # Vary the readings, so every poll cycle decodes differently
+            simulator.registers[0x56] = cycle * 7 % 6000
+            simulator.registers[0x6d] = 300 + cycle % 100
+            result = modbus.read_blocks(register_blocks)
+            live.append(';'.join(f'{s.name}={s.format_value(v)}' for s in sorted(sensor_list, key=lambda s: s.name)
+                                 for v in [s.read_value(result.registers)] if v is not None))
+    finally:
+        connector.capture.close()
+        simulator.stop()
+    print(f"Captured {cycles} poll cycles, {protocol}, {os.stat(capture_file)[6]} bytes")
+    replay = DeyeReplay(config)
+    lines = replay.replay(capture_file)
+    replay.print_stats()
+    replayed = [line.split(' ', 1)[1] for line in lines]
+    print("Replayed values match live decode" if replayed == live else "Replayed values DIFFER from live decode")
+    os.remove(capture_file)
+
+BASELINE_FILE = 'bench_baseline.json'
+
+def measure_us(function, iterations: int) -> float:
+    """
+    Best of 5 runs, in us per call
+    """
+    best = None
+    for _ in range(5):
+        start = time.ticks_us()
+        for _ in range(iterations):
+            function()
+        elapsed = time.ticks_diff(time.ticks_us(), start)
+        best = elapsed if best is None else min(best, elapsed)
+    return best / iterations
+
+def measure_alloc(function, iterations: int) -> float:
+    """
+    Bytes allocated per call on MicroPython, traced peak of a single call on CPython
+    """
+    import gc
+    gc.collect()
+    if hasattr(gc, 'mem_alloc'):
+        gc.disable()
+        before = gc.mem_alloc()
+        for _ in range(iterations):
+            function()
+        allocated = gc.mem_alloc() - before
+        gc.enable()
+        return allocated / iterations
+    import tracemalloc
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def hotpath_cases() -> list:
+    """
+    (name, function, iterations) of the measured hot paths, with frames produced by the simulator
+    """
+    from mp_deye_transport import crc16_bytes
+    from mp_deye_sensors import sensor_list
+    data_64 = bytes(range(64))
+    data_256 = bytes(range(256))
+    cases = [
+        ('crc16 64B', lambda: crc16_bytes(data_64), 200),
+        ('crc16 256B', lambda: crc16_bytes(data_256), 50),
+    ]
+    registers = {}
+    for protocol in ('solarman_v5', 'modbus_tcp', 'rtu_over_tcp'):
+        config = mp_deye_host.local_config(0, protocol)
+        modbus = DeyeModbus(config, None)
+        simulator = DeyeLoggerSimulator(protocol, serial_number=None, port=0)
+        request = modbus.build_read_request(0x40, 0x4f, 1)
+        response = simulator.handle(None, bytes(request))
+        for block in register_blocks:
+            registers.update(modbus.parse_read_response(
+                simulator.handle(None, bytes(modbus.build_read_request(block[0], block[1], 1))), block[0], block[1]))
+        cases.append((f'build {protocol}', lambda m=modbus: m.build_read_request(0x40, 0x4f, 1), 200))
+        cases.append((f'parse {protocol} 16 regs', lambda m=modbus, r=response: m.parse_read_response(r, 0x40, 0x4f), 200))
+
+    def decode():
+        for sensor in sensor_list:
+            value = sensor.read_value(registers)
+            if value is not None:
+                sensor.format_value(value)
+    cases.append(('decode all sensors', decode, 50))
+    return cases
+
+def bench_hotpath(args):
+    import gc
+    import json
+    update = 'update' in args
+    timed = 'time' in args
+    numbers = [arg for arg in args if arg not in ('update', 'time')]
+    tolerance = int(numbers[0]) if numbers else 30
+    implementation = sys.implementation.name
+    results = {}
+    alloc_label = 'bytes/call' if hasattr(gc, 'mem_alloc') else 'peak bytes'
+    print(f"Hot path benchmark on {implementation}")
+    print(f"case                          us/call   {alloc_label}")
+    for name, function, iterations in hotpath_cases():
+        results[name] = {'us': round(measure_us(function, iterations), 2),
+                         'alloc': round(measure_alloc(function, iterations), 1)}
+        print(f"{name:28s}  {results[name]['us']:8.2f}  {results[name]['alloc']:10.1f}")
+
+    try:
+        with open(BASELINE_FILE) as f:
+            baselines = json.load(f)
+    except (OSError, ValueError):
+        baselines = {}
+    baseline = baselines.get(implementation)
+    if update or not baseline:
+        baselines[implementation] = results
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baselines, f)
+        print(f"Baseline for {implementation} written to {BASELINE_FILE}")
+        return
+    regressions = 0
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        if timed and result['us'] > baseline[name]['us'] * (100 + tolerance) / 100:
+            print(f"REGRESSION {name}: {result['us']:.2f} us/call, baseline {baseline[name]['us']:.2f}")
+            regressions += 1
+        # Allocations are deterministic, a small slack covers interpreter differences
+        if result['alloc'] > baseline[name]['alloc'] * 1.1 + 32:
+            print(f"REGRESSION {name}: {result['alloc']:.1f} {alloc_label}, baseline {baseline[name]['alloc']:.1f}")
+            regressions += 1
+    checked = f"time tolerance {tolerance}%" if timed else "allocations only"
+    if regressions:
+        print(f"{regressions} regression(s) against {BASELINE_FILE} ({checked})")
+        sys.exit(1)
+    print(f"No regressions against {BASELINE_FILE} ({checked})")
+
+def bench_log(args):
+    import ubinascii
+    from mp_deye_config import DEBUG, INFO, WARNING
+    from mp_deye_log import DeyeLogger
+    frame = bytes(range(64))
+    level = INFO
+    logger = DeyeLogger(INFO, WARNING, 16, console=False)
+
+    def inline_check():
+        if level <= DEBUG: print("DEBUG: Request frame: ", ubinascii.hexlify(frame))
+
+    cases = [
+        ('disabled, inline level check', inline_check),
+        ('disabled, deferred logger', lambda: logger.debug("Request frame: {}", frame)),
+        ('disabled, eager f-string', lambda: logger.debug(f"Request frame: {ubinascii.hexlify(frame)}")),
+        ('enabled, into RAM ring', lambda: logger.warning("Request frame: {}", frame)),
+    ]
+    print("log call                          us/call   bytes/call")
+    for name, function in cases:
+        print(f"{name:32s}  {measure_us(function, 1000):7.3f}  {measure_alloc(function, 1000):10.1f}")
+
+def reference_crc16(data) -> int:
+    """
+    Table driven Modbus CRC-16 (reflected polynomial 0xA001, initial value 0xFFFF), independent of crc16()
+    """
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    crc = 0xFFFF
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xff]
+    return crc
+
+def reference_v5_request(serial_number: int, sequence: int, modbus_frame) -> bytes:
+    """
+    Solarman V5 request frame assembled field by field, independent of DeyeSolarmanV5Transport
+    """
+    rtu = bytes(modbus_frame) + reference_crc16(modbus_frame).to_bytes(2, 'little')
+    payload = bytes([0x02]) + bytes(14) + rtu
+    frame = bytearray([0xa5]) + len(payload).to_bytes(2, 'little') + bytes([0x10, 0x45]) \
+        + sequence.to_bytes(2, 'little') + serial_number.to_bytes(4, 'little') + payload
+    frame += bytes([sum(frame[1:]) & 0xff, 0x15])
+    return bytes(frame)
+
+def bench_selfcheck(args):
+    import random
+    from mp_deye_error import DeyeError
+    from mp_deye_sensor import SingleRegisterSensor, DoubleRegisterSensor
+    from mp_deye_sensors import plan_register_blocks
+    from mp_deye_transport import crc16_bytes
+    import ubinascii
+    cases = int(args[0]) if len(args) > 0 else 500
+    random.seed(int(args[1]) if len(args) > 1 else 1)
+
+    def below(n):
+        return random.getrandbits(16) % n
+
+    def check(condition, message):
+        if not condition:
+            print(f"FAIL: {message}")
+            sys.exit(1)
+
+    check(reference_crc16(b'123456789') == 0x4B37, "reference CRC of the Modbus check string")
+    check(bytes(crc16_bytes(b'123456789')) == b'\x37\x4b', "crc16_bytes of the Modbus check string")
+    for _ in range(cases):
+        data = bytes(random.getrandbits(8) for _ in range(below(300)))
+        check(bytes(crc16_bytes(data)) == reference_crc16(data).to_bytes(2, 'little'),
+              f"crc16 of {len(data)} bytes {ubinascii.hexlify(data)}")
+    print(f"crc16: {cases} random frames bit-exact with the reference")
+
+    for protocol in ('solarman_v5', 'modbus_tcp', 'rtu_over_tcp'):
+        config = mp_deye_host.local_config(0, protocol, serial_number=random.getrandbits(32))
+        modbus = DeyeModbus(config, None)
+        simulator = DeyeLoggerSimulator(protocol, serial_number=None, port=0)
+        for _ in range(cases):
+            first_reg = below(0x10000 - 125)
+            last_reg = first_reg + below(125)
+            values = {reg: random.getrandbits(16) for reg in range(first_reg, last_reg + 1)}
+            simulator.registers = values
+            sequence = 1 + below(255)
+            request = modbus.build_read_request(first_reg, last_reg, sequence)
+            modbus_frame = bytes([config.logger.modbus_unit, 0x03]) + first_reg.to_bytes(2, 'big') \
+                + (last_reg - first_reg + 1).to_bytes(2, 'big')
+            check(bytes(modbus.transport.extract_request(request)) == modbus_frame,
+                  f"{protocol} request of {first_reg}-{last_reg} does not carry the Modbus frame")
+            if protocol == 'solarman_v5':
+                check(bytes(request) == reference_v5_request(config.logger.serial_number, sequence, modbus_frame),
+                      f"V5 request of {first_reg}-{last_reg} differs from the reference")
+            response = bytearray(simulator.handle(None, bytes(request)))
+            if modbus.transport.supports_pipelining:
+                check(modbus.transport.response_sequence(response) == sequence, f"{protocol} sequence not echoed")
+            check(modbus.transport.response_length(response) == len(response), f"{protocol} response length")
+            registers = modbus.parse_read_response(response, first_reg, last_reg)
+            check(len(registers) == len(values) and all(int.from_bytes(registers[reg], 'big') == value
+                                                        for reg, value in values.items()),
+                  f"{protocol} round trip of {first_reg}-{last_reg}")
+            if protocol != 'modbus_tcp':
+                # Flip one bit of the register data, the CRC has to catch it
+                rtu_start = 25 if protocol == 'solarman_v5' else 0
+                position = rtu_start + 3 + below(len(values) * 2)
+                response[position] ^= 1 << below(8)
+                try:
+                    modbus.parse_read_response(response, first_reg, last_reg)
+                    check(False, f"{protocol} corrupted response of {first_reg}-{last_reg} accepted")
+                except DeyeError:
+                    pass
+        print(f"{protocol}: {cases} random register blocks round trip, corruption detected")
+
+    from mp_deye_error import DeyeCrcError, DeyeFrameError, DeyeModbusExceptionError
+    for i, protocol in enumerate(('solarman_v5', 'modbus_tcp', 'rtu_over_tcp')):
+        config = mp_deye_host.local_config(SIMULATOR_PORT + 10 + i, protocol)
+        config.logger.retry_backoff_base_ms = config.logger.retry_backoff_max_ms = 10
+        config.logger.pipeline_window = 4
+        simulator = DeyeLoggerSimulator(protocol, config.logger.serial_number, port=config.logger.port)
+        simulator.start_in_thread()
+        try:
+            modbus = DeyeModbus(config, DeyeConnector(config))
+            values = {reg: random.getrandbits(16) for reg in range(0x100, 0x100 + 125)}
+            simulator.registers = dict(values)
+            registers = modbus.read_registers(0x100, 0x100 + 124)
+            check(all(int.from_bytes(registers[reg], 'big') == value for reg, value in values.items()),
+                  f"{protocol} read over the socket")
+            check(modbus.write_registers(0x110, [1, 2, 0xffff]) and
+                  [simulator.registers[reg] for reg in (0x110, 0x111, 0x112)] == [1, 2, 0xffff],
+                  f"{protocol} verified write over the socket")
+            blocks = [(0x100, 0x10f), (0x120, 0x12f), (0x140, 0x17c)]
+            result = modbus.read_blocks(blocks)
+            check(result.is_complete() and all(int.from_bytes(result.registers[reg], 'big') == simulator.registers[reg]
+                                               for reg in range(0x140, 0x17d)), f"{protocol} block read over the socket")
+
+            def fails(fault, error, request):
+                simulator.fault = fault
+                requests = simulator.requests
+                try:
+                    request()
+                    check(False, f"{protocol} response with fault '{fault}' accepted")
+                except DeyeError as e:
+                    check(isinstance(e, error), f"{protocol} fault '{fault}' raised {e.kind}, expected {error.kind}")
+                finally:
+                    simulator.fault = None
+                return simulator.requests - requests
+
+            for request in (lambda: modbus.read_registers(0x100, 0x101), lambda: modbus.write_register(0x110, 7)):
+                check(fails('exception', DeyeModbusExceptionError, request) == 1,
+                      f"{protocol} Modbus exception response retried")
+                check(modbus.circuit_breaker.failures == 0, f"{protocol} Modbus exception counted as logger failure")
+            check(fails('short', DeyeFrameError, lambda: modbus.read_registers(0x100, 0x17c))
+                  == config.logger.retry_attempts, f"{protocol} short frame not retried")
+            if protocol != 'modbus_tcp':
+                check(fails('crc', DeyeCrcError, lambda: modbus.read_registers(0x100, 0x101))
+                      == config.logger.retry_attempts, f"{protocol} CRC error not retried")
+            if modbus.transport.supports_pipelining:
+                # A logger garbling pipelined responses is read serially after two failed pipelined passes
+                simulator.fault = 'garbled'
+                for _ in range(2):
+                    modbus.circuit_breaker.reset()
+                    modbus.read_blocks(blocks)
+                simulator.fault = None
+                check(modbus.pipeline_window == 1, f"{protocol} pipelining kept for a garbled response stream")
+        finally:
+            simulator.stop()
+        print(f"{protocol}: socket round trips of reads and writes, exception, short frame and CRC responses")
+
+    from mp_deye_discovery import DeyeDiscovery
+    config = mp_deye_host.local_config(0, serial_number=0)
+    modbus = DeyeModbus(config, None)
+    probe = DeyeDiscovery(config).probe_request
+    check(bytes(modbus.transport.extract_request(probe))
+          == bytes(modbus.transport.extract_request(modbus.build_read_request(0, 0))),
+          "discovery probe carries a different Modbus frame than a read of register 0")
+    check(bytes(probe) == bytes(modbus.build_read_request(0, 0)), "discovery probe differs from a read of register 0")
+    print("discovery: probe request equal to a read of register 0 for serial 0")
+
+    from mp_deye_simulator import DeyeDiscoverySimulator
+    import os
+    port = SIMULATOR_PORT + 20
+    config = mp_deye_host.local_config(port)
+    config.logger.discovery_broadcast = '127.0.0.1'
+    config.logger.discovery_subnet = '127.0.0'
+    config.logger.discovery_cache = 'bench_discovery.json'
+    # Two loggers answering the probe of serial 0 and a Modbus TCP device on the logger port
+    loggers = {1001: '127.0.0.2', 1002: '127.0.0.3'}
+    servers = [DeyeLoggerSimulator('solarman_v5', serial_number, port=port, host=ip_address)
+               for serial_number, ip_address in loggers.items()]
+    servers.append(DeyeLoggerSimulator('modbus_tcp', port=port, host='127.0.0.4'))
+    udp = DeyeDiscoverySimulator({1001: '127.0.0.2'}, port=port)
+    udp.noise = [b'\xff\xfe\x00', b'not,a,logger']
+    for server in servers + [udp]:
+        server.start_in_thread()
+    try:
+        discovery = DeyeDiscovery(config, udp_port=port)
+        check(discovery.probe_udp(500) == {1001: '127.0.0.2'}, "UDP probe answers with noise on the port")
+        check(discovery.scan_tcp(f'127.0.0.{host}' for host in range(1, 9)) == loggers,
+              "TCP scan of two loggers and a Modbus TCP device")
+        check(discovery.locate(1001) == '127.0.0.2', "locate a logger answering the UDP probe")
+        check(discovery.locate(1002) == '127.0.0.3', "locate a logger by the subnet scan")
+        check(discovery.locate(1003) is None, "locate a missing logger")
+        check(discovery.cached_ip_address(1002) == '127.0.0.3', "located logger cached")
+    finally:
+        for server in servers + [udp]:
+            server.stop()
+        try:
+            os.remove(config.logger.discovery_cache)
+        except OSError:
+            pass
+    print("discovery: locate() by the UDP probe and by the subnet scan, noise and non-Solarman hosts ignored")
+
+    from mp_deye_config import DeyeMqttConfig
+    from mp_deye_mqtt_session import DeyeMqttSession
+    from mp_deye_simulator import DeyeMqttBrokerSimulator
+    port = SIMULATOR_PORT + 30
+    broker = DeyeMqttBrokerSimulator(port=port)
+    broker.start_in_thread()
+    config = DeyeMqttConfig('127.0.0.1', port, '', '', 'deye', keepalive=1, inflight_window=3, queue_size=5,
+                            retransmit_ms=200, reconnect_backoff_max_ms=2000)
+    session = DeyeMqttSession(config, 'selfcheck')
+    topics = []
+    broker.on_publish = lambda topic, payload: topics.append(topic)
+
+    def run(ms, until=lambda: False):
+        start = time.ticks_ms()
+        while time.ticks_diff(time.ticks_ms(), start) < ms and not until():
+            session.poll()
+            time.sleep_ms(10)
+
+    try:
+        check(session.connect(), "MQTT connect to the broker simulator")
+        broker.acknowledge = False
+        for i in range(10):
+            check(session.publish(f'deye/{i}', str(i)), "QoS 1 publication not queued")
+        run(100)
+        check(broker.published == 3, f"{broker.published} publications in flight, window is 3")
+        check(session.pending() == 8 and session.dropped == 2, "full queue does not drop its oldest publications")
+        run(300)
+        check(broker.duplicates == 3, f"{broker.duplicates} retransmits with the DUP flag, expected 3")
+        broker.acknowledge = True
+        check(session.flush(3000), "retransmitted publications not acknowledged")
+        # 0-2 went out right away, 8 and 9 pushed the oldest queued ones out
+        check(sorted(set(topics)) == [f'deye/{i}'.encode() for i in (0, 1, 2, 5, 6, 7, 8, 9)],
+              "published topics after the drops")
+
+        pings, reconnects = broker.pings, session.reconnects
+        run(800)
+        check(broker.pings > pings and session.reconnects == reconnects, "ping within the keepalive")
+        broker.silent = True
+        run(2000, lambda: session.reconnects > reconnects)
+        check(session.reconnects == reconnects + 1, "unanswered ping does not drop the connection")
+        broker.silent = False
+
+        # Broker restart with one publication in flight, refusing connections for a while after the restart
+        broker.acknowledge = False
+        session.publish('deye/restart', 'x')
+        run(50)
+        broker.stop()
+        time.sleep_ms(200)
+        broker = DeyeMqttBrokerSimulator(port=port)
+        broker.accept = False
+        broker.start_in_thread()
+        run(3000)
+        check(1 < broker.connects <= 5, f"{broker.connects} connect attempts in 3 s, expected a growing backoff")
+        broker.accept = True
+        run(3000, lambda: session.pending() == 0)
+        check(session.is_connected() and session.pending() == 0 and broker.duplicates == 1,
+              "publication in flight not retransmitted with the DUP flag after the broker restart")
+    finally:
+        session.disconnect()
+        broker.stop()
+    print("mqtt: in-flight window, queue drops, DUP retransmits, pings, reconnect backoff and broker restart")
+
+    for _ in range(cases):
+        reg_address = below(0x100)
+        low, high = random.getrandbits(16), random.getrandbits(16)
+        registers = {reg_address: low.to_bytes(2, 'big'), reg_address + 1: high.to_bytes(2, 'big')}
+        factor = (1 + below(1000)) / 100
+        single = SingleRegisterSensor('single', reg_address, factor)
+        double = DoubleRegisterSensor('double', reg_address, factor)
+        check(single.read_value(registers) == low * factor, f"single register sensor of {low}")
+        check(double.read_value(registers) == (high * 65536 + low) * factor, f"double register sensor of {high}, {low}")
+        check(double.read_value({reg_address: registers[reg_address]}) is None, "double register sensor with one register")
+        signed_low = low - 0x10000 if low >= 0x8000 else low
+        signed_double = high * 65536 + low
+        signed_double = signed_double - 0x100000000 if signed_double >= 0x80000000 else signed_double
+        check(SingleRegisterSensor('single', reg_address, factor, signed=True).read_value(registers)
+              == signed_low * factor, f"signed single register sensor of {low}")
+        check(DoubleRegisterSensor('double', reg_address, factor, signed=True).read_value(registers)
+              == signed_double * factor, f"signed double register sensor of {high}, {low}")
+    print(f"sensors: {cases} random register values decoded as specified")
+
+    for _ in range(cases):
+        sensors = [SingleRegisterSensor('single', below(0x400), 1) for _ in range(1 + below(40))]
+        max_gap, max_registers = below(32), 1 + below(125)
+        blocks = plan_register_blocks(sensors, max_gap, max_registers)
+        addresses = set(s.reg_address for s in sensors)
+        check(all(any(b[0] <= a <= b[1] for b in blocks) for a in addresses), "planned blocks miss a register")
+        check(all(b[1] - b[0] < max_registers and b[0] in addresses and b[1] in addresses for b in blocks),
+              f"planned block exceeds {max_registers} registers or starts/ends on an unused register")
+        check(all(blocks[i][1] < blocks[i + 1][0] for i in range(len(blocks) - 1)), "planned blocks overlap")
+    print(f"planner: {cases} random register maps covered within the gap and block size limits")
+
+    from mp_deye_derived import DeyeCounterDelta
+
+    def counted(daily, values):
+        counter = DeyeCounterDelta(SingleRegisterSensor('counter', 0, 0.1), daily)
+        for i, value in enumerate(values):
+            counter.add(value, i * 60000)
+        return round(counter.delta(), 3), counter.resets
+
+    # (daily, readings, expected energy, expected resets)
+    for daily, values, energy, resets in (
+            (False, [1000.0, 1000.1, 0.0, 1000.2], 0.2, 0),         # glitch to 0
+            (False, [1000.0, 1000.1, 6.5, 1000.2, 1000.3], 0.3, 0),  # torn read
+            (False, [1000.0, 999.9, 999.9, 1000.1], 0.1, 0),        # lower readings stay ignored
+            (True, [5.0, 5.1, 0.0, 5.2], 0.2, 0),                   # glitch to 0
+            (True, [5.0, 5.1, 0.0, 0.1, 0.3], 0.4, 1),              # midnight reset
+            (True, [5.0, 0.2, 0.1, 0.1, 0.4], 0.4, 1),              # reset with a lower second sample
+            (True, [5.0, 5.1, 0.0], 0.1, 0)):                       # reset not confirmed yet
+        check(counted(daily, values) == (energy, resets),
+              f"{'daily' if daily else 'lifetime'} counter {values}: {counted(daily, values)}, expected {energy}, {resets}")
+    print("derived: counter resets and glitches of daily and lifetime counters")
+    print("Selfcheck passed")
+
+def bench_planner(args):
+    from mp_deye_sensors import sensor_list, plan_register_blocks
+    delay_ms = int(args[0]) if len(args) > 0 else 100
+    cycles = int(args[1]) if len(args) > 1 else 5
+    groups = set(args[2].split(',')) if len(args) > 2 else {'hybrid'}
+    sensors = [s for s in sensor_list if s.in_any_group(groups)]
+    used = len(set(reg for s in sensors for reg in s.registers()))
+    plans = [('one block per register run', 0, 125), ('planned (defaults)', 16, 64),
+             ('gap 64', 64, 125), ('no gap limit', 0x10000, 125)]
+    simulator = DeyeLoggerSimulator(port=SIMULATOR_PORT, delay_ms=delay_ms)
+    simulator.start_in_thread()
+    print(f"Read plans for groups {','.join(sorted(groups))}: {len(sensors)} sensors on {used} registers, "
+          f"logger delay {delay_ms} ms")
+    print("plan                         blocks  registers  wasted  cycle ms")
+    try:
+        for name, max_gap, max_registers in plans:
+            blocks = plan_register_blocks(sensors, max_gap, max_registers)
+            read = sum(b[1] - b[0] + 1 for b in blocks)
+            config = mp_deye_host.local_config(SIMULATOR_PORT)
+            modbus = DeyeModbus(config, DeyeConnector(config))
+            start = time.ticks_ms()
+            for _ in range(cycles):
+                result = modbus.read_blocks(blocks)
+                if not result.is_complete():
+                    print(f"Cycle incomplete: {result.status()}")
+            elapsed = time.ticks_diff(time.ticks_ms(), start)
+            print(f"{name:28s} {len(blocks):6d}  {read:9d}  {read - used:6d}  {elapsed / cycles:8.1f}")
+    finally:
+        simulator.stop()
+
+def bench_http(args):
+    import gc
+    import select
+    import socket
+    from mp_deye_http import DeyeHttpServer
+    from mp_deye_observation import Observation
+    from mp_deye_sensors import sensor_list, plan_register_blocks
+    concurrency = int(args[0]) if len(args) > 0 else 4
+    total = int(args[1]) if len(args) > 1 else 1000
+    groups = set(args[2].split(',')) if len(args) > 2 else {'micro'}
+    simulator = DeyeLoggerSimulator(port=SIMULATOR_PORT)
+    simulator.start_in_thread()
+    config = mp_deye_host.local_config(SIMULATOR_PORT)
+    config.http_host = '127.0.0.1'
+    config.http_port = SIMULATOR_PORT + 1
+    config.http_max_clients = concurrency
+    sensors = [s for s in sensor_list if s.in_any_group(groups)]
+    try:
+        result = DeyeModbus(config, DeyeConnector(config)).read_blocks(plan_register_blocks(sensors))
+    finally:
+        simulator.stop()
+    logger_requests = simulator.requests
+    server = DeyeHttpServer(config)
+    server.update([Observation(s, None, v) for s in sensors for v in [s.read_value(result.registers)] if v is not None],
+                  result)
+    address = socket.getaddrinfo('127.0.0.1', config.http_port)[0][-1]
+    tracing = not hasattr(gc, 'mem_alloc')
+    if tracing:
+        import tracemalloc
+        tracemalloc.start()
+    allocated = 0
+
+    def serve():
+        # Bytes allocated by the server: exact on MicroPython, traced peak per call on CPython
+        nonlocal allocated
+        if tracing:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            server.poll()
+            allocated += tracemalloc.get_traced_memory()[1] - before
+        else:
+            before = gc.mem_alloc()
+            server.poll()
+            allocated += max(0, gc.mem_alloc() - before)
+
+    clients = {}
+    sizes = {}
+    latencies = []
+    started = 0
+    start = time.ticks_ms()
+    while len(latencies) < total:
+        while len(clients) < concurrency and started < total:
+            path = b'/metrics' if started % 2 == 0 else b'/state'
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.connect(address)
+            client.send(b'GET ' + path + b' HTTP/1.1\r\nHost: bench\r\nAccept: */*\r\n\r\n')
+            client.setblocking(False)
+            clients[client] = [path, b'', time.ticks_us()]
+            started += 1
+        serve()
+        for client in list(clients):
+            state = clients[client]
+            try:
+                data = client.recv(4096)
+            except OSError:
+                continue
+            if data:
+                state[1] += data
+                continue
+            latencies.append(time.ticks_diff(time.ticks_us(), state[2]))
+            sizes[state[0]] = len(state[1])
+            if not state[1].startswith(b'HTTP/1.0 200'):
+                print(f"Unexpected response to {state[0]}: {state[1][:40]}")
+            client.close()
+            del clients[client]
+    elapsed = time.ticks_diff(time.ticks_ms(), start)
+    server.close()
+    latencies.sort()
+    print(f"HTTP load test, {total} requests from {concurrency} concurrent clients, groups {','.join(sorted(groups))}")
+    print(f"document bytes: " + ", ".join(f"{path.decode()} {size}" for path, size in sorted(sizes.items())))
+    print(f"requests/s {total * 1000 / max(1, elapsed):.0f}, latency us: median {latencies[len(latencies) // 2]}, "
+          f"max {latencies[-1]}")
+    print(f"renders {server.renders}, logger requests during the test {simulator.requests - logger_requests}, "
+          f"server allocations {allocated / total:.0f} bytes/request")
+
+def bench_wifi(args):
+    import network
+    from mp_deye_mqtt_session import DeyeMqttSession
+    from mp_deye_simulator import DeyeMqttBrokerSimulator
+    from mp_deye_watchdog import DeyeWatchdog
+    from mp_deye_wifi import DeyeWifiSupervisor
+    outages = int(args[0]) if len(args) > 0 else 5
+    outage_ms = int(args[1]) if len(args) > 1 else 2000
+    broker = DeyeMqttBrokerSimulator(port=SIMULATOR_PORT + 2)
+    broker.start_in_thread()
+    config = mp_deye_host.local_config(SIMULATOR_PORT)
+    config.mqtt.host = '127.0.0.1'
+    config.mqtt.port = SIMULATOR_PORT + 2
+    config.wifi_ssid = network.WLAN(network.STA_IF).SSID.decode()
+    link = DeyeWifiSupervisor(config, DeyeWatchdog(config))
+    station = link.station
+
+    try:
+        start = time.ticks_ms()
+        link.connect()
+        print(f"Boot connect (scan, association, DHCP) {time.ticks_diff(time.ticks_ms(), start)} ms, "
+              f"cached channel {link.channel}, ip {link.ifconfig[0]}")
+        session = DeyeMqttSession(config.mqtt, 'bench-wifi')
+        session.connect()
+        link.on_restored = session.reconnect
+        print(f"{outages} access point outages of {outage_ms} ms")
+        print("outage  restored  recovery ms  overhead ms  connects  mqtt connected  mqtt reconnects")
+        for outage in range(outages):
+            connects = station.connects
+            station.outage(outage_ms)
+            restored = link.check()
+            print(f"{outage + 1:6d}  {str(restored):8s}  {link.last_recovery_ms:11d}  "
+                  f"{link.last_recovery_ms - outage_ms:11d}  {station.connects - connects:8d}  "
+                  f"{str(session.is_connected()):14s}  {session.reconnects:15d}")
+        station.outage(3600000)
+        start = time.ticks_ms()
+        restored = link.check()
+        print(f"Permanent outage: restored {restored} after {time.ticks_diff(time.ticks_ms(), start)} ms "
+              f"({link.attempts} attempts), the daemon resets the device in this case")
+    finally:
+        broker.stop()
+
+def bench_cycle(args):
+    import gc
+    from mp_deye_derived import DeyeDerivedMetrics
+    from mp_deye_http import DeyeHttpServer
+    from mp_deye_log import log
+    from mp_deye_mqtt import DeyeMqttClient
+    from mp_deye_observation import Observation, ObservationSlots
+    from mp_deye_sensors import sensor_list, plan_register_blocks
+    from mp_deye_simulator import DeyeMqttBrokerSimulator
+    from mp_deye_watchdog import DeyeWatchdog
+    cycles = int(args[0]) if len(args) > 0 else 20
+    groups = set(args[1].split(',')) if len(args) > 1 else {'micro'}
+    simulator = DeyeLoggerSimulator(port=SIMULATOR_PORT)
+    simulator.start_in_thread()
+    broker = DeyeMqttBrokerSimulator(port=SIMULATOR_PORT + 2)
+    broker.start_in_thread()
+    config = mp_deye_host.local_config(SIMULATOR_PORT)
+    config.mqtt.host = '127.0.0.1'
+    config.mqtt.port = SIMULATOR_PORT + 2
+    config.http_host = '127.0.0.1'
+    config.http_port = SIMULATOR_PORT + 1
+    config.derived_counters = {'day_energy': 'daily', 'total_energy': 'lifetime'}
+    sensors = [s for s in sensor_list if s.in_any_group(groups)]
+    tracing = not hasattr(gc, 'mem_alloc')
+    if tracing:
+        import tracemalloc
+
+    try:
+        result = DeyeModbus(config, DeyeConnector(config)).read_blocks(plan_register_blocks(sensors))
+        client = DeyeMqttClient(config, DeyeWatchdog(config))
+        server = DeyeHttpServer(config)
+        derived = DeyeDerivedMetrics(config, sensors)
+
+        def consume(observations):
+            server.update(observations, result)
+            derived.add(observations)
+            client.publish_observations(observations)
+
+        def cycle_list(ticks_ms):
+            # The daemon up to this change: a new observation per sensor, collected in a list.
+            # Only the decoding differs, both pipelines publish through the current drain based client.
+            observations = []
+            for sensor in sensors:
+                value = sensor.read_value(result.registers)
+                if value is not None:
+                    observation = Observation(sensor, ticks_ms, value)
+                    observations.append(observation)
+                    log.debug("Observation {}: {}", observation.sensor.name, observation.value_as_str)
+            consume(observations)
+
+        def cycle_slots(ticks_ms):
+            observations = slots[0]
+            observations.decode(result.registers, ticks_ms)
+            consume(observations)
+
+        slots = [None]
+        print(f"Decode to publish of {len(sensors)} sensors ({','.join(sorted(groups))}), {cycles} cycles, "
+              f"{'traced peak' if tracing else 'allocated with gc disabled'}")
+        print("pipeline  peak bytes  retained bytes  cycle ms median (min-max)")
+        for name, cycle in (('list', cycle_list), ('slots', cycle_slots)):
+            server.update([], result)
+            gc.collect()
+            if tracing:
+                tracemalloc.start()
+                base = tracemalloc.get_traced_memory()[0]
+            else:
+                base = gc.mem_alloc()
+            slots[0] = ObservationSlots(sensors) if cycle is cycle_slots else None
+            peak = 0
+            durations = []
+            for i in range(cycles):
+                if tracing:
+                    start = time.ticks_ms()
+                    cycle(i * 1000)
+                    durations.append(time.ticks_diff(time.ticks_ms(), start))
+                    peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+                else:
+                    gc.collect()
+                    gc.disable()
+                    start = time.ticks_ms()
+                    cycle(i * 1000)
+                    durations.append(time.ticks_diff(time.ticks_ms(), start))
+                    peak = max(peak, gc.mem_alloc() - base)
+                    gc.enable()
+            durations.sort()
+            gc.collect()
+            retained = (tracemalloc.get_traced_memory()[0] if tracing else gc.mem_alloc()) - base
+            if tracing:
+                tracemalloc.stop()
+            print(f"{name:8s}  {peak:10d}  {retained:14d}  {durations[len(durations) // 2]:4d} ({durations[0]}-{durations[-1]})")
+    finally:
+        simulator.stop()
+        broker.stop()
+
+def wait_for_port(port: int):
+    import socket
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except OSError:
+            time.sleep_ms(100)
+    raise OSError(f"Nothing listening on port {port}")
+
+def bench_gateway(args):
+    import copy
+    import os
+    import resource
+    import subprocess
+    from mp_deye_gateway import run_sharded
+    counts = [int(count) for count in args[0].split(',')] if len(args) > 0 else [10, 100, 300]
+    delay_ms = int(args[1]) if len(args) > 1 else 200
+    shards = int(args[2]) if len(args) > 2 else 1
+    broker_port = SIMULATOR_PORT + 1
+    # Simulators run in their own processes, so they do not count against the gateway CPU time
+    simulator_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mp_deye_simulator.py')
+    processes = [
+        subprocess.Popen([sys.executable, simulator_path, 'solarman_v5', str(SIMULATOR_PORT), str(delay_ms), 'any'],
+                         stdout=subprocess.DEVNULL),
+        subprocess.Popen([sys.executable, simulator_path, 'mqtt', str(broker_port)], stdout=subprocess.DEVNULL),
+    ]
+    try:
+        wait_for_port(SIMULATOR_PORT)
+        wait_for_port(broker_port)
+        config = mp_deye_host.local_config(SIMULATOR_PORT)
+        config.mqtt.host = '127.0.0.1'
+        config.mqtt.port = broker_port
+        config.data_read_inverval = 1
+        config.log_level = 40
+        print(f"Gateway poll round, {len(register_blocks)} register blocks per logger, logger delay {delay_ms} ms, "
+              f"{shards} shard(s), concurrency {config.gateway_concurrency}")
+        print("loggers   wall ms    cpu ms  p50 ms  p99 ms")
+        for count in counts:
+            loggers = []
+            for i in range(count):
+                logger = copy.copy(config.logger)
+                logger.serial_number = 3000000000 + i
+                loggers.append(logger)
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            start = time.ticks_ms()
+            latencies = sorted(run_sharded(config, loggers, shards, rounds=1))
+            elapsed = time.ticks_diff(time.ticks_ms(), start)
+            # Pool workers show up as children once they have been joined
+            cpu = sum(resource.getrusage(resource.RUSAGE_SELF)[:2]) - sum(usage[:2])
+            cpu += sum(resource.getrusage(resource.RUSAGE_CHILDREN)[:2]) - sum(children[:2])
+            p50 = latencies[len(latencies) // 2]
+            p99 = latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)]
+            print(f"{count:7d}  {elapsed:8d}  {cpu * 1000:8.0f}  {p50:6d}  {p99:6d}")
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+BENCHMARKS = {
+    'pipeline': bench_pipeline,
+    'control': bench_control,
+    'replay': bench_replay,
+    'hotpath': bench_hotpath,
+    'selfcheck': bench_selfcheck,
+    'log': bench_log,
+    'gateway': bench_gateway,
+    'planner': bench_planner,
+    'http': bench_http,
+    'wifi': bench_wifi,
+    'cycle': bench_cycle,
+}
+
+def main(args):
+    if not args or args[0] not in BENCHMARKS:
+        print("Usage: mp_deye_bench.py <" + "|".join(BENCHMARKS) + "> [args]")
+        sys.exit(1)
+    BENCHMARKS[args[0]](args[1:])
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
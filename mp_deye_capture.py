@@ -0,0 +1,119 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+import time
+
+try:
+    import ustruct as struct
+except ImportError:
+    import struct
+
+from mp_deye_log import log
+
+# Capture file: header 'DYCP', version, protocol name length, protocol name, then one record per exchange:
+# ticks_ms (uint32), time (uint32, seconds since the epoch of the platform), request length (uint16),
+# response length (uint16, 0 = no response), request frame, response frame. All integers little endian.
+CAPTURE_MAGIC = b'DYCP'
+CAPTURE_VERSION = 1
+RECORD_HEADER = '<IIHH'
+RECORD_HEADER_SIZE = 12
+
+class DeyeFrameCapture():
+    """
+    Appends the request and response frames exchanged with the logger to a capture file on flash or disk.
+    Capturing stops for good when the file reaches max_bytes, to protect the flash.
+    """
+
+    def __init__(self, path: str, max_bytes: int, protocol: str):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.protocol = protocol
+        self.__file = None
+        self.__size = 0
+        self.__full = False
+
+    def record(self, req_frame, resp_frame):
+        """
+        Appends one exchange, resp_frame is None or empty if the logger did not answer
+        """
+        if self.__full:
+            return
+        resp_frame = resp_frame or b''
+        try:
+            if self.__file is None:
+                self.__open()
+            length = RECORD_HEADER_SIZE + len(req_frame) + len(resp_frame)
+            if self.__size + length > self.max_bytes:
+                log.warning("Capture file {} is full, capturing stopped", self.path)
+                self.close()
+                self.__full = True
+                return
+            self.__file.write(struct.pack(RECORD_HEADER, time.ticks_ms() & 0xffffffff, int(time.time()) & 0xffffffff,
+                                          len(req_frame), len(resp_frame)))
+            self.__file.write(req_frame)
+            self.__file.write(resp_frame)
+            self.__size += length
+        except OSError as e:
+            log.error("Capture to {} failed: {}", self.path, e)
+            self.close()
+            self.__full = True
+
+    def flush(self):
+        if self.__file:
+            self.__file.flush()
+
+    def close(self):
+        if self.__file:
+            self.__file.close()
+            self.__file = None
+
+    def __open(self):
+        self.__file = open(self.path, 'ab')
+        self.__size = self.__file.seek(0, 2)
+        if self.__size == 0:
+            protocol = self.protocol.encode()
+            self.__file.write(CAPTURE_MAGIC + bytes([CAPTURE_VERSION, len(protocol)]) + protocol)
+            self.__size = 6 + len(protocol)
+
+
+def read_capture_header(f) -> str:
+    """
+    Reads the header of an open capture file and returns the logger protocol of the captured frames
+    """
+    header = f.read(6)
+    if len(header) < 6 or header[0:4] != CAPTURE_MAGIC:
+        raise ValueError("Not a capture file")
+    if header[4] != CAPTURE_VERSION:
+        raise ValueError(f"Unsupported capture file version {header[4]}")
+    return f.read(header[5]).decode()
+
+def read_capture_records(f):
+    """
+    Yields (ticks_ms, time, req_frame, resp_frame) for every record of an open capture file after its header
+    """
+    while True:
+        header = f.read(RECORD_HEADER_SIZE)
+        if len(header) < RECORD_HEADER_SIZE:
+            return
+        ticks_ms, timestamp, req_length, resp_length = struct.unpack(RECORD_HEADER, header)
+        req_frame = f.read(req_length)
+        resp_frame = f.read(resp_length)
+        if len(resp_frame) < resp_length:
+            # Truncated by a reset while writing
+            return
+        yield (ticks_ms, timestamp, req_frame, resp_frame)
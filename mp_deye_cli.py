@@ -22,6 +22,7 @@ import sys
 from mp_deye_config import DeyeConfig
 from mp_deye_connector import DeyeConnector
 from mp_deye_modbus import DeyeModbus
+from mp_deye_error import DeyeError
 
 
 class DeyeCli():
@@ -39,9 +40,10 @@ class DeyeCli():
 
     def read_register(self, args):
         reg_address = int(args[0])
-        registers = self.__modbus.read_registers(reg_address, reg_address)
-        if registers is None:
-            print(f"Error: no registers read")
+        try:
+            registers = self.__modbus.read_registers(reg_address, reg_address)
+        except DeyeError as e:
+            print(f"Error: no registers read ({e.kind}: {e})")
             sys.exit(1)
         if reg_address not in registers:
             print(f"Error: register {reg_address} not read")
@@ -57,11 +59,15 @@ class DeyeCli():
             print(f"Not enough arguments")
             sys.exit(1)
         reg_address = int(args[0])
-        reg_value = int(args[1])
-        if self.__modbus.write_register(reg_address, reg_value):
+        reg_values = [int(v) for v in args[1:]]
+        try:
+            if len(reg_values) == 1:
+                self.__modbus.write_register(reg_address, reg_values[0])
+            else:
+                self.__modbus.write_registers(reg_address, reg_values)
             print(f"Ok")
-        else:
-            print(f"Error")
+        except DeyeError as e:
+            print(f"Error ({e.kind}: {e})")
 
 
 def main():
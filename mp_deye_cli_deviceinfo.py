@@ -22,6 +22,8 @@ import sys
 from mp_deye_config import DeyeConfig
 from mp_deye_connector import DeyeConnector
 from mp_deye_modbus import DeyeModbus
+from mp_deye_error import DeyeError
+from mp_deye_log import log
 
 
 class DeyeCliDeviceInfo():
@@ -29,24 +31,24 @@ class DeyeCliDeviceInfo():
     def __init__(self, config: DeyeConfig):
         connector = DeyeConnector(config)
         self.__modbus = DeyeModbus(config, connector)
-        self.log_level = config.log_level
 
     def read_info(self):
         ser_no=''
         micro=False
         for reg_address in [0,2,3,4,5,6,7,16,17,18,20,40]:
-            registers = self.__modbus.read_registers(reg_address, reg_address)
-            if registers is None:
-                if self.log_level <= 40: print(f"ERROR: no registers read")
+            try:
+                registers = self.__modbus.read_registers(reg_address, reg_address)
+            except DeyeError as e:
+                log.error("no registers read ({}: {})", e.kind, e)
                 sys.exit(1)
             if reg_address not in registers:
-                if self.log_level <= 40: print(f"ERROR: register {reg_address} not read")
+                log.error("register {} not read", reg_address)
                 sys.exit(1)
             reg_bytes = registers[reg_address]
             reg_value_int = int.from_bytes(reg_bytes, 'big')
             low_byte = reg_bytes[1]
             high_byte = reg_bytes[0]
-            if self.log_level <= 10: print(f'DEBUG: reg_address: {reg_address} Result -> int: {reg_value_int}, lo_byte: {low_byte}, hi_byte: {high_byte}')
+            log.debug("reg_address: {} Result -> int: {}, lo_byte: {}, hi_byte: {}", reg_address, reg_value_int, low_byte, high_byte)
             if (reg_address == 0):
                 if (low_byte == 2): print("Stringing Inverter")
                 elif (low_byte == 3): print("Single-phase energy storage machine")
@@ -79,6 +81,7 @@ def main():
     ap_if.active(False)
     
     config = DeyeConfig.from_env()
+    log.configure(config)
     
     # Activate WLAN Connection
     station = network.WLAN(network.STA_IF)
@@ -0,0 +1,95 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+
+import time
+
+from mp_deye_config import DeyeConfig
+from mp_deye_watchdog import DeyeWatchdog
+from mp_deye_log import log
+
+# Seconds from the Unix epoch to the MicroPython epoch (2000-01-01) used by ntptime on the ESP8266
+EPOCH_2000_OFFSET = 946684800
+
+
+class DeyeClock():
+    """
+    Monotonic millisecond clock for stamping samples, with the wall clock derived from an NTP offset.
+
+    time.ticks_ms() wraps around (every 12.4 days on the ESP8266), so the elapsed ticks are accumulated into
+    a counter that only grows. The RTC is never read: it is not battery backed and drifts, instead sync()
+    asks an NTP server and stores the difference between its Unix time and the monotonic counter.
+    epoch_ms() is None until the first successful sync.
+    """
+
+    def __init__(self, config: DeyeConfig, watchdog: DeyeWatchdog):
+        self.watchdog = watchdog
+        self.ntp_host = config.ntp_host
+        self.sync_interval_ms = config.ntp_sync_interval * 1000
+        self.offset_ms = None
+        self.syncs = 0
+        self.__last_ticks = time.ticks_ms()
+        self.__monotonic_ms = 0
+        self.__next_sync_ms = 0
+
+    def ticks_ms(self) -> int:
+        """
+        Milliseconds since start, must be called at least once per ticks period
+        """
+        now = time.ticks_ms()
+        self.__monotonic_ms += time.ticks_diff(now, self.__last_ticks)
+        self.__last_ticks = now
+        return self.__monotonic_ms
+
+    def is_synced(self) -> bool:
+        return self.offset_ms is not None
+
+    def epoch_ms(self, ticks_ms: int):
+        """
+        Unix time in ms of a monotonic timestamp, None if the clock was never synced
+        """
+        return None if self.offset_ms is None else ticks_ms + self.offset_ms
+
+    def maybe_sync(self):
+        """
+        Syncs when the sync interval has passed, a failed sync is retried at the next call
+        """
+        if self.ntp_host and self.ticks_ms() >= self.__next_sync_ms:
+            self.sync()
+
+    def sync(self) -> bool:
+        import ntptime
+        ntptime.host = self.ntp_host
+        self.watchdog.start('ntp')
+        try:
+            start = self.ticks_ms()
+            seconds = ntptime.time()
+            # The answer arrived somewhere within the round trip, half of it is the best guess
+            ticks = (start + self.ticks_ms()) // 2
+        except OSError as e:
+            log.warning("NTP sync with {} failed: {}", self.ntp_host, e)
+            return False
+        finally:
+            self.watchdog.stop('ntp')
+        offset_ms = (seconds + EPOCH_2000_OFFSET) * 1000 - ticks
+        if self.offset_ms is not None:
+            log.info("NTP sync, clock corrected by {} ms", offset_ms - self.offset_ms)
+        self.offset_ms = offset_ms
+        self.syncs += 1
+        self.__next_sync_ms = ticks + self.sync_interval_ms
+        return True
@@ -20,17 +20,73 @@ import os
 DEYE_LOGGER_IP_ADDRESS='192.168.2.156'
 DEYE_LOGGER_PORT=8899
 DEYE_LOGGER_SERIAL_NUMBER=4175806782
+# Protocol spoken by the logger: 'solarman_v5' (Deye Wi-Fi logger, port 8899),
+# 'modbus_tcp' (MBAP header, port 502) or 'rtu_over_tcp' (raw RTU frames via an RS485 gateway)
+DEYE_LOGGER_PROTOCOL='solarman_v5'
+DEYE_LOGGER_MODBUS_UNIT=1
+# Number of register block requests sent back to back over one socket (1 = one request at a time).
+# Only used with 'solarman_v5' and 'modbus_tcp'. Falls back to 1 if the logger can not handle it.
+DEYE_LOGGER_PIPELINE_WINDOW=1
+# Read planning: registers of the active sensors are grouped into blocks of at most DEYE_LOGGER_MAX_BLOCK_REGISTERS
+# registers (Modbus allows 125, some loggers truncate longer frames). Up to DEYE_LOGGER_MAX_REGISTER_GAP unused
+# registers between two sensors are read along instead of starting a new request.
+DEYE_LOGGER_MAX_BLOCK_REGISTERS=64
+DEYE_LOGGER_MAX_REGISTER_GAP=16
+
+# Retry policy per logger request: attempts in total, jittered exponential backoff between them
+DEYE_LOGGER_RETRY_ATTEMPTS=3
+DEYE_LOGGER_RETRY_BACKOFF_BASE_MS=250
+DEYE_LOGGER_RETRY_BACKOFF_MAX_MS=2000
+# Circuit breaker: open after this many failed requests in a row, then probe the logger every N seconds
+DEYE_LOGGER_CIRCUIT_FAILURE_THRESHOLD=3
+DEYE_LOGGER_CIRCUIT_PROBE_INTERVAL=300
+
+# Discovery: after DEYE_LOGGER_DISCOVERY_FAILURES failed connects in a row the logger is searched by its serial number,
+# first with the Solarman UDP broadcast probe, then by scanning DEYE_LOGGER_PORT on every host of the /24 subnet.
+# The address found is cached on flash and used instead of DEYE_LOGGER_IP_ADDRESS.
+DEYE_LOGGER_DISCOVERY_ENABLE=False
+DEYE_LOGGER_DISCOVERY_FAILURES=3
+DEYE_LOGGER_DISCOVERY_BROADCAST='255.255.255.255'
+DEYE_LOGGER_DISCOVERY_SUBNET=''         # e.g. '192.168.2', empty = subnet of the Wi-Fi connection
+DEYE_LOGGER_DISCOVERY_CONCURRENCY=8     # connects in flight during the subnet scan
+DEYE_LOGGER_DISCOVERY_CACHE='deye_discovery.json'
+
+# Gateway mode (mp_deye_gateway.py on a Linux host) polls many loggers from one process.
+# Each entry is (serial_number, ip_address) or (serial_number, ip_address, port, protocol).
+# All other logger settings are taken from the DEYE_LOGGER_* options above.
+DEYE_GATEWAY_LOGGERS=[]
+DEYE_GATEWAY_CONCURRENCY=32             # logger connections open at the same time
+DEYE_GATEWAY_SHARDS=1                   # processes sharing the loggers, each with its own MQTT connection
+
+# Capture: appends every request and response frame exchanged with the logger to this file (empty = off).
+# Replay the file with mp_deye_replay.py. Capturing stops when the file reaches DEYE_CAPTURE_MAX_BYTES.
+DEYE_CAPTURE_FILE=''
+DEYE_CAPTURE_MAX_BYTES=262144
 
 MQTT_HOST='your-mqtt-server'
 MQTT_PORT=1883
 MQTT_USERNAME='user'
 MQTT_PASSWORD='password'
 MQTT_TOPIC_PREFIX='deye'
+MQTT_KEEPALIVE=60                       # s, the session pings the broker on its own, independent of the read interval
+MQTT_QOS=1                              # QoS of published metrics, 1 = retransmitted until the broker acknowledges
+MQTT_INFLIGHT_WINDOW=4                  # QoS 1 publications sent but not acknowledged yet
+MQTT_QUEUE_SIZE=64                      # QoS 1 publications waiting for a free slot or a reconnect, oldest dropped first
+MQTT_RETRANSMIT_MS=5000                 # unacknowledged QoS 1 publications are sent again after this time
+MQTT_RECONNECT_BACKOFF_MAX_MS=60000     # upper bound of the jittered exponential backoff between reconnect attempts
 
 WIFI_SSID = 'your-ssid'
 WIFI_PASSWORD = 'your-password'
+# A lost Wi-Fi link is reconnected in place with the cached BSSID and IP configuration. The device is only
+# reset when WIFI_RECONNECT_ATTEMPTS attempts of up to WIFI_RECONNECT_TIMEOUT_MS each failed.
+WIFI_RECONNECT_ATTEMPTS=6
+WIFI_RECONNECT_TIMEOUT_MS=5000
+WIFI_RECONNECT_BACKOFF_MAX_MS=8000      # upper bound of the doubling delay between attempts
 
 WDT_ENABLE=False
+# Deadline (seconds) per stage of a poll cycle. The watchdog is starved when a stage overruns its deadline.
+# The 'sleep' deadline is the allowed slack on top of DEYE_DATA_READ_INTERVAL.
+WDT_STAGE_DEADLINES={'connect': 10, 'request': 15, 'publish': 30, 'sleep': 5, 'discover': 90, 'wifi': 15, 'ntp': 5}
 
 CRITICAL = 50
 ERROR    = 40
@@ -40,17 +96,86 @@ DEBUG    = 10
 NOTSET   = 0
 
 LOG_LEVEL=INFO
+# Log records at or above LOG_RING_LEVEL are kept in a ring of LOG_RING_SIZE records in RAM and published
+# in batches to '<MQTT_TOPIC_PREFIX>/log' after every poll cycle. LOG_CONSOLE=False silences the UART output.
+LOG_RING_LEVEL=WARNING
+LOG_RING_SIZE=16
+LOG_CONSOLE=True
+
+# HTTP endpoint serving '/metrics' (Prometheus text format) and '/state' (JSON) of the last poll cycle.
+# Scrapes are answered from a cache and never cause requests to the logger.
+HTTP_ENABLE=False
+HTTP_HOST='0.0.0.0'
+HTTP_PORT=8080
+HTTP_BUFFER_SIZE=6144                   # bytes for both rendered documents, about 4.3 kB with the string and micro groups
+HTTP_MAX_CLIENTS=4                      # clients served at once, further ones are closed right away
+
+# Home Assistant MQTT discovery: retained configs of the active sensors under HA_DISCOVERY_PREFIX.
+# They are published only when their content hash differs from the one in HA_DISCOVERY_HASH_FILE on flash.
+HA_DISCOVERY_ENABLE=False
+HA_DISCOVERY_PREFIX='homeassistant'
+HA_DISCOVERY_HASH_FILE='deye_ha_discovery.hash'
+HA_DISCOVERY_BUFFER_SIZE=512            # bytes, holds the largest single config
 
-DEYE_DATA_READ_INTERVAL=300 # Do not exceed approx. 600sec, (300 = 5 Minutes is safe) else adapt MQTT keepalive im mp_deye_mqtt.py
+# Zero export control: holds grid export near a setpoint by adjusting the active power limit of the inverter.
+# The grid meter publishes its power on POWER_CONTROL_GRID_TOPIC in W, positive = import, negative = export.
+# The payload is a plain number or JSON, then POWER_CONTROL_GRID_JSON_KEY selects the value (e.g. 'ENERGY.Power').
+POWER_CONTROL_ENABLE=False
+POWER_CONTROL_GRID_TOPIC='meter/grid_power'
+POWER_CONTROL_GRID_JSON_KEY=''
+POWER_CONTROL_EXPORT_SETPOINT=0         # W of export to hold, 0 = zero export
+POWER_CONTROL_HYSTERESIS=50             # W of deviation from the setpoint tolerated without a write
+POWER_CONTROL_MIN_WRITE_INTERVAL=60     # s between two reads/writes, protects the EEPROM of the inverter
+POWER_CONTROL_RATED_POWER=600           # W, rated power of the inverter
+POWER_CONTROL_LIMIT_REGISTER=40         # Active power regulation register
+POWER_CONTROL_LIMIT_SCALE=1             # Register units per percent: 1 for micro, 10 for string inverters
+
+DEYE_DATA_READ_INTERVAL=300 # s between two poll cycles, the MQTT keepalive is handled independently (MQTT_KEEPALIVE)
 DEYE_METRIC_GROUPS={'micro'}
 
+# Status and alarm registers: read in every poll cycle and additionally every DEYE_ALARM_POLL_INTERVAL seconds
+# (0 = only in poll cycles). Changes are published right away to '<sensor topic>/event'. While a fault is
+# active they are read every DEYE_ALARM_FAST_INTERVAL seconds; after it cleared the interval doubles per read.
+DEYE_ALARM_POLL_INTERVAL=60
+DEYE_ALARM_FAST_INTERVAL=5
+
+# Aggregation: sample every DEYE_DATA_READ_INTERVAL, but publish only min/max/avg (and energy in Wh of the
+# DEYE_AGGREGATE_INTEGRATE power sensors) every DEYE_AGGREGATE_PUBLISH_EVERY samples.
+# E.g. DEYE_DATA_READ_INTERVAL=10 and DEYE_AGGREGATE_PUBLISH_EVERY=30 publishes every 5 minutes without missing peaks.
+DEYE_AGGREGATE_ENABLE=False
+DEYE_AGGREGATE_WINDOW=30                # samples per rolling window
+DEYE_AGGREGATE_PUBLISH_EVERY=30         # samples between two publications
+DEYE_AGGREGATE_INTEGRATE={'ac/ac_active_power', 'dc/dc_total_power'}
+
+# Derived metrics: energy since the last publication ('<topic>/delta', kWh) and the average power over that time
+# ('<topic>/power', W) of the DEYE_DERIVED_COUNTERS energy counters, inverter restarts detected from the uptime.
+# A daily counter going down (midnight, inverter restart) counts as reset once the next sample confirms it, lower
+# readings of a lifetime counter are ignored. Samples are stamped with a monotonic clock, the wall clock
+# ('timestamp', 'uptime/started', Unix seconds) is taken from NTP_HOST every NTP_SYNC_INTERVAL seconds ('' = no NTP).
+DEYE_DERIVED_ENABLE=False
+DEYE_DERIVED_COUNTERS={'day_energy': 'daily', 'total_energy': 'lifetime'}   # topic: 'daily' or 'lifetime' counter
+NTP_HOST=''                             # e.g. 'pool.ntp.org'
+NTP_SYNC_INTERVAL=3600
+
 class DeyeMqttConfig():
-    def __init__(self, host: str, port: int, username: str, password: str, topic_prefix: str):
+    def __init__(self, host: str, port: int, username: str, password: str, topic_prefix: str,
+                 keepalive: int = 60,
+                 qos: int = 1,
+                 inflight_window: int = 4,
+                 queue_size: int = 64,
+                 retransmit_ms: int = 5000,
+                 reconnect_backoff_max_ms: int = 60000):
         self.host = host
         self.port = port
         self.username = username
         self.password = password
         self.topic_prefix = topic_prefix
+        self.keepalive = keepalive
+        self.qos = qos
+        self.inflight_window = inflight_window
+        self.queue_size = queue_size
+        self.retransmit_ms = retransmit_ms
+        self.reconnect_backoff_max_ms = reconnect_backoff_max_ms
 
     @staticmethod
     def from_env():
@@ -59,7 +184,13 @@ class DeyeMqttConfig():
             port=int(MQTT_PORT),
             username=MQTT_USERNAME,
             password=MQTT_PASSWORD,
-            topic_prefix=MQTT_TOPIC_PREFIX
+            topic_prefix=MQTT_TOPIC_PREFIX,
+            keepalive=int(MQTT_KEEPALIVE),
+            qos=int(MQTT_QOS),
+            inflight_window=int(MQTT_INFLIGHT_WINDOW),
+            queue_size=int(MQTT_QUEUE_SIZE),
+            retransmit_ms=int(MQTT_RETRANSMIT_MS),
+            reconnect_backoff_max_ms=int(MQTT_RECONNECT_BACKOFF_MAX_MS),
         )
 
 
@@ -71,10 +202,42 @@ class DeyeLoggerConfig():
     with the device.
     """
 
-    def __init__(self, serial_number: int, ip_address: str, port: int):
+    def __init__(self, serial_number: int, ip_address: str, port: int,
+                 protocol: str = 'solarman_v5',
+                 modbus_unit: int = 1,
+                 pipeline_window: int = 1,
+                 max_block_registers: int = 64,
+                 max_register_gap: int = 16,
+                 retry_attempts: int = 3,
+                 retry_backoff_base_ms: int = 250,
+                 retry_backoff_max_ms: int = 2000,
+                 circuit_failure_threshold: int = 3,
+                 circuit_probe_interval: int = 300,
+                 discovery_enable: bool = False,
+                 discovery_failures: int = 3,
+                 discovery_broadcast: str = '255.255.255.255',
+                 discovery_subnet: str = '',
+                 discovery_concurrency: int = 8,
+                 discovery_cache: str = 'deye_discovery.json'):
         self.serial_number = serial_number
         self.ip_address = ip_address
         self.port = port
+        self.protocol = protocol
+        self.modbus_unit = modbus_unit
+        self.pipeline_window = pipeline_window
+        self.max_block_registers = min(max_block_registers, 125)
+        self.max_register_gap = max_register_gap
+        self.retry_attempts = retry_attempts
+        self.retry_backoff_base_ms = retry_backoff_base_ms
+        self.retry_backoff_max_ms = retry_backoff_max_ms
+        self.circuit_failure_threshold = circuit_failure_threshold
+        self.circuit_probe_interval = circuit_probe_interval
+        self.discovery_enable = discovery_enable
+        self.discovery_failures = discovery_failures
+        self.discovery_broadcast = discovery_broadcast
+        self.discovery_subnet = discovery_subnet
+        self.discovery_concurrency = discovery_concurrency
+        self.discovery_cache = discovery_cache
 
     @staticmethod
     def from_env():
@@ -82,30 +245,188 @@ class DeyeLoggerConfig():
             serial_number=int(DEYE_LOGGER_SERIAL_NUMBER),
             ip_address=DEYE_LOGGER_IP_ADDRESS,
             port=int(DEYE_LOGGER_PORT),
+            protocol=DEYE_LOGGER_PROTOCOL,
+            modbus_unit=int(DEYE_LOGGER_MODBUS_UNIT),
+            pipeline_window=int(DEYE_LOGGER_PIPELINE_WINDOW),
+            max_block_registers=int(DEYE_LOGGER_MAX_BLOCK_REGISTERS),
+            max_register_gap=int(DEYE_LOGGER_MAX_REGISTER_GAP),
+            retry_attempts=int(DEYE_LOGGER_RETRY_ATTEMPTS),
+            retry_backoff_base_ms=int(DEYE_LOGGER_RETRY_BACKOFF_BASE_MS),
+            retry_backoff_max_ms=int(DEYE_LOGGER_RETRY_BACKOFF_MAX_MS),
+            circuit_failure_threshold=int(DEYE_LOGGER_CIRCUIT_FAILURE_THRESHOLD),
+            circuit_probe_interval=int(DEYE_LOGGER_CIRCUIT_PROBE_INTERVAL),
+            discovery_enable=DEYE_LOGGER_DISCOVERY_ENABLE,
+            discovery_failures=int(DEYE_LOGGER_DISCOVERY_FAILURES),
+            discovery_broadcast=DEYE_LOGGER_DISCOVERY_BROADCAST,
+            discovery_subnet=DEYE_LOGGER_DISCOVERY_SUBNET,
+            discovery_concurrency=int(DEYE_LOGGER_DISCOVERY_CONCURRENCY),
+            discovery_cache=DEYE_LOGGER_DISCOVERY_CACHE,
+        )
+
+    @staticmethod
+    def gateway_from_env():
+        """
+        Configurations of all loggers polled in gateway mode
+        """
+        loggers = []
+        for entry in DEYE_GATEWAY_LOGGERS:
+            logger = DeyeLoggerConfig.from_env()
+            logger.serial_number = int(entry[0])
+            logger.ip_address = entry[1]
+            if len(entry) > 2:
+                logger.port = int(entry[2])
+            if len(entry) > 3:
+                logger.protocol = entry[3]
+            loggers.append(logger)
+        return loggers
+
+
+class DeyePowerControlConfig():
+    """
+    Settings of the zero export power limit control loop
+    """
+
+    def __init__(self, enable: bool, grid_topic: str, grid_json_key: str, export_setpoint: int, hysteresis: int,
+                 min_write_interval: int, rated_power: int, limit_register: int, limit_scale: int):
+        self.enable = enable
+        self.grid_topic = grid_topic
+        self.grid_json_key = grid_json_key
+        self.export_setpoint = export_setpoint
+        self.hysteresis = hysteresis
+        self.min_write_interval = min_write_interval
+        self.rated_power = rated_power
+        self.limit_register = limit_register
+        self.limit_scale = limit_scale
+
+    @staticmethod
+    def from_env():
+        return DeyePowerControlConfig(
+            enable=POWER_CONTROL_ENABLE,
+            grid_topic=POWER_CONTROL_GRID_TOPIC,
+            grid_json_key=POWER_CONTROL_GRID_JSON_KEY,
+            export_setpoint=int(POWER_CONTROL_EXPORT_SETPOINT),
+            hysteresis=int(POWER_CONTROL_HYSTERESIS),
+            min_write_interval=int(POWER_CONTROL_MIN_WRITE_INTERVAL),
+            rated_power=int(POWER_CONTROL_RATED_POWER),
+            limit_register=int(POWER_CONTROL_LIMIT_REGISTER),
+            limit_scale=int(POWER_CONTROL_LIMIT_SCALE)
         )
 
 
 class DeyeConfig():
     def __init__(self, logger_config: DeyeLoggerConfig, mqtt: DeyeMqttConfig,
                  log_level=INFO,
+                 log_ring_level=WARNING,
+                 log_ring_size=16,
+                 log_console=True,
                  wifi_ssid='',
                  wifi_pwd='',
+                 wifi_reconnect_attempts=6,
+                 wifi_reconnect_timeout_ms=5000,
+                 wifi_reconnect_backoff_max_ms=8000,
                  wdt_enable=False,
+                 wdt_stage_deadlines=WDT_STAGE_DEADLINES,
                  data_read_inverval=60,
-                 metric_groups=[]):
+                 metric_groups=[],
+                 alarm_poll_interval=60,
+                 alarm_fast_interval=5,
+                 aggregate_enable=False,
+                 aggregate_window=30,
+                 aggregate_publish_every=30,
+                 aggregate_integrate=set(),
+                 derived_enable=False,
+                 derived_counters={},
+                 ntp_host='',
+                 ntp_sync_interval=3600,
+                 gateway_concurrency=32,
+                 gateway_shards=1,
+                 capture_file='',
+                 capture_max_bytes=262144,
+                 http_enable=False,
+                 http_host='0.0.0.0',
+                 http_port=8080,
+                 http_buffer_size=6144,
+                 http_max_clients=4,
+                 ha_discovery_enable=False,
+                 ha_discovery_prefix='homeassistant',
+                 ha_discovery_hash_file='deye_ha_discovery.hash',
+                 ha_discovery_buffer_size=512,
+                 power_control: DeyePowerControlConfig = None):
         self.logger = logger_config
         self.mqtt = mqtt
         self.log_level = log_level
+        self.log_ring_level = log_ring_level
+        self.log_ring_size = log_ring_size
+        self.log_console = log_console
         self.wifi_ssid=WIFI_SSID
         self.wifi_pwd=WIFI_PASSWORD
+        self.wifi_reconnect_attempts = wifi_reconnect_attempts
+        self.wifi_reconnect_timeout_ms = wifi_reconnect_timeout_ms
+        self.wifi_reconnect_backoff_max_ms = wifi_reconnect_backoff_max_ms
         self.wdt_enable=WDT_ENABLE
+        self.wdt_stage_deadlines = wdt_stage_deadlines
         self.data_read_inverval = data_read_inverval
         self.metric_groups = metric_groups
+        self.alarm_poll_interval = alarm_poll_interval
+        self.alarm_fast_interval = alarm_fast_interval
+        self.aggregate_enable = aggregate_enable
+        self.aggregate_window = aggregate_window
+        self.aggregate_publish_every = aggregate_publish_every
+        self.aggregate_integrate = aggregate_integrate
+        self.derived_enable = derived_enable
+        self.derived_counters = derived_counters
+        self.ntp_host = ntp_host
+        self.ntp_sync_interval = ntp_sync_interval
+        self.gateway_concurrency = gateway_concurrency
+        self.gateway_shards = gateway_shards
+        self.capture_file = capture_file
+        self.capture_max_bytes = capture_max_bytes
+        self.http_enable = http_enable
+        self.http_host = http_host
+        self.http_port = http_port
+        self.http_buffer_size = http_buffer_size
+        self.http_max_clients = http_max_clients
+        self.ha_discovery_enable = ha_discovery_enable
+        self.ha_discovery_prefix = ha_discovery_prefix
+        self.ha_discovery_hash_file = ha_discovery_hash_file
+        self.ha_discovery_buffer_size = ha_discovery_buffer_size
+        self.power_control = power_control if power_control else DeyePowerControlConfig.from_env()
 
     @staticmethod
     def from_env():
         return DeyeConfig(DeyeLoggerConfig.from_env(), DeyeMqttConfig.from_env(),
                           log_level=LOG_LEVEL,
+                          log_ring_level=LOG_RING_LEVEL,
+                          log_ring_size=int(LOG_RING_SIZE),
+                          log_console=LOG_CONSOLE,
+                          wifi_reconnect_attempts=int(WIFI_RECONNECT_ATTEMPTS),
+                          wifi_reconnect_timeout_ms=int(WIFI_RECONNECT_TIMEOUT_MS),
+                          wifi_reconnect_backoff_max_ms=int(WIFI_RECONNECT_BACKOFF_MAX_MS),
+                          wdt_stage_deadlines=WDT_STAGE_DEADLINES,
                           data_read_inverval=int(DEYE_DATA_READ_INTERVAL),
-                          metric_groups=DEYE_METRIC_GROUPS
+                          metric_groups=DEYE_METRIC_GROUPS,
+                          alarm_poll_interval=int(DEYE_ALARM_POLL_INTERVAL),
+                          alarm_fast_interval=int(DEYE_ALARM_FAST_INTERVAL),
+                          aggregate_enable=DEYE_AGGREGATE_ENABLE,
+                          aggregate_window=int(DEYE_AGGREGATE_WINDOW),
+                          aggregate_publish_every=int(DEYE_AGGREGATE_PUBLISH_EVERY),
+                          aggregate_integrate=DEYE_AGGREGATE_INTEGRATE,
+                          derived_enable=DEYE_DERIVED_ENABLE,
+                          derived_counters=DEYE_DERIVED_COUNTERS,
+                          ntp_host=NTP_HOST,
+                          ntp_sync_interval=int(NTP_SYNC_INTERVAL),
+                          gateway_concurrency=int(DEYE_GATEWAY_CONCURRENCY),
+                          gateway_shards=int(DEYE_GATEWAY_SHARDS),
+                          capture_file=DEYE_CAPTURE_FILE,
+                          capture_max_bytes=int(DEYE_CAPTURE_MAX_BYTES),
+                          http_enable=HTTP_ENABLE,
+                          http_host=HTTP_HOST,
+                          http_port=int(HTTP_PORT),
+                          http_buffer_size=int(HTTP_BUFFER_SIZE),
+                          http_max_clients=int(HTTP_MAX_CLIENTS),
+                          ha_discovery_enable=HA_DISCOVERY_ENABLE,
+                          ha_discovery_prefix=HA_DISCOVERY_PREFIX,
+                          ha_discovery_hash_file=HA_DISCOVERY_HASH_FILE,
+                          ha_discovery_buffer_size=int(HA_DISCOVERY_BUFFER_SIZE),
+                          power_control=DeyePowerControlConfig.from_env()
                           )
@@ -16,54 +16,146 @@
 # under the License.
 
 import socket
-import ubinascii
-from machine import WDT
+import time
 
+from mp_deye_capture import DeyeFrameCapture
 from mp_deye_config import DeyeConfig
+from mp_deye_discovery import DeyeDiscovery
+from mp_deye_error import DeyeTimeoutError, DeyeConnectError
+from mp_deye_watchdog import DeyeWatchdog
+from mp_deye_log import log
 
 class DeyeConnector:
 
-    def __init__(self, config: DeyeConfig):
-        self.log_level = config.log_level
-        self.wdt_enable = config.wdt_enable
+    def __init__(self, config: DeyeConfig, watchdog: DeyeWatchdog = None):
         self.config = config.logger
+        self.watchdog = watchdog if watchdog else DeyeWatchdog(config)
+        self.capture = None
+        if config.capture_file:
+            self.capture = DeyeFrameCapture(config.capture_file, config.capture_max_bytes, self.config.protocol)
+        self.discovery = None
+        self.__connect_failures = 0
+        # Discovery identifies loggers by the serial number in the Solarman V5 header
+        if self.config.discovery_enable and self.config.protocol == 'solarman_v5':
+            self.discovery = DeyeDiscovery(config, self.watchdog)
+            ip_address = self.discovery.cached_ip_address(self.config.serial_number)
+            if ip_address:
+                self.config.ip_address = ip_address
 
     def send_request(self, req_frame):
-        for res in socket.getaddrinfo(self.config.ip_address, self.config.port, socket.AF_INET, socket.SOCK_STREAM):
-            family, socktype, proto, canonname, sockadress = res
-            if self.wdt_enable: wdt = WDT()
-            try:
-                client_socket = socket.socket(family, socktype, proto)
-                client_socket.settimeout(10)
-                if self.wdt_enable: wdt.feed()
-                client_socket.connect(sockadress)
-            except: 
-                if self.log_level <= 30: print("WARN: Could not open socket on IP ", self.config.ip_address)
-                client_socket.close()
-                return
+        client_socket = self.__connect()
 
-            if self.log_level <= 10: print("DEBUG: Request frame: ", ubinascii.hexlify(req_frame))
-            if self.wdt_enable: wdt.feed()
+        log.debug("Request frame: {}", req_frame)
+        self.watchdog.start('request')
+        try:
             client_socket.sendall(req_frame)
+            # Short socket timeouts keep the watchdog fed, the stage deadline bounds the total wait
+            while not self.watchdog.expired('request'):
+                self.watchdog.feed()
+                try:
+                    data = client_socket.recv(1024)
+                    log.debug("Response frame: {}", data)
+                    if self.capture:
+                        self.capture.record(req_frame, data)
+                        self.capture.flush()
+                    return data
+                except OSError:
+                    pass
+        except OSError as e:
+            raise DeyeTimeoutError(f"Connection error (send_request): {e}")
+        finally:
+            client_socket.close()
+            self.watchdog.stop('request')
+
+        if self.capture:
+            self.capture.record(req_frame, None)
+            self.capture.flush()
+        raise DeyeTimeoutError("No response within the request deadline")
 
-            attempts = 5
-            while (attempts > 0):
-                if self.wdt_enable: wdt.feed()
-                attempts = attempts - 1
+    def send_requests(self, requests: list, transport, window: int) -> dict:
+        """
+        Sends (sequence, frame) requests over a single socket with up to 'window' requests in flight.
+        Responses are split from the stream with the transport and returned as a dict by sequence.
+        Responses missing when the request deadline passes are absent from the result.
+        """
+        client_socket = self.__connect()
+
+        responses = {}
+        buffer = bytearray()
+        next_request = 0
+        in_flight = 0
+        self.watchdog.start('request')
+        try:
+            while len(responses) < len(requests):
+                while next_request < len(requests) and in_flight < window:
+                    req_frame = requests[next_request][1]
+                    log.debug("Request frame: {}", req_frame)
+                    client_socket.sendall(req_frame)
+                    next_request += 1
+                    in_flight += 1
+                if self.watchdog.expired('request'):
+                    log.warning("{} responses missing (send_requests)", len(requests) - len(responses))
+                    break
+                self.watchdog.feed()
                 try:
                     data = client_socket.recv(1024)
+                except OSError:
+                    continue
+                if not data:
+                    break
+                buffer += data
+                length = transport.response_length(buffer)
+                while length is not None and len(buffer) >= length:
+                    resp_frame = buffer[:length]
+                    buffer = buffer[length:]
+                    log.debug("Response frame: {}", resp_frame)
+                    responses[transport.response_sequence(resp_frame)] = resp_frame
+                    in_flight -= 1
+                    # Deadline applies per response, a batch may take several round trips
+                    self.watchdog.start('request')
+                    length = transport.response_length(buffer)
+        except OSError as e:
+            raise DeyeTimeoutError(f"Connection error (send_requests): {e}")
+        finally:
+            client_socket.close()
+            self.watchdog.stop('request')
+            if self.capture:
+                for sequence, req_frame in requests[:next_request]:
+                    self.capture.record(req_frame, responses.get(sequence))
+                self.capture.flush()
+
+        return responses
+
+    def __connect(self):
+        self.watchdog.start('connect')
+        try:
+            for res in socket.getaddrinfo(self.config.ip_address, self.config.port, socket.AF_INET, socket.SOCK_STREAM):
+                family, socktype, proto, canonname, sockadress = res
+                while not self.watchdog.expired('connect'):
+                    client_socket = socket.socket(family, socktype, proto)
+                    client_socket.settimeout(1)
                     try:
-                        data
-                    except:
-                        if self.log_level <= 30: print("WARN: No data received")
-                    if self.log_level <= 10: print("DEBUG: Response frame: ", ubinascii.hexlify(data))
-                    if self.wdt_enable: wdt.feed()
-                    client_socket.close()
-                    return data
-                except:
-                    if self.log_level <= 30: print("WARN: Connection timeout/error (send_request)")
+                        client_socket.connect(sockadress)
+                        self.__connect_failures = 0
+                        return client_socket
+                    except OSError:
+                        client_socket.close()
+                    self.watchdog.feed()
+                    time.sleep(1)
+        except OSError:
+            pass
+        finally:
+            self.watchdog.stop('connect')
+        ip_address = self.config.ip_address
+        self.__connect_failures += 1
+        if self.discovery and self.__connect_failures >= self.config.discovery_failures:
+            self.__rediscover()
+        raise DeyeConnectError(f"Could not open socket on IP {ip_address}")
 
-        if self.wdt_enable: wdt.feed()
-        client_socket.close()
-        
-        return bytearray()
+    def __rediscover(self):
+        self.__connect_failures = 0
+        log.warning("Logger not reachable on IP {}, starting discovery", self.config.ip_address)
+        ip_address = self.discovery.locate(self.config.serial_number)
+        if ip_address and ip_address != self.config.ip_address:
+            log.info("Logger moved to IP {}", ip_address)
+            self.config.ip_address = ip_address
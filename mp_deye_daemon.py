@@ -15,70 +15,177 @@
 # specific language governing permissions and limitations
 # under the License.
 
-import sys
 import time
 import network
 import gc
 import machine
-from machine import WDT
 
 from mp_deye_config import DeyeConfig
+from mp_deye_watchdog import DeyeWatchdog
 from mp_deye_connector import DeyeConnector
 from mp_deye_modbus import DeyeModbus
-from mp_deye_sensors import sensor_list
+from mp_deye_sensors import sensor_list, plan_register_blocks
 from mp_deye_mqtt import DeyeMqttClient
-from mp_deye_observation import Observation
+from mp_deye_observation import ObservationSlots
+from mp_deye_clock import DeyeClock
+from mp_deye_log import log
 
 
 class DeyeDaemon():
-    
-    def __init__(self, config: DeyeConfig):
+    """
+    Feature modules are imported only when enabled, their bytecode would otherwise stay on the heap
+    """
+
+    def __init__(self, config: DeyeConfig, watchdog: DeyeWatchdog, link=None):
         self.__config = config
-        self.log_level = config.log_level
-        self.wdt_enable = config.wdt_enable
-        self.mqtt_client = DeyeMqttClient(config)
-        connector = DeyeConnector(config)
+        self.watchdog = watchdog
+        self.link = link
+        self.mqtt_client = DeyeMqttClient(config, watchdog)
+        connector = DeyeConnector(config, watchdog)
         self.modbus = DeyeModbus(config, connector)
         self.sensors = [s for s in sensor_list if s.in_any_group(self.__config.metric_groups)]
+        self.blocks = plan_register_blocks(self.sensors, config.logger.max_register_gap, config.logger.max_block_registers)
+        self.alarm_blocks = plan_register_blocks([s for s in self.sensors if s.is_status()],
+                                                 config.logger.max_register_gap, config.logger.max_block_registers)
+        self.clock = DeyeClock(config, watchdog)
+        self.observations = ObservationSlots(self.sensors)
+        self.aggregator = None
+        if config.aggregate_enable:
+            from mp_deye_aggregate import DeyeAggregator
+            self.aggregator = DeyeAggregator(config, self.sensors)
+        self.derived = None
+        if config.derived_enable:
+            from mp_deye_derived import DeyeDerivedMetrics
+            self.derived = DeyeDerivedMetrics(config, self.sensors)
+        self.alarm_monitor = None
+        if self.alarm_blocks:
+            from mp_deye_alarm import DeyeAlarmMonitor
+            self.alarm_monitor = DeyeAlarmMonitor(config, self.sensors)
+        self.http_server = None
+        if config.http_enable:
+            from mp_deye_http import DeyeHttpServer
+            self.http_server = DeyeHttpServer(config)
+        self.ha_discovery = None
+        if config.ha_discovery_enable:
+            from mp_deye_homeassistant import DeyeHomeAssistantDiscovery
+            self.ha_discovery = DeyeHomeAssistantDiscovery(config, self.sensors)
+        self.power_controller = None
+        if config.power_control.enable:
+            from mp_deye_power_control import DeyePowerController
+            self.power_controller = DeyePowerController(config, self.modbus)
+            self.mqtt_client.subscribe(config.power_control.grid_topic, self.power_controller.on_grid_message)
+
+    def idle(self):
+        """
+        Called frequently between poll cycles
+        """
+        # Without link the MQTT session would only grow its reconnect backoff, the main loop reconnects first
+        if self.link and not self.link.is_connected():
+            return
+        self.mqtt_client.check_msg()
+        if self.http_server:
+            self.http_server.poll()
 
     def do_task(self):
-        if self.log_level <= 20: print("INFO: Reading start")
-        if self.wdt_enable: wdt = WDT()
-        if self.wdt_enable: wdt.feed()
+        log.info("Reading start")
+        self.watchdog.feed()
         try:
-            
-            regs = self.modbus.read_registers(0x3c, 0x3f)
-            if self.wdt_enable: wdt.feed()
-            gc.collect()
-            regs.update(self.modbus.read_registers(0x40, 0x4f))
-            if self.wdt_enable: wdt.feed()
-            gc.collect()
-            regs.update(self.modbus.read_registers(0x50, 0x5f))
-            if self.wdt_enable: wdt.feed()
-            gc.collect()
-            regs.update(self.modbus.read_registers(0x6d, 0x74))
-            if self.wdt_enable: wdt.feed()
-            gc.collect()
-
-            timestamp = time.localtime()
-            observations = []
-            for sensor in self.sensors:
-                value = sensor.read_value(regs)
-                if value is not None:
-                    observation = Observation(sensor, timestamp, value)
-                    observations.append(observation)
-                    if self.log_level <= 10: print(f"DEBUG: Observation {observation.sensor.name}: {observation.value_as_str()}")
+            if self.ha_discovery and not self.ha_discovery.published:
+                self.ha_discovery.publish(self.mqtt_client.session)
+            self.clock.maybe_sync()
 
-            self.mqtt_client.publish_observations(observations)
+            result = self.modbus.read_blocks(self.blocks)
+            gc.collect()
+            if not result.is_complete():
+                log.warning("Read status {}, {} of {} register blocks failed", result.status(), len(result.failed_blocks), len(self.blocks))
+
+            self.publish_alarms(result.registers)
+
+            # Decoded in place into the slots, the consumers below iterate them without copies
+            ticks_ms = self.clock.ticks_ms()
+            observations = self.observations
+            observations.decode(result.registers, ticks_ms)
+            log.debug("Decoded {} of {} sensors", len(observations), len(self.sensors))
+
+            if self.http_server:
+                self.http_server.update(observations, result)
+
+            if self.derived:
+                self.derived.add(observations)
+            if self.aggregator:
+                self.aggregator.add(observations, ticks_ms)
+                if not self.aggregator.is_due():
+                    log.info("Reading completed, aggregated")
+                    return
+                self.mqtt_client.publish_values(self.aggregator.summaries())
+            else:
+                self.mqtt_client.publish_observations(observations)
+            if self.derived:
+                self.mqtt_client.publish_values(self.derived.summaries(self.clock))
+            self.mqtt_client.publish_read_status(result)
+            if self.power_controller and self.power_controller.limit_percent is not None:
+                self.mqtt_client.publish_value('power_control/limit', str(self.power_controller.limit_percent))
+                self.mqtt_client.publish_value('power_control/writes', str(self.power_controller.writes))
+                self.mqtt_client.publish_value('power_control/latency_ms', str(self.power_controller.last_latency_ms))
             self.mqtt_client.publish_os_mem_free()
+            self.mqtt_client.publish_session_stats()
+            if self.link:
+                self.mqtt_client.publish_link_stats(self.link)
             self.mqtt_client.publish_os_resetcause()
-            if self.wdt_enable: wdt.feed()
+            self.watchdog.feed()
             gc.collect()
-            if self.log_level <= 20: print("INFO: Reading completed")
+            log.info("Reading completed")
+
+        except Exception as e:
+            log.warning("Cannot read from Inverter (do_task): {}", e)
+        finally:
+            self.mqtt_client.publish_log()
+
+    def do_alarm_task(self):
+        """
+        Reads only the status and alarm registers and publishes their changes
+        """
+        log.debug("Reading alarms")
+        self.watchdog.feed()
+        try:
+            result = self.modbus.read_blocks(self.alarm_blocks)
+            self.publish_alarms(result.registers)
+        except Exception as e:
+            log.warning("Cannot read from Inverter (do_alarm_task): {}", e)
+        finally:
+            self.mqtt_client.publish_log()
+
+    def publish_alarms(self, registers: dict):
+        if not self.alarm_monitor:
+            return
+        messages = self.alarm_monitor.update(registers)
+        if messages:
+            self.mqtt_client.publish_values(messages)
+
+    def restore_connections(self):
+        """
+        Rebuilds the sockets after the Wi-Fi link came back, without restarting.
+        Logger requests open their own sockets, only failures counted during the outage are forgotten.
+        """
+        self.mqtt_client.session.reconnect()
+        self.modbus.circuit_breaker.reset()
+        if self.http_server:
+            self.http_server.reopen()
+
+    def wait(self, seconds: int):
+        """
+        Sleeps until the next poll cycle, reading the alarm registers in between as often as the alarm monitor asks for
+        """
+        if not self.alarm_monitor:
+            self.watchdog.sleep(seconds, self.idle)
+            return
+        while seconds > 0:
+            step = min(seconds, self.alarm_monitor.interval())
+            self.watchdog.sleep(step, self.idle)
+            seconds -= step
+            if seconds > 0:
+                self.do_alarm_task()
 
-        except:
-            if self.log_level <= 30: print("WARN: Cannot read from Inverter (do_task)")
-            
 
 def os_mem_free():
     m_free = gc.mem_free()
@@ -99,39 +206,32 @@ def main():
     ap_if.active(False)
     
     config = DeyeConfig.from_env()
+    log.configure(config)
     
-    if config.wdt_enable: wdt = WDT()
+    watchdog = DeyeWatchdog(config)
 
     # Activate WLAN Connection
-    if config.log_level <= 20: print("INFO: Connecting to Wifi")
-    station = network.WLAN(network.STA_IF)
-    station.active(True)
-    station.connect(config.wifi_ssid, config.wifi_pwd)
-
-    while station.isconnected() == False:
-        if config.log_level <= 20: print(".", end=" ")
-        if config.wdt_enable: wdt.feed()
-        time.sleep(1)
-        pass
+    log.info("Connecting to Wifi")
+    from mp_deye_wifi import DeyeWifiSupervisor
+    link = DeyeWifiSupervisor(config, watchdog)
+    link.connect()
     
-    if config.log_level <= 20: print("INFO: Wifi Connection successful")
+    log.info("Wifi Connection successful")
     
-    daemon = DeyeDaemon(config)
+    daemon = DeyeDaemon(config, watchdog, link)
+    link.on_restored = daemon.restore_connections
 
-    while station.isconnected() == True:
-        if config.wdt_enable: wdt.feed()
+    # A lost link is reconnected in place, check() is False only if that failed
+    while link.check():
+        watchdog.feed()
         daemon.do_task()
         gc.collect()
-        if config.log_level <= 20: print("INFO: main() Loop memory:", os_mem_free())
-        count = config.data_read_inverval
-        while (count):
-            if config.wdt_enable: wdt.feed()
-            count -= 1
-            time.sleep(1)
+        log.info("main() Loop memory: {}", os_mem_free)
+        daemon.wait(config.data_read_inverval)
 
 
-    station.disconnect()
-    restart_and_reconnect()  # If connection gets lost
+    link.station.disconnect()
+    restart_and_reconnect()  # If the connection can not be restored
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,160 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+
+from mp_deye_config import DeyeConfig
+from mp_deye_observation import Observation
+from mp_deye_sensor import Sensor
+from mp_deye_log import log
+
+
+class DeyeCounterDelta():
+    """
+    Energy counted by a cumulative sensor (kWh) between two publications, and the average power over that time.
+
+    Only the last sample, a pending reset and the running sum are kept. A lifetime counter never goes down,
+    a lower reading is a glitch (e.g. a torn read) and ignored. A daily counter goes down at midnight or on an
+    inverter restart, but only a reset confirmed by the next sample (not below the lower reading, not back at
+    the old level) counts: then the new value is the energy counted since the reset.
+    """
+
+    def __init__(self, sensor: Sensor, daily: bool):
+        self.sensor = sensor
+        self.daily = daily
+        self.resets = 0
+        self.glitches = 0
+        self.__last_value = None
+        self.__reset_value = None
+        self.__delta = 0.0
+        self.__since_ms = None
+        self.__until_ms = None
+
+    def add(self, value: float, ticks_ms: int):
+        last = self.__last_value
+        if last is None:
+            self.__since_ms = ticks_ms
+            self.__last_value = value
+        elif value >= last:
+            if self.__reset_value is not None:
+                self.__glitch(self.__reset_value)
+            self.__delta += value - last
+            self.__last_value = value
+        elif self.__reset_value is not None and value >= self.__reset_value:
+            self.__reset_value = None
+            self.__delta += value
+            self.__last_value = value
+            self.resets += 1
+        elif self.daily:
+            self.__reset_value = value
+        else:
+            self.__glitch(value)
+        self.__until_ms = ticks_ms
+
+    def __glitch(self, value: float):
+        self.__reset_value = None
+        self.glitches += 1
+        log.warning("{}: ignored reading {} below {}", self.sensor.name, value, self.__last_value)
+
+    def is_empty(self) -> bool:
+        return self.__since_ms is None or self.__until_ms == self.__since_ms
+
+    def delta(self) -> float:
+        return self.__delta
+
+    def power_w(self) -> float:
+        return self.__delta * 3600000000 / (self.__until_ms - self.__since_ms)
+
+    def restart(self):
+        """
+        Starts the next interval at the last sample
+        """
+        self.__delta = 0.0
+        self.__since_ms = self.__until_ms
+
+
+class DeyeRestartDetector():
+    """
+    Detects inverter restarts from its uptime (minutes): the uptime went down, or it is shorter
+    than the time passed since the previous sample (restarted while not polled).
+    """
+
+    def __init__(self, sensor: Sensor):
+        self.sensor = sensor
+        self.restarts = 0
+        self.started_ms = None
+        self.__last_uptime = None
+        self.__last_ms = None
+
+    def add(self, uptime: float, ticks_ms: int):
+        if self.__last_uptime is not None:
+            # One minute of tolerance for the resolution of the register
+            if uptime < self.__last_uptime or (uptime + 1) * 60000 < ticks_ms - self.__last_ms:
+                self.restarts += 1
+        self.started_ms = ticks_ms - int(uptime * 60000)
+        self.__last_uptime = uptime
+        self.__last_ms = ticks_ms
+
+
+class DeyeDerivedMetrics():
+    """
+    Derives rates from the observations of every poll cycle with constant state per sensor: energy and average
+    power between two publications for the DEYE_DERIVED_COUNTERS, and inverter restarts from the uptime.
+    Samples are stamped with the monotonic clock, so irregular poll cycles and an unsynced RTC do not matter.
+    """
+
+    def __init__(self, config: DeyeConfig, sensors: list):
+        self.counters = {}
+        self.restart_detector = None
+        self.__sample_ms = None
+        for sensor in sensors:
+            if sensor.mqtt_topic_suffix in config.derived_counters:
+                daily = config.derived_counters[sensor.mqtt_topic_suffix] == 'daily'
+                self.counters[sensor] = DeyeCounterDelta(sensor, daily)
+            elif sensor.mqtt_topic_suffix == 'uptime':
+                self.restart_detector = DeyeRestartDetector(sensor)
+
+    def add(self, observations: list[Observation]):
+        for observation in observations:
+            self.__sample_ms = observation.ticks_ms
+            counter = self.counters.get(observation.sensor)
+            if counter:
+                counter.add(observation.value, observation.ticks_ms)
+            elif self.restart_detector and observation.sensor == self.restart_detector.sensor:
+                self.restart_detector.add(observation.value, observation.ticks_ms)
+
+    def summaries(self, clock):
+        """
+        Yields (topic_suffix, value) of the derived metrics and starts the next interval.
+        Wall clock times are Unix seconds and only published once the clock is synced.
+        """
+        for sensor, counter in self.counters.items():
+            if counter.is_empty():
+                continue
+            suffix = sensor.mqtt_topic_suffix
+            yield (suffix + '/delta', sensor.format_value(counter.delta()))
+            yield (suffix + '/power', '{:0.1f}'.format(counter.power_w()))
+            yield (suffix + '/resets', str(counter.resets))
+            counter.restart()
+        detector = self.restart_detector
+        if detector and detector.started_ms is not None:
+            yield ('uptime/restarts', str(detector.restarts))
+            started_ms = clock.epoch_ms(detector.started_ms)
+            if started_ms is not None:
+                yield ('uptime/started', str(started_ms // 1000))
+        if self.__sample_ms is not None and clock.is_synced():
+            yield ('timestamp', str(clock.epoch_ms(self.__sample_ms) // 1000))
@@ -0,0 +1,223 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+import errno
+import select
+import socket
+import time
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from mp_deye_config import DeyeConfig
+from mp_deye_transport import DeyeSolarmanV5Transport
+from mp_deye_watchdog import DeyeWatchdog
+from mp_deye_log import log
+
+DISCOVERY_UDP_PORT = 48899
+DISCOVERY_UDP_MESSAGE = b'WIFIKIT-214028-READ'
+
+class DeyeDiscovery():
+    """
+    Finds loggers on the local network and maps their serial numbers to IP addresses.
+
+    The UDP probe asks all Solarman loggers to answer with 'ip,mac,serial'. Loggers that do not
+    answer it are found by connecting to the logger port of every host in the subnet, a bounded
+    number of connects at a time. Each open port receives a Solarman V5 request for serial 0, the
+    logger rejects it with an error frame carrying its own serial number in the header.
+    """
+
+    def __init__(self, config: DeyeConfig, watchdog: DeyeWatchdog = None, udp_port: int = DISCOVERY_UDP_PORT):
+        self.config = config.logger
+        self.watchdog = watchdog if watchdog else DeyeWatchdog(config)
+        self.udp_port = udp_port
+        # Read holding register 0, the logger answers the serial number mismatch first. The transport adds the CRC.
+        modbus_frame = bytearray([self.config.modbus_unit, 0x03, 0, 0, 0, 1])
+        self.probe_request = DeyeSolarmanV5Transport(0).build_request(modbus_frame)
+
+    def locate(self, serial_number: int) -> str:
+        """
+        Returns the IP address of the logger with the given serial number, None if it was not found
+        """
+        self.watchdog.start('discover')
+        try:
+            loggers = self.probe_udp()
+            if serial_number not in loggers:
+                subnet = self.config.discovery_subnet or self.__wlan_subnet()
+                if subnet:
+                    loggers.update(self.scan_tcp(subnet_hosts(subnet)))
+        finally:
+            self.watchdog.stop('discover')
+        ip_address = loggers.get(serial_number)
+        log.info("Discovery found {} logger(s), {} at {}", len(loggers), serial_number, ip_address)
+        if ip_address:
+            self.store(serial_number, ip_address)
+        return ip_address
+
+    def probe_udp(self, timeout_ms: int = 2000) -> dict:
+        """
+        Broadcasts the Solarman discovery message, returns the answering loggers as a dict serial -> IP
+        """
+        loggers = {}
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            try:
+                udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            except (AttributeError, OSError):
+                pass
+            udp_socket.settimeout(0.2)
+            address = socket.getaddrinfo(self.config.discovery_broadcast, self.udp_port)[0][-1]
+            udp_socket.sendto(DISCOVERY_UDP_MESSAGE, address)
+            start = time.ticks_ms()
+            while time.ticks_diff(time.ticks_ms(), start) < timeout_ms:
+                self.watchdog.feed()
+                try:
+                    fields = udp_socket.recv(128).decode().split(',')
+                except (OSError, ValueError):
+                    # Nothing received yet, or a datagram of another device on the port that is not text
+                    continue
+                if len(fields) == 3 and fields[2].isdigit():
+                    loggers[int(fields[2])] = fields[0]
+        except OSError as e:
+            log.warning("Discovery probe failed: {}", e)
+        finally:
+            udp_socket.close()
+        log.debug("Discovery probe answers: {}", loggers)
+        return loggers
+
+    def scan_tcp(self, hosts, timeout_ms: int = 1000) -> dict:
+        """
+        Connects to the logger port of every host, returns the Solarman loggers found as a dict serial -> IP
+        """
+        transport = DeyeSolarmanV5Transport(0)
+        loggers = {}
+        pending = {}
+        poller = select.poll()
+        hosts = iter(hosts)
+        more_hosts = True
+        while more_hosts or pending:
+            while more_hosts and len(pending) < self.config.discovery_concurrency:
+                ip_address = next(hosts, None)
+                if ip_address is None:
+                    more_hosts = False
+                    break
+                scan_socket = self.__start_connect(ip_address)
+                if scan_socket:
+                    pending[scan_socket] = [ip_address, time.ticks_ms(), bytearray(), False]
+                    poller.register(scan_socket, select.POLLOUT)
+            self.watchdog.feed()
+            for ev in poller.poll(50):
+                # MicroPython may append more elements to the tuple
+                obj, event = ev[0], ev[1]
+                # CPython reports file descriptors, MicroPython the registered objects
+                scan_socket = obj
+                if isinstance(obj, int):
+                    scan_socket = next((s for s in pending if s.fileno() == obj), None)
+                if scan_socket not in pending:
+                    continue
+                state = pending[scan_socket]
+                if event & (select.POLLERR | select.POLLHUP) and not event & select.POLLIN:
+                    self.__finish(poller, pending, scan_socket)
+                    continue
+                try:
+                    if not state[3]:
+                        scan_socket.send(self.probe_request)
+                        state[3] = True
+                        poller.modify(scan_socket, select.POLLIN)
+                        continue
+                    data = scan_socket.recv(128)
+                except OSError:
+                    self.__finish(poller, pending, scan_socket)
+                    continue
+                if not data:
+                    self.__finish(poller, pending, scan_socket)
+                    continue
+                state[2] += data
+                if len(state[2]) >= 11:
+                    if state[2][0] == 0xa5:
+                        loggers[transport.response_serial(state[2])] = state[0]
+                    self.__finish(poller, pending, scan_socket)
+            now = time.ticks_ms()
+            for scan_socket in [s for s, state in pending.items() if time.ticks_diff(now, state[1]) > timeout_ms]:
+                self.__finish(poller, pending, scan_socket)
+        log.debug("Discovery scan found: {}", loggers)
+        return loggers
+
+    def cached_ip_address(self, serial_number: int) -> str:
+        """
+        IP address of the logger found by an earlier discovery, None if there is none
+        """
+        return self.__load().get(str(serial_number))
+
+    def store(self, serial_number: int, ip_address: str):
+        cache = self.__load()
+        if cache.get(str(serial_number)) == ip_address:
+            # Do not wear the flash with unchanged data
+            return
+        cache[str(serial_number)] = ip_address
+        try:
+            with open(self.config.discovery_cache, 'w') as f:
+                json.dump(cache, f)
+        except OSError as e:
+            log.warning("Discovery cache not written: {}", e)
+
+    def __load(self) -> dict:
+        try:
+            with open(self.config.discovery_cache) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def __start_connect(self, ip_address: str):
+        try:
+            address = socket.getaddrinfo(ip_address, self.config.port)[0][-1]
+            scan_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        except OSError:
+            return None
+        scan_socket.setblocking(False)
+        try:
+            scan_socket.connect(address)
+        except OSError as e:
+            # The connect completes in the background
+            if e.args[0] != errno.EINPROGRESS:
+                scan_socket.close()
+                return None
+        return scan_socket
+
+    def __finish(self, poller, pending: dict, scan_socket):
+        poller.unregister(scan_socket)
+        del pending[scan_socket]
+        scan_socket.close()
+
+    def __wlan_subnet(self) -> str:
+        try:
+            import network
+            ip_address = network.WLAN(network.STA_IF).ifconfig()[0]
+        except (ImportError, OSError):
+            return None
+        return ip_address.rsplit('.', 1)[0]
+
+
+def subnet_hosts(subnet: str):
+    """
+    Host addresses 1 to 254 of a /24 subnet given as e.g. '192.168.2'
+    """
+    for host in range(1, 255):
+        yield f'{subnet}.{host}'
@@ -0,0 +1,103 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+class DeyeError(Exception):
+    """
+    Base class of all errors raised while talking to the logger.
+
+    'kind' is a short, stable name used in logs and published read status.
+    'retryable' tells the retry policy whether repeating the request may help.
+    """
+    kind = 'error'
+    retryable = True
+
+
+class DeyeTimeoutError(DeyeError):
+    """
+    Logger did not answer within the request deadline
+    """
+    kind = 'timeout'
+
+
+class DeyeConnectError(DeyeTimeoutError):
+    """
+    Socket to the logger could not be opened
+    """
+    kind = 'connect'
+
+
+class DeyeFrameError(DeyeError):
+    """
+    Response frame is malformed (invalid start or end byte, unexpected content)
+    """
+    kind = 'frame'
+
+
+class DeyeShortFrameError(DeyeFrameError):
+    """
+    Response frame is empty or shorter than expected
+    """
+    kind = 'short_frame'
+
+
+class DeyeCrcError(DeyeFrameError):
+    """
+    Modbus CRC of the response frame is not valid
+    """
+    kind = 'crc'
+
+
+class DeyeLoggerError(DeyeError):
+    """
+    Logger answered with an error code instead of a Modbus response
+    """
+    kind = 'logger_error'
+    retryable = False
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class DeyeModbusExceptionError(DeyeError):
+    """
+    Inverter answered with a Modbus exception response, e.g. illegal data address
+    """
+    kind = 'modbus_exception'
+    retryable = False
+
+    def __init__(self, function: int, code: int):
+        super().__init__("Modbus exception response, function {:02x}, exception code {:02x}".format(function, code))
+        self.function = function
+        self.code = code
+
+
+class DeyeVerifyError(DeyeError):
+    """
+    Registers read back after a write do not hold the written values
+    """
+    kind = 'verify'
+    retryable = False
+
+
+class DeyeCircuitOpenError(DeyeError):
+    """
+    Request was not sent, because the circuit breaker considers the logger dead
+    """
+    kind = 'circuit_open'
+    retryable = False
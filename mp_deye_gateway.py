@@ -0,0 +1,322 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+# Gateway mode: polls a whole fleet of loggers (DEYE_GATEWAY_LOGGERS) from one Linux host with asyncio
+# and publishes over one shared MQTT connection per process. Requires CPython 3.8+:
+#   python3 mp_deye_gateway.py [shards]
+# Topics are '<MQTT_TOPIC_PREFIX>/<logger serial number>/<metric>'.
+
+import mp_deye_host
+mp_deye_host.install()
+
+import asyncio
+import collections
+import random
+import sys
+import time
+
+from mp_deye_config import DeyeConfig, DeyeLoggerConfig, DeyeMqttConfig
+from mp_deye_error import DeyeError, DeyeConnectError, DeyeTimeoutError, DeyeCircuitOpenError, \
+    DeyeModbusExceptionError
+from mp_deye_modbus import DeyeModbus, DeyeReadResult
+from mp_deye_sensors import sensor_list, plan_register_blocks
+import mp_deye_mqtt_packet as mqtt_packet
+from mp_deye_log import log
+
+class DeyeGatewayMqtt():
+    """
+    MQTT connection shared by all loggers of a gateway process.
+
+    Publications use QoS 0 and are written back to back without waiting for the broker (pipelined).
+    One supervisor task owns the connection: it connects with backoff, drains incoming packets (ping
+    responses), pings the broker and reconnects when the connection is lost. Publishers only check
+    is_connected(), publications made without connection are dropped.
+    """
+
+    def __init__(self, config: DeyeMqttConfig, client_id: str, keepalive: int = 60):
+        self.config = config
+        self.client_id = client_id
+        self.keepalive = keepalive
+        self.published = 0
+        self.reconnects = 0
+        self.__reader = None
+        self.__writer = None
+        self.__supervisor = None
+        self.__connected = None
+
+    def is_connected(self) -> bool:
+        return self.__writer is not None and not self.__writer.is_closing()
+
+    async def start(self):
+        """
+        Starts the supervisor task and waits for the first connection
+        """
+        self.__connected = asyncio.Event()
+        self.__supervisor = asyncio.ensure_future(self.__supervise())
+        await self.__connected.wait()
+
+    def publish(self, topic_suffix: str, value: str):
+        if not self.is_connected():
+            return
+        self.__writer.write(mqtt_packet.publish_packet(f'{self.config.topic_prefix}/{topic_suffix}', value))
+        self.published += 1
+
+    async def flush(self):
+        """
+        Waits until the buffered publications are written. A write error closes the connection,
+        reconnecting is left to the supervisor task.
+        """
+        if not self.is_connected():
+            return
+        try:
+            await self.__writer.drain()
+        except OSError as e:
+            log.error("MQTT publishing error: {}", e)
+            self.__writer.close()
+
+    async def close(self):
+        if self.__supervisor:
+            self.__supervisor.cancel()
+        if self.is_connected():
+            self.__writer.write(mqtt_packet.disconnect_packet())
+            await self.__writer.drain()
+            self.__writer.close()
+
+    async def __supervise(self):
+        while True:
+            await self.__connect()
+            self.__connected.set()
+            ping = asyncio.ensure_future(self.__ping())
+            try:
+                await self.__read()
+            finally:
+                ping.cancel()
+            self.reconnects += 1
+            log.warning("MQTT connection lost, reconnecting")
+
+    async def __connect(self):
+        backoff = 1
+        while True:
+            try:
+                self.__reader, self.__writer = await asyncio.open_connection(self.config.host, self.config.port)
+                self.__writer.write(mqtt_packet.connect_packet(self.client_id, self.config.username,
+                                                               self.config.password, self.keepalive))
+                await self.__writer.drain()
+                connack = await asyncio.wait_for(self.__reader.readexactly(4), 10)
+                if connack[0] != mqtt_packet.CONNACK or connack[3] != 0:
+                    raise ConnectionError(f"MQTT connection refused, return code {connack[3]}")
+                return
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                log.error("MQTT connect error: {}, retry in {} s", e, backoff)
+                if self.__writer:
+                    self.__writer.close()
+                    self.__writer = None
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+    async def __read(self):
+        """
+        Drains incoming packets until the connection is closed, by the broker or by a failed flush()
+        """
+        try:
+            while await self.__reader.read(1024):
+                pass
+        except OSError as e:
+            log.error("MQTT read error: {}", e)
+        self.__writer.close()
+
+    async def __ping(self):
+        while True:
+            await asyncio.sleep(self.keepalive / 2)
+            self.__writer.write(mqtt_packet.pingreq_packet())
+
+
+class DeyeGatewayLogger():
+    """
+    One logger polled by the gateway. The DeyeModbus instance is only used to build and parse frames,
+    the exchange with the logger runs on asyncio streams. All register blocks are requested over one
+    connection, pipelined if the transport supports it.
+    """
+
+    def __init__(self, config: DeyeConfig, logger_config: DeyeLoggerConfig):
+        self.config = logger_config
+        self.timeout = config.wdt_stage_deadlines['request']
+        self.modbus = DeyeModbus(DeyeConfig(logger_config, config.mqtt), None)
+
+    async def poll(self, blocks: list) -> DeyeReadResult:
+        result = DeyeReadResult()
+        breaker = self.modbus.circuit_breaker
+        requests = []
+        for block in blocks:
+            sequence = self.modbus.next_sequence()
+            requests.append((sequence, self.modbus.build_read_request(block[0], block[1], sequence)))
+        try:
+            breaker.check()
+            responses = await self.__exchange(requests)
+        except DeyeError as e:
+            for block in blocks:
+                result.failed_blocks[block] = e
+            if not isinstance(e, DeyeCircuitOpenError):
+                breaker.record_failure()
+            return result
+        for i, block in enumerate(blocks):
+            resp_frame = responses.get(requests[i][0])
+            try:
+                if resp_frame is None:
+                    raise DeyeTimeoutError("No response within the request deadline")
+                result.registers.update(self.modbus.parse_read_response(resp_frame, block[0], block[1]))
+                result.valid_blocks.append(block)
+            except DeyeError as e:
+                result.failed_blocks[block] = e
+        # A Modbus exception response is an answer of a healthy inverter as well
+        if result.valid_blocks or any(isinstance(e, DeyeModbusExceptionError) for e in result.failed_blocks.values()):
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        return result
+
+    async def __exchange(self, requests: list) -> dict:
+        transport = self.modbus.transport
+        window = len(requests) if transport.supports_pipelining else 1
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.config.ip_address, self.config.port), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise DeyeConnectError(f"Could not open socket on IP {self.config.ip_address}: {e}")
+        responses = {}
+        buffer = bytearray()
+        sent = 0
+        try:
+            while len(responses) < len(requests):
+                while sent < len(requests) and sent - len(responses) < window:
+                    writer.write(requests[sent][1])
+                    sent += 1
+                await writer.drain()
+                data = await asyncio.wait_for(reader.read(1024), self.timeout)
+                if not data:
+                    break
+                buffer += data
+                length = transport.response_length(buffer)
+                while length is not None and len(buffer) >= length:
+                    resp_frame = buffer[:length]
+                    buffer = buffer[length:]
+                    if transport.supports_pipelining:
+                        responses[transport.response_sequence(resp_frame)] = resp_frame
+                    else:
+                        responses[requests[len(responses)][0]] = resp_frame
+                    length = transport.response_length(buffer)
+        except asyncio.TimeoutError:
+            log.warning("Logger {}: {} responses missing", self.config.serial_number, len(requests) - len(responses))
+        except OSError as e:
+            raise DeyeTimeoutError(f"Connection error: {e}")
+        finally:
+            writer.close()
+        return responses
+
+
+class DeyeGateway():
+    """
+    Polls all loggers every DEYE_DATA_READ_INTERVAL seconds with at most DEYE_GATEWAY_CONCURRENCY
+    logger connections open at once. The first poll of each logger is delayed by a random part of
+    the interval, so the polls spread evenly instead of hitting the network all at once.
+    """
+
+    def __init__(self, config: DeyeConfig, loggers: list, client_id: str = 'deye-gateway'):
+        self.interval = config.data_read_inverval
+        self.concurrency = config.gateway_concurrency
+        self.sensors = [s for s in sensor_list if s.in_any_group(config.metric_groups) and s.mqtt_topic_suffix]
+        self.blocks = plan_register_blocks(self.sensors, config.logger.max_register_gap, config.logger.max_block_registers)
+        self.loggers = [DeyeGatewayLogger(config, logger) for logger in loggers]
+        self.mqtt = DeyeGatewayMqtt(config.mqtt, client_id)
+        # Latencies of the most recent polls, at least the last one of every logger
+        self.latencies_ms = collections.deque(maxlen=max(1000, len(self.loggers)))
+        self.polls = 0
+
+    async def run(self, rounds: int = None):
+        """
+        Polls every logger 'rounds' times, forever if None
+        """
+        self.__semaphore = asyncio.Semaphore(self.concurrency)
+        await self.mqtt.start()
+        await asyncio.gather(*[self.__logger_loop(logger, rounds) for logger in self.loggers])
+        await self.mqtt.close()
+
+    async def __logger_loop(self, logger: DeyeGatewayLogger, rounds: int):
+        await asyncio.sleep(random.random() * self.interval)
+        next_start = time.monotonic()
+        done = 0
+        while True:
+            await self.poll_logger(logger)
+            done += 1
+            if rounds is not None and done >= rounds:
+                return
+            next_start += self.interval
+            await asyncio.sleep(max(0, next_start - time.monotonic()))
+
+    async def poll_logger(self, logger: DeyeGatewayLogger):
+        async with self.__semaphore:
+            start = time.ticks_ms()
+            result = await logger.poll(self.blocks)
+            self.latencies_ms.append(time.ticks_diff(time.ticks_ms(), start))
+            self.polls += 1
+        if not result.is_complete():
+            log.warning("Logger {}: read status {}", logger.config.serial_number, result.status())
+        serial = logger.config.serial_number
+        for sensor in self.sensors:
+            value = sensor.read_value(result.registers)
+            if value is not None:
+                self.mqtt.publish(f'{serial}/{sensor.mqtt_topic_suffix}', sensor.format_value(value))
+        self.mqtt.publish(f'{serial}/read_status', result.status())
+        await self.mqtt.flush()
+
+
+def run_shard(config: DeyeConfig, loggers: list, shard: int, rounds: int = None) -> list:
+    """
+    Runs the gateway for one shard of the loggers, returns the latencies in ms of the most recent polls
+    """
+    log.configure(config)
+    gateway = DeyeGateway(config, loggers, f'deye-gateway-{shard}')
+    asyncio.run(gateway.run(rounds))
+    return list(gateway.latencies_ms)
+
+def run_sharded(config: DeyeConfig, loggers: list, shards: int, rounds: int = None) -> list:
+    """
+    Spreads the loggers over 'shards' processes, each with its own event loop and MQTT connection
+    """
+    if shards <= 1:
+        return run_shard(config, loggers, 0, rounds)
+    import multiprocessing
+    with multiprocessing.Pool(shards) as pool:
+        results = pool.starmap(run_shard, [(config, loggers[i::shards], i, rounds) for i in range(shards)])
+    return [latency for result in results for latency in result]
+
+
+def main(args):
+    config = DeyeConfig.from_env()
+    log.configure(config)
+    loggers = DeyeLoggerConfig.gateway_from_env()
+    if not loggers:
+        print("ERROR: No loggers configured in DEYE_GATEWAY_LOGGERS")
+        sys.exit(1)
+    shards = int(args[0]) if args else config.gateway_shards
+    log.info("Gateway polling {} loggers in {} shard(s)", len(loggers), shards)
+    run_sharded(config, loggers, shards)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
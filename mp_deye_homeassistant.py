@@ -0,0 +1,141 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+import hashlib
+import ubinascii
+
+from mp_deye_config import DeyeConfig
+from mp_deye_mqtt_session import DeyeMqttSession
+from mp_deye_log import log
+
+
+class DeyeHomeAssistantDiscovery():
+    """
+    Generates the Home Assistant MQTT discovery configs of the active sensors from their metadata.
+
+    The configs are published retained, so Home Assistant picks them up whenever it starts. To keep the boot
+    short they are only published when their content hash differs from the one stored on flash after the
+    last complete publication. Every config is rendered into one reused buffer and sent from there.
+    """
+
+    def __init__(self, config: DeyeConfig, sensors: list):
+        self.discovery_prefix = config.ha_discovery_prefix
+        self.topic_prefix = config.mqtt.topic_prefix
+        self.hash_file = config.ha_discovery_hash_file
+        self.device_id = 'deye_{:d}'.format(config.logger.serial_number)
+        # With aggregation, measurements are published as window summaries only
+        self.state_suffix = '/avg' if config.aggregate_enable else ''
+        self.published = False
+        # One entity per topic, in a stable order, so the hash does not change between boots
+        by_topic = {}
+        for sensor in sensors:
+            if sensor.mqtt_topic_suffix:
+                by_topic[sensor.mqtt_topic_suffix] = sensor
+        self.sensors = [by_topic[topic] for topic in sorted(by_topic)]
+        self.__buffer = bytearray(config.ha_discovery_buffer_size)
+        self.__view = memoryview(self.__buffer)
+
+    def publish(self, session: DeyeMqttSession) -> int:
+        """
+        Publishes the configs if they changed since the last publication. Returns the number of configs published.
+        """
+        digest = self.digest()
+        if digest == self.__stored_digest():
+            log.info("Home Assistant discovery configs unchanged")
+            self.published = True
+            return 0
+        for sensor in self.sensors:
+            length = self.render(sensor)
+            if not session.publish(self.config_topic(sensor), self.__view[:length], True, 0):
+                log.warning("Home Assistant discovery config of {} not published", sensor.name)
+                return 0
+        self.__store_digest(digest)
+        log.info("Home Assistant discovery: {} configs published", len(self.sensors))
+        self.published = True
+        return len(self.sensors)
+
+    def digest(self) -> str:
+        """
+        Content hash over the topics and payloads of all configs
+        """
+        content_hash = hashlib.sha256()
+        for sensor in self.sensors:
+            content_hash.update(self.config_topic(sensor).encode())
+            content_hash.update(self.__view[:self.render(sensor)])
+        return ubinascii.hexlify(content_hash.digest()).decode()
+
+    def config_topic(self, sensor) -> str:
+        return '{}/sensor/{}/{}/config'.format(self.discovery_prefix, self.device_id,
+                                               sensor.mqtt_topic_suffix.replace('/', '_'))
+
+    def render(self, sensor) -> int:
+        """
+        Renders the discovery config of the sensor into the buffer, returns its length
+        """
+        offset = self.__write(0, '{"name":"')
+        offset = self.__write(offset, sensor.name)
+        offset = self.__write(offset, '","uniq_id":"')
+        offset = self.__write(offset, self.device_id)
+        offset = self.__write(offset, '_')
+        offset = self.__write(offset, sensor.mqtt_topic_suffix.replace('/', '_'))
+        offset = self.__write(offset, '","stat_t":"')
+        offset = self.__write(offset, self.topic_prefix)
+        offset = self.__write(offset, '/')
+        offset = self.__write(offset, sensor.mqtt_topic_suffix)
+        if not sensor.is_status():
+            offset = self.__write(offset, self.state_suffix)
+        offset = self.__write(offset, '"')
+        if sensor.unit:
+            offset = self.__write(offset, ',"unit_of_meas":"')
+            offset = self.__write(offset, sensor.unit)
+            offset = self.__write(offset, '"')
+        if sensor.device_class:
+            offset = self.__write(offset, ',"dev_cla":"')
+            offset = self.__write(offset, sensor.device_class)
+            offset = self.__write(offset, '"')
+        if sensor.device_class == 'energy':
+            offset = self.__write(offset, ',"stat_cla":"total_increasing"')
+        elif sensor.unit:
+            offset = self.__write(offset, ',"stat_cla":"measurement"')
+        offset = self.__write(offset, ',"dev":{"ids":["')
+        offset = self.__write(offset, self.device_id)
+        offset = self.__write(offset, '"],"name":"Deye ')
+        offset = self.__write(offset, self.device_id[5:])
+        return self.__write(offset, '","mf":"Deye"}}')
+
+    def __write(self, offset: int, text: str) -> int:
+        data = text.encode()
+        end = offset + len(data)
+        if end > len(self.__buffer):
+            raise OverflowError("HA_DISCOVERY_BUFFER_SIZE too small")
+        self.__view[offset:end] = data
+        return end
+
+    def __stored_digest(self) -> str:
+        try:
+            with open(self.hash_file) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def __store_digest(self, digest: str):
+        try:
+            with open(self.hash_file, 'w') as f:
+                f.write(digest)
+        except OSError as e:
+            log.warning("Cannot store Home Assistant discovery hash: {}", e)
@@ -0,0 +1,188 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+# Lets the device modules run on a PC with CPython, for the simulator, benchmarks and the gateway.
+# MicroPython (ESP8266 and unix port) already provides everything, there install() changes nothing.
+
+import sys
+import time
+
+def _ticks_ms():
+    return int(time.monotonic() * 1000)
+
+def _ticks_us():
+    return int(time.monotonic() * 1000000)
+
+def _ticks_diff(ticks1, ticks2):
+    return ticks1 - ticks2
+
+def _ticks_add(ticks, delta):
+    return ticks + delta
+
+def _sleep_ms(ms):
+    time.sleep(ms / 1000)
+
+class HostWLAN():
+    """
+    Simulated Wi-Fi station of the 'network' shim. outage() drops the link and keeps the access point
+    unavailable for a while. A connect takes associate_ms once the access point is available, plus scan_ms
+    without a BSSID and dhcp_ms without a static IP configuration, like on the ESP8266.
+    """
+
+    SSID = b'host-ssid'
+    BSSID = b'\x02\x00\x00\x00\x00\x01'
+
+    def __init__(self, interface: int):
+        self.interface = interface
+        self.associate_ms = 100
+        self.scan_ms = 1500
+        self.dhcp_ms = 1000
+        self.connects = 0
+        self.last_bssid = None
+        self.__active = False
+        self.__connected_at = None
+        self.__available_at = time.ticks_ms()
+        self.__static = None
+
+    def outage(self, duration_ms: int):
+        """
+        Drops the link, the access point accepts connects again after duration_ms
+        """
+        self.__connected_at = None
+        self.__available_at = time.ticks_add(time.ticks_ms(), duration_ms)
+
+    def active(self, is_active=None):
+        if is_active is None:
+            return self.__active
+        self.__active = is_active
+
+    def connect(self, ssid=None, password=None, bssid=None):
+        self.connects += 1
+        self.last_bssid = bssid
+        start = self.__available_at if self.__is_down() else time.ticks_ms()
+        delay_ms = self.associate_ms + (0 if bssid else self.scan_ms) + (0 if self.__static else self.dhcp_ms)
+        self.__connected_at = time.ticks_add(start, delay_ms)
+
+    def isconnected(self) -> bool:
+        return self.__connected_at is not None and time.ticks_diff(time.ticks_ms(), self.__connected_at) >= 0
+
+    def disconnect(self):
+        self.__connected_at = None
+
+    def ifconfig(self, config=None):
+        if config is not None:
+            self.__static = config
+            return None
+        return self.__static or ('127.0.0.1', '255.0.0.0', '127.0.0.1', '127.0.0.1')
+
+    def scan(self):
+        return [(HostWLAN.SSID, HostWLAN.BSSID, 6, -55, 3, False)]
+
+    def status(self, param=None):
+        return -55 if param == 'rssi' else 5
+
+    def config(self, *args, **kwargs):
+        return None
+
+    def __is_down(self) -> bool:
+        return time.ticks_diff(self.__available_at, time.ticks_ms()) > 0
+
+
+class HostNetwork():
+    """
+    Stand-in for the MicroPython 'network' module, one HostWLAN per interface
+    """
+    STA_IF = 0
+    AP_IF = 1
+    interfaces = {}
+
+    @staticmethod
+    def WLAN(interface: int = 0) -> HostWLAN:
+        if interface not in HostNetwork.interfaces:
+            HostNetwork.interfaces[interface] = HostWLAN(interface)
+        return HostNetwork.interfaces[interface]
+
+class HostMachine():
+    """
+    Stand-in for the parts of the MicroPython 'machine' module used by the MQTT client
+    """
+    PWRON_RESET = 0
+    HARD_RESET = 1
+    WDT_RESET = 3
+    DEEPSLEEP_RESET = 5
+    SOFT_RESET = 4
+
+    @staticmethod
+    def unique_id() -> bytes:
+        return b'\x02\x00\x00\x01'
+
+    @staticmethod
+    def reset_cause() -> int:
+        return HostMachine.PWRON_RESET
+
+class HostNtpTime():
+    """
+    Stand-in for the MicroPython 'ntptime' module, answers with the host clock after round_trip_ms
+    """
+    host = 'pool.ntp.org'
+    round_trip_ms = 40
+
+    @staticmethod
+    def time() -> int:
+        time.sleep_ms(HostNtpTime.round_trip_ms)
+        return int(time.time()) - 946684800
+
+def install():
+    """
+    Adds the MicroPython specific time functions and module names missing in CPython
+    """
+    if not hasattr(time, 'ticks_ms'):
+        time.ticks_ms = _ticks_ms
+        time.ticks_us = _ticks_us
+        time.ticks_diff = _ticks_diff
+        time.ticks_add = _ticks_add
+        time.sleep_ms = _sleep_ms
+    try:
+        import ubinascii
+    except ImportError:
+        import binascii
+        sys.modules['ubinascii'] = binascii
+    try:
+        import network
+    except ImportError:
+        sys.modules['network'] = HostNetwork
+    try:
+        import machine
+    except ImportError:
+        sys.modules['machine'] = HostMachine
+    try:
+        import ntptime
+    except ImportError:
+        sys.modules['ntptime'] = HostNtpTime
+
+def local_config(port: int, protocol: str = 'solarman_v5', serial_number: int = 4175806782):
+    """
+    Configuration pointing to a simulated logger on this host
+    """
+    from mp_deye_config import DeyeConfig
+    config = DeyeConfig.from_env()
+    config.logger.ip_address = '127.0.0.1'
+    config.logger.port = port
+    config.logger.protocol = protocol
+    config.logger.serial_number = serial_number
+    return config
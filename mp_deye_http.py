@@ -0,0 +1,290 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+import errno
+import select
+import socket
+import time
+
+from mp_deye_config import DeyeConfig
+from mp_deye_modbus import DeyeReadResult
+from mp_deye_log import log
+
+# Space reserved in front of every rendered document for the status line and headers
+HEADER_RESERVE = 128
+# Clients that did not complete their request or response within this time are dropped, in ms
+CLIENT_TIMEOUT_MS = 5000
+# Request bytes accepted before a request without the blank line is answered anyway
+MAX_REQUEST_LENGTH = 1024
+
+HEADER_FORMAT = 'HTTP/1.0 200 OK\r\nContent-Type: {}\r\nContent-Length: {:d}\r\nConnection: close\r\n\r\n'
+NOT_FOUND = b'HTTP/1.0 404 Not Found\r\nContent-Type: text/plain\r\nContent-Length: 10\r\nConnection: close\r\n\r\nNot found\n'
+NO_DATA = b'HTTP/1.0 503 Service Unavailable\r\nContent-Type: text/plain\r\nContent-Length: 8\r\nConnection: close\r\n\r\nNo data\n'
+
+METRIC_PREFIX = 'deye_'
+READ_OK_TYPE = '# TYPE ' + METRIC_PREFIX + 'read_ok gauge\n'
+READ_FAILED_BLOCKS_TYPE = '# TYPE ' + METRIC_PREFIX + 'read_failed_blocks gauge\n'
+POLLS_TOTAL_TYPE = '# TYPE ' + METRIC_PREFIX + 'polls_total counter\n'
+
+class DeyeHttpServer():
+    """
+    Small non-blocking HTTP/1.0 server exposing the last poll cycle as /metrics (Prometheus text format)
+    and /state (JSON).
+
+    poll() has to be called frequently (via the daemon idle hook) and never blocks. update() hands over the
+    observations of a completed poll cycle. Both documents are rendered on the first request after an update
+    into one preallocated buffer and served from there until the next update, so scrapes never cause Modbus
+    traffic and allocate next to nothing.
+    """
+
+    def __init__(self, config: DeyeConfig):
+        self.host = config.http_host
+        self.port = config.http_port
+        self.max_clients = config.http_max_clients
+        self.requests = 0
+        self.renders = 0
+        self.polls = 0
+        self.__buffer = bytearray(config.http_buffer_size)
+        self.__view = memoryview(self.__buffer)
+        self.__documents = {}
+        self.__observations = None
+        self.__result = None
+        self.__stale = False
+        self.__names = {}
+        self.__clients = {}
+        self.__fds = {}
+        self.__poller = select.poll()
+        self.__server = None
+        self.__listen()
+
+    def update(self, observations, result: DeyeReadResult):
+        """
+        Takes the observations (ObservationSlots) of a completed poll cycle, rendered on the next request.
+        Only a reference is kept, the slots are overwritten by the next cycle right before its update.
+        """
+        self.__observations = observations
+        self.__result = result
+        self.__stale = True
+        self.polls += 1
+
+    def poll(self):
+        """
+        Accepts clients, reads their requests and sends the responses as far as the sockets allow
+        """
+        for ev in self.__poller.poll(0):
+            # MicroPython may append more elements to the tuple
+            obj, event = ev[0], ev[1]
+            # CPython reports file descriptors, MicroPython the registered objects
+            client = self.__fds.get(obj, obj)
+            if client is self.__server:
+                self.__accept()
+            elif client in self.__clients:
+                if event & (select.POLLERR | select.POLLHUP):
+                    self.__close(client)
+                elif event & select.POLLOUT:
+                    self.__send(client)
+                elif event & select.POLLIN:
+                    self.__receive(client)
+        if self.__clients:
+            now = time.ticks_ms()
+            for client, state in list(self.__clients.items()):
+                if time.ticks_diff(now, state[3]) > CLIENT_TIMEOUT_MS:
+                    self.__close(client)
+
+    def close(self):
+        for client in list(self.__clients):
+            self.__close(client)
+        self.__poller.unregister(self.__server)
+        if hasattr(self.__server, 'fileno'):
+            self.__fds.pop(self.__server.fileno(), None)
+        self.__server.close()
+
+    def reopen(self):
+        """
+        Replaces the listening socket, e.g. after the network link came back.
+        The last poll cycle stays cached, scrapes are answered from it right away.
+        """
+        self.close()
+        self.__listen()
+
+    def __listen(self):
+        self.__server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__server.bind(socket.getaddrinfo(self.host, self.port)[0][-1])
+        self.__server.listen(self.max_clients)
+        self.__server.setblocking(False)
+        self.__register(self.__server, select.POLLIN)
+        log.info("HTTP server listening on port {}", self.port)
+
+    def __register(self, sock, events):
+        self.__poller.register(sock, events)
+        if hasattr(sock, 'fileno'):
+            self.__fds[sock.fileno()] = sock
+
+    def __accept(self):
+        try:
+            client, address = self.__server.accept()
+        except OSError:
+            return
+        if len(self.__clients) >= self.max_clients:
+            client.close()
+            return
+        client.setblocking(False)
+        # [request bytes, response, bytes sent, accepted at]
+        self.__clients[client] = [b'', None, 0, time.ticks_ms()]
+        self.__register(client, select.POLLIN)
+
+    def __receive(self, client):
+        state = self.__clients[client]
+        try:
+            data = client.recv(256)
+        except OSError as e:
+            if e.args[0] != errno.EAGAIN:
+                self.__close(client)
+            return
+        if not data:
+            self.__close(client)
+            return
+        state[0] += data
+        if b'\r\n\r\n' not in state[0] and len(state[0]) < MAX_REQUEST_LENGTH:
+            return
+        self.requests += 1
+        state[1] = self.__response(state[0])
+        state[0] = b''
+        self.__poller.modify(client, select.POLLOUT)
+        self.__send(client)
+
+    def __response(self, request: bytes):
+        parts = request.split(b' ', 2)
+        path = parts[1].split(b'?', 1)[0] if len(parts) > 1 else b''
+        if path not in (b'/metrics', b'/state'):
+            return NOT_FOUND
+        # A new poll cycle is rendered once no response is sent from the buffer anymore
+        if self.__stale and not self.__sending():
+            self.__render()
+        document = self.__documents.get(path)
+        if document is None:
+            return NO_DATA
+        return self.__view[document[0]:document[1]]
+
+    def __sending(self) -> bool:
+        for state in self.__clients.values():
+            if isinstance(state[1], memoryview):
+                return True
+        return False
+
+    def __send(self, client):
+        state = self.__clients[client]
+        response = state[1]
+        while state[2] < len(response):
+            try:
+                sent = client.send(response[state[2]:])
+            except OSError as e:
+                if e.args[0] != errno.EAGAIN:
+                    self.__close(client)
+                return
+            if not sent:
+                return
+            state[2] += sent
+        self.__close(client)
+
+    def __close(self, client):
+        if client in self.__clients:
+            del self.__clients[client]
+            self.__poller.unregister(client)
+            if hasattr(client, 'fileno'):
+                self.__fds.pop(client.fileno(), None)
+        client.close()
+
+    def __render(self):
+        self.__stale = False
+        self.__documents = {}
+        self.renders += 1
+        try:
+            end = self.__render_document(b'/metrics', 'text/plain; version=0.0.4', 0, self.__render_metrics)
+            self.__render_document(b'/state', 'application/json', end, self.__render_state)
+        except OverflowError:
+            log.warning("HTTP buffer of {} bytes too small, increase HTTP_BUFFER_SIZE", len(self.__buffer))
+
+    def __render_document(self, path: bytes, content_type: str, offset: int, render_body) -> int:
+        """
+        Renders the body behind the space reserved for the header, then puts the header right in front of it
+        """
+        body_start = offset + HEADER_RESERVE
+        end = render_body(body_start)
+        header = HEADER_FORMAT.format(content_type, end - body_start).encode()
+        start = body_start - len(header)
+        self.__view[start:body_start] = header
+        self.__documents[path] = (start, end)
+        return end
+
+    def __render_metrics(self, offset: int) -> int:
+        for observation in self.__observations:
+            sensor = observation.sensor
+            if not sensor.mqtt_topic_suffix:
+                continue
+            value = '{:d}'.format(observation.value) if sensor.is_status() else observation.value_as_str()
+            name, type_line = self.__metric_name(sensor)
+            offset = self.__write(offset, type_line)
+            offset = self.__write(offset, name)
+            offset = self.__write(offset, ' ')
+            offset = self.__write(offset, value)
+            offset = self.__write(offset, '\n')
+        offset = self.__write(offset, READ_OK_TYPE)
+        offset = self.__write(offset, METRIC_PREFIX + 'read_ok {:d}\n'.format(int(self.__result.is_complete())))
+        offset = self.__write(offset, READ_FAILED_BLOCKS_TYPE)
+        offset = self.__write(offset, METRIC_PREFIX + 'read_failed_blocks {:d}\n'.format(len(self.__result.failed_blocks)))
+        offset = self.__write(offset, POLLS_TOTAL_TYPE)
+        return self.__write(offset, METRIC_PREFIX + 'polls_total {:d}\n'.format(self.polls))
+
+    def __render_state(self, offset: int) -> int:
+        offset = self.__write(offset, '{{"read_status":"{}","polls":{:d},"values":{{'.format(self.__result.status(), self.polls))
+        separator = ''
+        for observation in self.__observations:
+            sensor = observation.sensor
+            if not sensor.mqtt_topic_suffix:
+                continue
+            value = observation.value_as_str()
+            offset = self.__write(offset, separator)
+            offset = self.__write(offset, '"')
+            offset = self.__write(offset, sensor.mqtt_topic_suffix)
+            offset = self.__write(offset, '":"' if sensor.is_status() else '":')
+            offset = self.__write(offset, value)
+            if sensor.is_status():
+                offset = self.__write(offset, '"')
+            separator = ','
+        return self.__write(offset, '}}\n')
+
+    def __metric_name(self, sensor) -> tuple:
+        """
+        Metric name of the sensor and its '# TYPE' line, built once
+        """
+        names = self.__names.get(sensor)
+        if names is None:
+            name = METRIC_PREFIX + sensor.mqtt_topic_suffix.replace('/', '_')
+            names = (name, '# TYPE ' + name + ' gauge\n')
+            self.__names[sensor] = names
+        return names
+
+    def __write(self, offset: int, text: str) -> int:
+        data = text.encode()
+        end = offset + len(data)
+        if end > len(self.__buffer):
+            raise OverflowError()
+        self.__view[offset:end] = data
+        return end
@@ -0,0 +1,114 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+import time
+
+try:
+    import ubinascii
+except ImportError:
+    import binascii as ubinascii
+
+from mp_deye_config import DeyeConfig, CRITICAL, ERROR, WARNING, INFO, DEBUG, LOG_LEVEL, LOG_RING_LEVEL, LOG_RING_SIZE, LOG_CONSOLE
+
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARN', ERROR: 'ERROR', CRITICAL: 'CRITICAL'}
+
+# Longest message kept in the ring, longer ones are cut to bound the RAM used
+RING_MESSAGE_LENGTH = 120
+
+class DeyeLogger():
+    """
+    Logger with deferred formatting. A call like log.debug("Frame {} of {}", frame, length) formats the
+    message only if the record is emitted, so a disabled call costs a method call and a comparison.
+    bytes and bytearray arguments are rendered as hex, callable arguments (e.g. gc.mem_free) are only
+    called when the record is emitted.
+
+    Records at or above ring_level are also kept in a fixed-size ring in RAM, overwriting the oldest.
+    drain() hands them out, the daemon publishes them in batches to the MQTT log topic.
+    """
+
+    def __init__(self, level: int = INFO, ring_level: int = WARNING, ring_size: int = 16, console: bool = True):
+        self.dropped = 0
+        self.configure_levels(level, ring_level, ring_size, console)
+
+    def configure(self, config: DeyeConfig):
+        self.configure_levels(config.log_level, config.log_ring_level, config.log_ring_size, config.log_console)
+
+    def configure_levels(self, level: int, ring_level: int, ring_size: int, console: bool):
+        self.console_level = level if console else CRITICAL + 1
+        self.ring_level = ring_level
+        # Lowest level anybody is interested in, checked first by every call
+        self.level = min(self.console_level, ring_level)
+        self.__ring = [None] * ring_size
+        self.__next = 0
+        self.__count = 0
+
+    def enabled(self, level: int) -> bool:
+        return level >= self.level
+
+    def debug(self, message: str, *args):
+        if self.level <= DEBUG:
+            self.__emit(DEBUG, message, args)
+
+    def info(self, message: str, *args):
+        if self.level <= INFO:
+            self.__emit(INFO, message, args)
+
+    def warning(self, message: str, *args):
+        if self.level <= WARNING:
+            self.__emit(WARNING, message, args)
+
+    def error(self, message: str, *args):
+        if self.level <= ERROR:
+            self.__emit(ERROR, message, args)
+
+    def drain(self) -> list:
+        """
+        Returns the records in the ring as (ticks_ms, line), oldest first, and empties the ring
+        """
+        size = len(self.__ring)
+        records = []
+        for i in range(self.__count):
+            index = (self.__next - self.__count + i) % size
+            records.append(self.__ring[index])
+            self.__ring[index] = None
+        self.__count = 0
+        return records
+
+    def __emit(self, level: int, message: str, args: tuple):
+        if args:
+            message = message.format(*[self.__render(arg) for arg in args])
+        line = LEVEL_NAMES[level] + ': ' + message
+        if level >= self.console_level:
+            print(line)
+        if level >= self.ring_level and self.__ring:
+            self.__ring[self.__next] = (time.ticks_ms(), line[:RING_MESSAGE_LENGTH])
+            self.__next = (self.__next + 1) % len(self.__ring)
+            if self.__count < len(self.__ring):
+                self.__count += 1
+            else:
+                self.dropped += 1
+
+    def __render(self, arg):
+        if isinstance(arg, (bytes, bytearray)):
+            return ubinascii.hexlify(arg).decode()
+        elif callable(arg):
+            return arg()
+        return arg
+
+
+log = DeyeLogger(LOG_LEVEL, LOG_RING_LEVEL, LOG_RING_SIZE, LOG_CONSOLE)
@@ -20,130 +20,211 @@ import ubinascii
 
 from mp_deye_connector import DeyeConnector
 from mp_deye_config import DeyeConfig
+from mp_deye_error import DeyeError, DeyeFrameError, DeyeShortFrameError, DeyeLoggerError, DeyeVerifyError, \
+    DeyeModbusExceptionError, DeyeCircuitOpenError, DeyeConnectError
+from mp_deye_retry import DeyeRetryPolicy, DeyeCircuitBreaker
+from mp_deye_transport import create_transport
+from mp_deye_log import log
+
+class DeyeReadResult():
+    """
+    Outcome of reading a set of register blocks in one poll cycle.
+
+    'registers' holds the values of all valid blocks, 'failed_blocks' maps each failed
+    (first_reg, last_reg) block to the DeyeError that caused the failure.
+    """
+
+    def __init__(self):
+        self.registers = {}
+        self.valid_blocks = []
+        self.failed_blocks = {}
+
+    def is_complete(self) -> bool:
+        return not self.failed_blocks
+
+    def status(self) -> str:
+        if not self.failed_blocks:
+            return 'ok'
+        elif self.valid_blocks:
+            return 'partial'
+        return 'failed'
 
-def crc16(data: bytearray, poly: hex = 0xA001) -> str:
-    '''
-        CRC-16 MODBUS HASHING ALGORITHM
-        All the credits to [kalebu](https://github.com/kalebu)
-        
-        MIT License
-
-        Copyright (c) 2021 Jordan Kalebu
-
-        Permission is hereby granted, free of charge, to any person obtaining a copy
-        of this software and associated documentation files (the "Software"), to deal
-        in the Software without restriction, including without limitation the rights
-        to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
-        copies of the Software, and to permit persons to whom the Software is
-        furnished to do so, subject to the following conditions:
-
-        The above copyright notice and this permission notice shall be included in all
-        copies or substantial portions of the Software.
-
-        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
-        IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
-        FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
-        AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
-        LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
-        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
-        SOFTWARE.
-    '''
-    crc = 0xFFFF
-    for byte in data:
-        crc ^= byte
-        for _ in range(8):
-            crc = ((crc >> 1) ^ poly
-                   if (crc & 0x0001)
-                   else crc >> 1)
-
-    hv = hex(crc).upper()[2:]
-    blueprint = '0000'
-    return (blueprint if len(hv) == 0 else blueprint[:-len(hv)] + hv)
 
 class DeyeModbus:
     """ Simplified Modbus over TCP implementation that works with Deye Solar inverter.
         Supports only Modbus read-holding-registers function (0x03)
         Inspired by https://github.com/jlopez77/DeyeInverter
+
+        The envelope around the Modbus frames (Solarman V5, Modbus TCP or RTU over TCP)
+        is handled by the transport selected in the logger configuration.
+
+        Requests are retried according to the logger retry policy and guarded by a circuit breaker.
+        Failures are raised as DeyeError subclasses.
     """
 
     def __init__(self, config: DeyeConfig, connector: DeyeConnector):
-        self.log_level = config.log_level
         self.config = config.logger
         self.connector = connector
+        self.transport = create_transport(self.config)
+        self.pipeline_window = self.config.pipeline_window if self.transport.supports_pipelining else 1
+        self.__sequence = 0
+        self.__pipeline_failures = 0
+        self.retry_policy = DeyeRetryPolicy(self.config.retry_attempts,
+                                            self.config.retry_backoff_base_ms, self.config.retry_backoff_max_ms)
+        self.circuit_breaker = DeyeCircuitBreaker(self.config.circuit_failure_threshold,
+                                                  self.config.circuit_probe_interval)
 
     def read_registers(self, first_reg: int, last_reg: int) -> dict[int, int]:
+        req_frame = self.build_read_request(first_reg, last_reg)
+        def request():
+            resp_frame = self.connector.send_request(req_frame)
+            return self.parse_read_response(resp_frame, first_reg, last_reg)
+        return self.__guarded(request)
+
+    def build_read_request(self, first_reg: int, last_reg: int, sequence: int = 0) -> bytearray:
+        """
+        Builds the complete request frame reading registers first_reg..last_reg, ready to be sent to the logger
+        """
         modbus_frame = self.__build_modbus_read_holding_registers_request_frame(first_reg, last_reg)
-        req_frame = self.__build_request_frame(modbus_frame)
-        resp_frame = self.connector.send_request(req_frame)
-        modbus_resp_frame = self.__extract_modbus_response_frame(resp_frame)
+        return self.transport.build_request(modbus_frame, sequence)
+
+    def parse_read_response(self, resp_frame: bytearray, first_reg: int, last_reg: int) -> dict[int, int]:
+        """
+        Validates a complete response frame of the logger and returns the registers it holds
+        """
+        modbus_resp_frame = self.transport.extract_response(resp_frame)
         return self.__parse_modbus_read_holding_registers_response(modbus_resp_frame, first_reg, last_reg)
 
+    def next_sequence(self) -> int:
+        """
+        Sequence number for the next pipelined request, 1..255 so it fits the V5 echo byte
+        """
+        self.__sequence = self.__sequence % 255 + 1
+        return self.__sequence
+
+    def read_blocks(self, blocks: list) -> DeyeReadResult:
+        """
+        Reads all (first_reg, last_reg) blocks. A failing block does not stop reading the others.
+
+        With a pipeline window > 1 the blocks are requested back to back over one socket first.
+        Blocks the pipelined pass could not deliver are read again one by one. If the logger does
+        not answer pipelined requests properly twice in a row, pipelining is switched off for good.
+        """
+        result = DeyeReadResult()
+        pending = blocks
+        if self.pipeline_window > 1 and len(blocks) > 1:
+            pending = self.__read_blocks_pipelined(blocks, result)
+        for block in pending:
+            try:
+                result.registers.update(self.read_registers(block[0], block[1]))
+                result.valid_blocks.append(block)
+            except DeyeError as e:
+                log.error("Block 0x{:02x}-0x{:02x} failed ({}: {})", block[0], block[1], e.kind, e)
+                result.failed_blocks[block] = e
+        return result
+
+    def __read_blocks_pipelined(self, blocks: list, result: DeyeReadResult) -> list:
+        """
+        Returns the blocks that still have to be read serially
+        """
+        requests = []
+        for block in blocks:
+            sequence = self.next_sequence()
+            requests.append((sequence, self.build_read_request(block[0], block[1], sequence)))
+        try:
+            self.circuit_breaker.check()
+            responses = self.connector.send_requests(requests, self.transport, self.pipeline_window)
+        except (DeyeCircuitOpenError, DeyeConnectError) as e:
+            # Nothing was exchanged, the serial pass reports the error
+            log.warning("Pipelined read failed ({}: {})", e.kind, e)
+            return blocks
+        except DeyeError as e:
+            # E.g. a garbled stream the responses cannot be split from
+            log.warning("Pipelined read failed ({}: {})", e.kind, e)
+            self.__pipeline_failed()
+            return blocks
+        pending = []
+        for i, block in enumerate(blocks):
+            resp_frame = responses.pop(requests[i][0], None)
+            if resp_frame is None:
+                pending.append(block)
+                continue
+            try:
+                result.registers.update(self.parse_read_response(resp_frame, block[0], block[1]))
+                result.valid_blocks.append(block)
+            except DeyeModbusExceptionError as e:
+                # A proper answer, reading the block again would be rejected the same way
+                log.error("Block 0x{:02x}-0x{:02x} failed ({}: {})", block[0], block[1], e.kind, e)
+                result.failed_blocks[block] = e
+            except DeyeError:
+                pending.append(block)
+        if len(pending) < len(blocks):
+            self.circuit_breaker.record_success()
+        if responses or pending:
+            # Unexpected sequence numbers or requests left unanswered
+            self.__pipeline_failed()
+        else:
+            self.__pipeline_failures = 0
+        return pending
+
+    def __pipeline_failed(self):
+        self.__pipeline_failures += 1
+        if self.__pipeline_failures >= 2:
+            log.warning("Logger does not support pipelined requests, falling back to serial mode")
+            self.pipeline_window = 1
+
     def write_register(self, reg_address: int, reg_value: int) -> bool:
-        modbus_frame = self.__build_modbus_write_holding_register_request_frame(reg_address, reg_value)
-        req_frame = self.__build_request_frame(modbus_frame)
-        resp_frame = self.connector.send_request(req_frame)
-        modbus_resp_frame = self.__extract_modbus_response_frame(resp_frame)
-        return self.__parse_modbus_write_holding_register_response(modbus_resp_frame, reg_address, reg_value)
-
-    def __build_request_frame(self, modbus_frame) -> bytearray:
-        start = bytearray(ubinascii.unhexlify('A5'))  # start
-        length = (15 + len(modbus_frame) + 2).to_bytes(2, 'little')  # datalength
-        controlcode = bytearray(ubinascii.unhexlify('1045'))  # controlCode
-        inverter_sn_prefix = bytearray(ubinascii.unhexlify('0000'))  # serial
-        datafield = bytearray(ubinascii.unhexlify('020000000000000000000000000000'))
-        modbus_crc = bytearray(ubinascii.unhexlify(crc16(modbus_frame)))
-        modbus_crc = bytearray(bytes(reversed(modbus_crc)))
-        checksum = bytearray(ubinascii.unhexlify('00'))  # checksum placeholder for outer frame
-        end_code = bytearray(ubinascii.unhexlify('15'))
-        inverter_sn = bytearray(ubinascii.unhexlify('{:10x}'.format(self.config.serial_number).strip()))
-        inverter_sn = bytearray(bytes(reversed(inverter_sn)))
-        frame = start + length + controlcode + inverter_sn_prefix + inverter_sn + datafield \
-            + modbus_frame + modbus_crc + checksum + end_code
-
-        checksum = 0
-        for i in range(1, len(frame) - 2, 1):
-            checksum += frame[i] & 255
-        frame[len(frame) - 2] = int((checksum & 255))
+        return self.write_registers(reg_address, [reg_value], verify=False)
 
-        return frame
+    def write_registers(self, first_reg: int, values: list, verify: bool = True) -> bool:
+        """
+        Writes consecutive registers starting at first_reg with a single write-multiple-registers (0x10) request,
+        so the inverter applies all of them or none. With verify the registers are read back in one request
+        and compared, a mismatch raises DeyeVerifyError.
+        """
+        if not values or len(values) > 123:
+            raise ValueError(f"Between 1 and 123 registers can be written at once, got {len(values)}")
+        modbus_frame = self.__build_modbus_write_holding_registers_request_frame(first_reg, values)
+        req_frame = self.transport.build_request(modbus_frame)
+        def request():
+            resp_frame = self.connector.send_request(req_frame)
+            modbus_resp_frame = self.transport.extract_response(resp_frame)
+            return self.__parse_modbus_write_holding_registers_response(modbus_resp_frame, first_reg, len(values))
+        self.__guarded(request)
+        if verify:
+            last_reg = first_reg + len(values) - 1
+            registers = self.read_registers(first_reg, last_reg)
+            for i, value in enumerate(values):
+                actual = int.from_bytes(registers[first_reg + i], 'big')
+                if actual != value & 0xffff:
+                    raise DeyeVerifyError("Register {} reads {} after writing {}".format(first_reg + i, actual, value))
+        return True
 
-    def __extract_modbus_response_frame(self, frame: bytearray) -> bytearray:
-        # 29 - outer frame, 2 - modbus addr and command, 2 - modbus crc
-        if not frame:
-            if self.log_level <= 40: print("ERROR: No response frame")
-            return None
-        elif len(frame) == 29:
-            self.__parse_response_error_code(frame)
-            return None
-        elif len(frame) < (29 + 4):
-            if self.log_level <= 40: print("ERROR: Response frame is too short")
-            return None
-        elif frame[0] != 0xa5:
-            if self.log_level <= 40: print("ERROR: Response frame has invalid starting byte")
-            return None
-        elif frame[-1] != 0x15:
-            if self.log_level <= 40: print("ERROR: Response frame has invalid ending byte")
-            return None
-
-        return frame[25:-2]
+    def __guarded(self, request):
+        self.circuit_breaker.check()
+        try:
+            result = self.retry_policy.run(request, self.connector.watchdog)
+        except (DeyeLoggerError, DeyeModbusExceptionError):
+            # Logger and inverter are alive, they just reject the request
+            self.circuit_breaker.record_success()
+            raise
+        except DeyeError:
+            self.circuit_breaker.record_failure()
+            raise
+        self.circuit_breaker.record_success()
+        return result
 
     def __build_modbus_read_holding_registers_request_frame(self, first_reg, last_reg):
         reg_count = last_reg - first_reg + 1
-        return bytearray(ubinascii.unhexlify('0103{:04x}{:04x}'.format(first_reg, reg_count)))
+        return bytearray(ubinascii.unhexlify('{:02x}03{:04x}{:04x}'.format(self.config.modbus_unit, first_reg, reg_count)))
 
     def __parse_modbus_read_holding_registers_response(self, frame: bytearray, first_reg: int, last_reg: int) -> dict:
         reg_count = last_reg - first_reg + 1
         registers = {}
         expected_frame_data_len = 2 + 1 + reg_count * 2
-        if not frame or len(frame) < expected_frame_data_len + 2: # 2 bytes for crc
-            if self.log_level <= 40: print("ERROR: Modbus frame is too short or empty")
-            return registers
-        actual_crc = int.from_bytes(frame[expected_frame_data_len:expected_frame_data_len+2], 'little')
-        expected_crc = int.from_bytes(ubinascii.unhexlify(crc16(frame[0:expected_frame_data_len])), 'big')
-        if actual_crc != expected_crc:
-            if self.log_level <= 40: print("ERROR: Modbus frame crc is not valid. Expected {:04x}, got {:04x}".format(
-                expected_crc, actual_crc))
-            return registers
+        self.__check_modbus_exception(frame)
+        if not frame or len(frame) < expected_frame_data_len:
+            raise DeyeShortFrameError("Modbus frame is too short or empty")
         a = 0
         while a < reg_count:
             p1 = 3 + (a*2)
@@ -152,38 +233,27 @@ class DeyeModbus:
             a += 1
         return registers
 
-    def __build_modbus_write_holding_register_request_frame(self, reg_address, reg_value):
-        return bytearray(ubinascii.unhexlify('0110{:04x}000102{:04x}'.format(reg_address, reg_value)))
+    def __build_modbus_write_holding_registers_request_frame(self, first_reg, values):
+        reg_count = len(values)
+        frame = bytearray(ubinascii.unhexlify('{:02x}10{:04x}{:04x}{:02x}'.format(
+            self.config.modbus_unit, first_reg, reg_count, reg_count * 2)))
+        for value in values:
+            frame += (value & 0xffff).to_bytes(2, 'big')
+        return frame
 
-    def __parse_modbus_write_holding_register_response(self, frame, reg_address, reg_value):
-        expected_frame_data_len = 6
-        expected_frame_len = 6 + 2 # 2 bytes for crc
+    def __parse_modbus_write_holding_registers_response(self, frame, first_reg, reg_count):
+        expected_frame_len = 6
+        self.__check_modbus_exception(frame)
         if not frame:
-            if self.log_level <= 40: print("ERROR: Modbus response frame is empty")
-            return False
+            raise DeyeShortFrameError("Modbus response frame is empty")
         elif len(frame) != expected_frame_len: 
-            if self.log_level <= 40: print(f"ERROR: Wrong response frame length. Expected at least {expected_frame_len} bytes, got {len(frame)}")
-            return False
-        actual_crc = int.from_bytes(frame[expected_frame_data_len:expected_frame_data_len+2], 'little')
-        expected_crc = int.from_bytes(ubinascii.unhexlify(crc16(frame[0:expected_frame_data_len])), 'big')
-        if actual_crc != expected_crc:
-            if self.log_level <= 40: print("ERROR: Modbus frame crc is not valid. Expected {:04x}, got {:04x}".format(
-                expected_crc, actual_crc))
-            return False
+            raise DeyeShortFrameError(f"Wrong response frame length. Expected {expected_frame_len} bytes, got {len(frame)}")
         returned_address = int.from_bytes(frame[2:4], 'big')
         returned_count = int.from_bytes(frame[4:6], 'big')
-        if returned_address != reg_address or returned_count != 1:
-            if self.log_level <= 40: print("ERROR: Returned address does not match sent value.")
-            return False
+        if returned_address != first_reg or returned_count != reg_count:
+            raise DeyeFrameError("Returned address does not match sent value.")
         return True
 
-    def __parse_response_error_code(self, frame):
-        error_frame = frame[25:-2]
-        error_code = error_frame[0]
-        if error_code == 0x05:
-            if self.log_level <= 40: print("ERROR: Modbus device address does not match.")
-        elif error_code == 0x06:
-            if self.log_level <= 40: print("ERROR: Logger Serial Number does not match. Check your configuration file.")
-        else:
-            if self.log_level <= 40: print("ERROR: Unknown response error code. Error frame: {:02x}".format(error_frame))
-
+    def __check_modbus_exception(self, frame):
+        if frame and len(frame) >= 3 and frame[1] & 0x80:
+            raise DeyeModbusExceptionError(frame[1] & 0x7f, frame[2])
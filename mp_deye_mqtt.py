@@ -15,83 +15,116 @@
 # specific language governing permissions and limitations
 # under the License.
 
-from umqtt.simple import MQTTClient
 import machine
 import ubinascii
 import gc
-import time
 
 from mp_deye_config import DeyeConfig
 from mp_deye_observation import Observation
+from mp_deye_modbus import DeyeReadResult
+from mp_deye_mqtt_session import DeyeMqttSession
+from mp_deye_watchdog import DeyeWatchdog
+from mp_deye_log import log
 
 class DeyeMqttClient():
 
-    def __init__(self, config: DeyeConfig):
-        self.log_level = config.log_level
-        self.wdt_enable = config.wdt_enable
-        
-        # Call format: MQTTClient(client_id, server, port=0, user=None, password=None, keepalive=0, ssl=False, ssl_params={})        
-        self.__mqtt_client = MQTTClient(ubinascii.hexlify(machine.unique_id()), config.mqtt.host, config.mqtt.port, config.mqtt.username, config.mqtt.password, keepalive=300)
-
-        try:
-            self.__mqtt_client.connect()
-        except:
-            if self.log_level <= 40: print("ERROR: MQTT connect error")
-            time.sleep(2)
-            machine.reset()
-            
+    def __init__(self, config: DeyeConfig, watchdog: DeyeWatchdog):
+        self.watchdog = watchdog
         self.__config = config.mqtt
+        self.session = DeyeMqttSession(config.mqtt, ubinascii.hexlify(machine.unique_id()), watchdog)
+        # A failed connect is retried by the session with backoff, no reset needed
+        self.session.connect()
 
-    def __do_publish(self, observation: Observation):
-        if self.wdt_enable: wdt = WDT()
-        try:
-            if observation.sensor.mqtt_topic_suffix:
-                if self.wdt_enable: wdt.feed()
-                mqtt_topic = f'{self.__config.topic_prefix}/{observation.sensor.mqtt_topic_suffix}'
-                value = observation.value_as_str()
-                if self.log_level <= 10: print(f"DEBUG: Publishing message. topic: {mqtt_topic}, value: {value}")
-                info = self.__mqtt_client.publish(mqtt_topic, value)
-        except:
-            if self.log_level <= 40: print("ERROR: MQTT publishing error")
-            time.sleep(10)
-            machine.reset()           
+    def subscribe(self, topic: str, callback):
+        """
+        Subscribes callback(topic, msg) to an absolute topic (not prefixed)
+        """
+        self.session.subscribe(topic, callback)
+
+    def check_msg(self):
+        """
+        Dispatches pending incoming messages and keeps the session alive, without blocking
+        """
+        self.session.poll()
+
+    def publish_value(self, topic_suffix: str, value: str):
+        mqtt_topic = f'{self.__config.topic_prefix}/{topic_suffix}'
+        log.debug("Publishing message. topic: {}, value: {}", mqtt_topic, value)
+        if not self.session.publish(mqtt_topic, value):
+            log.error("MQTT publishing error {}", topic_suffix)
 
     def publish_observation(self, observation: Observation):
         self.publish_observations([observation])
 
-    def publish_observations(self, observations: List[Observation]):
+    def publish_observations(self, observations):
+        """
+        Publishes the observations (ObservationSlots or a list) as they are iterated, without collecting the values.
+        Status and alarm sensors are left out, the alarm monitor publishes them when they change.
+        """
+        self.publish_values((o.sensor.mqtt_topic_suffix, o.value_as_str()) for o in observations
+                            if o.sensor.mqtt_topic_suffix and not o.sensor.is_status())
+
+    def publish_values(self, values):
+        """
+        Publishes (topic_suffix, value) pairs, e.g. aggregated window summaries.
+        Waits for the broker to acknowledge them within the publish stage deadline.
+        While connected, the pairs are taken from values only as fast as the in-flight window drains,
+        so a cycle never queues more than the window. Without connection they are queued for later.
+        """
+        self.watchdog.start('publish')
         try:
-            for observation in observations:
-                if observation.sensor.mqtt_topic_suffix:
-                    self.__do_publish(observation)
-        except:
-            if self.log_level <= 40: print("ERROR: MQTT connection error")
+            for topic_suffix, value in values:
+                self.watchdog.feed()
+                if self.session.is_connected():
+                    self.session.drain(self.__config.inflight_window, self.watchdog.remaining_ms('publish'))
+                self.publish_value(topic_suffix, value)
+            if not self.session.flush(self.watchdog.remaining_ms('publish')):
+                log.warning("MQTT {} publications not acknowledged yet", self.session.pending())
+        finally:
+            self.watchdog.stop('publish')
+
+    def publish_read_status(self, result: DeyeReadResult):
+        """
+        Publishes the read status of the poll cycle (ok, partial, failed) and the list of valid register blocks
+        """
+        self.publish_value('read_status', result.status())
+        self.publish_value('read_valid_blocks', ','.join(['{:02x}-{:02x}'.format(b[0], b[1]) for b in result.valid_blocks]))
 
     def publish_os_resetcause(self):
-        try:
-            mqtt_topic = f'{self.__config.topic_prefix}/{"esp_os_resetcause"}'
-            MyResetCause = machine.reset_cause()
-            resetstr = "Unknown cause "+str(MyResetCause)
-            if ( MyResetCause == machine.PWRON_RESET ): resetstr = "PWRON_RESET"
-            if ( MyResetCause == machine.HARD_RESET ): resetstr = "HARD_RESET"
-            if ( MyResetCause == machine.WDT_RESET ): resetstr = "WDT_RESET"
-            if ( MyResetCause == machine.DEEPSLEEP_RESET ): resetstr = "DEEPSLEEP_RESET"
-            if ( MyResetCause == machine.SOFT_RESET ): resetstr = "SOFT_RESET"
-
-            self.__mqtt_client.publish(mqtt_topic, resetstr)
-            if self.log_level <= 10: print("INFO: OS reset cause: ", resetstr)
-        except:
-            if self.log_level <= 40: print("ERROR: MQTT publishing error resetcause")
-            time.sleep(10)
-            machine.reset()           
+        MyResetCause = machine.reset_cause()
+        resetstr = "Unknown cause "+str(MyResetCause)
+        if ( MyResetCause == machine.PWRON_RESET ): resetstr = "PWRON_RESET"
+        if ( MyResetCause == machine.HARD_RESET ): resetstr = "HARD_RESET"
+        if ( MyResetCause == machine.WDT_RESET ): resetstr = "WDT_RESET"
+        if ( MyResetCause == machine.DEEPSLEEP_RESET ): resetstr = "DEEPSLEEP_RESET"
+        if ( MyResetCause == machine.SOFT_RESET ): resetstr = "SOFT_RESET"
+
+        self.publish_value("esp_os_resetcause", resetstr)
+        log.debug("OS reset cause: {}", resetstr)
 
     def publish_os_mem_free(self):
-        try:
-            mqtt_topic = f'{self.__config.topic_prefix}/{"esp_mem_free"}'
-            self.__mqtt_client.publish(mqtt_topic, str(gc.mem_free()))
-            if self.log_level <= 10: print("INFO: Memory free:", str(gc.mem_free()))
-        except:
-            if self.log_level <= 40: print("ERROR: MQTT publishing error mem_free")
-            time.sleep(10)
-            machine.reset()           
+        self.publish_value("esp_mem_free", str(gc.mem_free()))
+        log.debug("Memory free: {}", gc.mem_free)
+
+    def publish_log(self):
+        """
+        Publishes the log records collected in the ring since the last call as one message, oldest first
+        """
+        records = log.drain()
+        if records:
+            self.publish_value("log", '\n'.join([f'{ticks_ms} {line}' for ticks_ms, line in records]))
+
+    def publish_link_stats(self, link):
+        """
+        Publishes the Wi-Fi outages since the start, the recovery time of the last one and the total time without link
+        """
+        self.publish_value("wifi/outages", str(link.outages))
+        self.publish_value("wifi/recovery_ms", str(link.last_recovery_ms))
+        self.publish_value("wifi/outage_s", str(link.total_outage_ms // 1000))
 
+    def publish_session_stats(self):
+        """
+        Publishes the reconnects and the QoS 1 publications dropped from a full queue since the start
+        """
+        self.publish_value("mqtt/reconnects", str(self.session.reconnects))
+        self.publish_value("mqtt/dropped", str(self.session.dropped))
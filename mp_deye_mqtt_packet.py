@@ -0,0 +1,134 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+# Encoding and decoding of the MQTT 3.1.1 packets used by the session layer, the gateway and the broker simulator.
+
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+SUBSCRIBE = 0x80
+SUBACK = 0x90
+PINGREQ = 0xc0
+PINGRESP = 0xd0
+DISCONNECT = 0xe0
+
+def encode_length(length: int) -> bytearray:
+    """
+    Variable length encoding of the remaining length
+    """
+    result = bytearray()
+    while True:
+        byte = length & 0x7f
+        length >>= 7
+        if length:
+            result.append(byte | 0x80)
+        else:
+            result.append(byte)
+            return result
+
+def encode_string(value) -> bytes:
+    if isinstance(value, str):
+        value = value.encode()
+    return len(value).to_bytes(2, 'big') + value
+
+def connect_packet(client_id, username=None, password=None, keepalive: int = 60, clean_session: bool = True) -> bytearray:
+    flags = 0x02 if clean_session else 0x00
+    payload = encode_string(client_id)
+    if username:
+        flags |= 0x80
+        payload += encode_string(username)
+        if password:
+            flags |= 0x40
+            payload += encode_string(password)
+    body = encode_string('MQTT') + bytes([4, flags]) + keepalive.to_bytes(2, 'big') + payload
+    return bytearray([CONNECT]) + encode_length(len(body)) + body
+
+def publish_header(topic, payload_length: int, qos: int = 0, retain: bool = False, packet_id: int = 0,
+                   dup: bool = False) -> bytearray:
+    """
+    Fixed and variable header of a PUBLISH packet, the payload is sent separately
+    """
+    first = PUBLISH | (qos << 1) | (0x01 if retain else 0) | (0x08 if dup else 0)
+    topic = encode_string(topic)
+    remaining = len(topic) + payload_length + (2 if qos else 0)
+    header = bytearray([first]) + encode_length(remaining) + topic
+    if qos:
+        header += packet_id.to_bytes(2, 'big')
+    return header
+
+def publish_packet(topic, payload, qos: int = 0, retain: bool = False, packet_id: int = 0, dup: bool = False) -> bytearray:
+    if isinstance(payload, str):
+        payload = payload.encode()
+    return publish_header(topic, len(payload), qos, retain, packet_id, dup) + payload
+
+def puback_packet(packet_id: int) -> bytearray:
+    return bytearray([PUBACK, 2]) + packet_id.to_bytes(2, 'big')
+
+def subscribe_packet(packet_id: int, topic, qos: int = 0) -> bytearray:
+    body = packet_id.to_bytes(2, 'big') + encode_string(topic) + bytes([qos])
+    return bytearray([SUBSCRIBE | 0x02]) + encode_length(len(body)) + body
+
+def pingreq_packet() -> bytes:
+    return bytes([PINGREQ, 0])
+
+def disconnect_packet() -> bytes:
+    return bytes([DISCONNECT, 0])
+
+def decode_header(buffer):
+    """
+    Decodes the fixed header at the start of buffer.
+    Returns (first_byte, header_length, remaining_length) or None if the header is incomplete.
+    """
+    if len(buffer) < 2:
+        return None
+    remaining = 0
+    shift = 0
+    pos = 1
+    while True:
+        if pos >= len(buffer) or pos > 4:
+            return None
+        byte = buffer[pos]
+        remaining |= (byte & 0x7f) << shift
+        shift += 7
+        pos += 1
+        if not byte & 0x80:
+            return (buffer[0], pos, remaining)
+
+def packet_length(buffer):
+    """
+    Total length of the packet at the start of buffer, None if not enough bytes were received yet
+    """
+    header = decode_header(buffer)
+    if header is None:
+        return None
+    return header[1] + header[2]
+
+def parse_publish(first_byte: int, body):
+    """
+    Splits the body of a PUBLISH packet into (topic, payload, qos, packet_id)
+    """
+    qos = (first_byte >> 1) & 0x03
+    topic_length = int.from_bytes(body[0:2], 'big')
+    topic = bytes(body[2:2 + topic_length])
+    pos = 2 + topic_length
+    packet_id = 0
+    if qos:
+        packet_id = int.from_bytes(body[pos:pos + 2], 'big')
+        pos += 2
+    return (topic, bytes(body[pos:]), qos, packet_id)
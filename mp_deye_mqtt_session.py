@@ -0,0 +1,286 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+import random
+import select
+import socket
+import time
+
+from mp_deye_config import DeyeMqttConfig
+from mp_deye_watchdog import DeyeWatchdog
+import mp_deye_mqtt_packet as mqtt_packet
+from mp_deye_log import log
+
+# Socket timeout of a connect attempt, a blocking send and each CONNACK read, in seconds.
+# Below the about 3 s after which the ESP8266 hardware watchdog resets the device.
+SOCKET_TIMEOUT = 1
+# Total wait for the CONNACK, the watchdog is fed between the reads
+CONNACK_TIMEOUT_MS = 5000
+
+class DeyeMqttSession():
+    """
+    MQTT 3.1.1 client session that does not block for long and never resets the device.
+
+    poll() has to be called frequently (between poll cycles via the daemon idle hook). It dispatches
+    incoming messages, pings the broker within the keepalive, retransmits unacknowledged QoS 1
+    publications and reconnects with jittered exponential backoff after a connection loss.
+
+    QoS 1 publications are queued and sent with at most 'inflight_window' of them unacknowledged.
+    Publications in flight during a connection loss are sent again after the reconnect.
+    """
+
+    def __init__(self, config: DeyeMqttConfig, client_id, watchdog: DeyeWatchdog = None):
+        self.config = config
+        self.client_id = client_id
+        self.watchdog = watchdog
+        self.reconnects = 0
+        self.dropped = 0
+        self.__socket = None
+        self.__poller = None
+        self.__buffer = bytearray()
+        self.__subscriptions = {}
+        self.__queue = []
+        self.__in_flight = {}
+        self.__packet_id = 0
+        self.__last_sent = 0
+        self.__ping_sent = None
+        self.__backoff_ms = 0
+        self.__next_connect = time.ticks_ms()
+
+    def is_connected(self) -> bool:
+        return self.__socket is not None
+
+    def pending(self) -> int:
+        """
+        QoS 1 publications not acknowledged by the broker yet
+        """
+        return len(self.__queue) + len(self.__in_flight)
+
+    def connect(self) -> bool:
+        """
+        Connects unless connected or the reconnect backoff is still running. Returns True if connected.
+        """
+        if self.__socket:
+            return True
+        if time.ticks_diff(time.ticks_ms(), self.__next_connect) < 0:
+            return False
+        client_socket = None
+        try:
+            address = socket.getaddrinfo(self.config.host, self.config.port)[0][-1]
+            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client_socket.settimeout(SOCKET_TIMEOUT)
+            client_socket.connect(address)
+            client_socket.sendall(mqtt_packet.connect_packet(self.client_id, self.config.username,
+                                                             self.config.password, self.config.keepalive))
+            connack = b''
+            start = time.ticks_ms()
+            while len(connack) < 4:
+                if self.watchdog:
+                    self.watchdog.feed()
+                try:
+                    data = client_socket.recv(4 - len(connack))
+                except OSError:
+                    if time.ticks_diff(time.ticks_ms(), start) >= CONNACK_TIMEOUT_MS:
+                        raise OSError("No CONNACK from broker")
+                    continue
+                if not data:
+                    raise OSError("Connection closed by broker")
+                connack += data
+            if connack[0] != mqtt_packet.CONNACK or connack[3] != 0:
+                raise OSError(f"Connection refused, return code {connack[3]}")
+        except OSError as e:
+            if client_socket:
+                client_socket.close()
+            self.__backoff_ms = min(self.config.reconnect_backoff_max_ms, max(1000, self.__backoff_ms * 2))
+            # Half jitter, so a broker restart is not hit by all clients at once
+            delay_ms = self.__backoff_ms // 2 + (self.__backoff_ms // 2) * random.getrandbits(16) // 65536
+            self.__next_connect = time.ticks_add(time.ticks_ms(), delay_ms)
+            log.error("MQTT connect error: {}, retry in {} ms", e, delay_ms)
+            return False
+
+        self.__socket = client_socket
+        self.__poller = select.poll()
+        self.__poller.register(client_socket, select.POLLIN)
+        self.__buffer = bytearray()
+        self.__ping_sent = None
+        self.__last_sent = time.ticks_ms()
+        self.__backoff_ms = 0
+        log.info("MQTT connected")
+        for topic in self.__subscriptions:
+            self.__send(mqtt_packet.subscribe_packet(self.__next_packet_id(), topic))
+        for entry in self.__in_flight.values():
+            self.__retransmit(entry)
+        return self.__socket is not None
+
+    def reconnect(self) -> bool:
+        """
+        Replaces the connection right away, e.g. after the network link came back. The old socket is
+        considered dead even if no error was seen on it yet, and the backoff starts over.
+        """
+        self.__drop("Network link restored")
+        self.__backoff_ms = 0
+        return self.connect()
+
+    def disconnect(self):
+        if self.__socket:
+            self.__send(mqtt_packet.disconnect_packet())
+        self.__drop(None)
+
+    def subscribe(self, topic, callback):
+        """
+        Subscribes callback(topic, msg) to a topic, the subscription is renewed after every reconnect
+        """
+        if isinstance(topic, str):
+            topic = topic.encode()
+        self.__subscriptions[topic] = callback
+        if self.connect():
+            self.__send(mqtt_packet.subscribe_packet(self.__next_packet_id(), topic))
+
+    def publish(self, topic, payload, retain: bool = False, qos: int = None):
+        """
+        Publishes with QoS 0 if connected, or queues a QoS 1 publication. Returns False if a QoS 0 publication
+        was not sent. QoS 1 publications are always queued, a full queue makes room by dropping its oldest
+        publication (counted in 'dropped').
+        """
+        if qos is None:
+            qos = self.config.qos
+        if not qos:
+            if isinstance(payload, str):
+                payload = payload.encode()
+            # Header and payload are sent separately, a payload in a reused buffer is not copied
+            return self.connect() and self.__send(mqtt_packet.publish_header(topic, len(payload), 0, retain)) \
+                and self.__send(payload)
+        if len(self.__queue) >= self.config.queue_size:
+            dropped_topic = self.__queue.pop(0)[0]
+            self.dropped += 1
+            log.warning("MQTT queue full, dropped publication to {}", dropped_topic)
+        self.__queue.append((topic, payload, retain))
+        if self.connect():
+            self.__fill_window()
+        return True
+
+    def poll(self):
+        """
+        Receives and dispatches incoming packets and schedules pings, retransmits and reconnects
+        """
+        if not self.connect():
+            return
+        while self.__socket and self.__poller.poll(0):
+            try:
+                data = self.__socket.recv(256)
+            except OSError as e:
+                self.__drop(e)
+                return
+            if not data:
+                self.__drop("Connection closed by broker")
+                return
+            self.__buffer += data
+            self.__receive()
+        now = time.ticks_ms()
+        for entry in self.__in_flight.values():
+            if self.__socket and time.ticks_diff(now, entry[1]) >= self.config.retransmit_ms:
+                self.__retransmit(entry)
+        half_keepalive_ms = self.config.keepalive * 500
+        if self.__ping_sent is not None:
+            if time.ticks_diff(now, self.__ping_sent) > half_keepalive_ms:
+                self.__drop("No ping response")
+        elif self.__socket and time.ticks_diff(now, self.__last_sent) >= half_keepalive_ms:
+            if self.__send(mqtt_packet.pingreq_packet()):
+                self.__ping_sent = now
+        self.__fill_window()
+
+    def flush(self, timeout_ms: int) -> bool:
+        """
+        Polls until all QoS 1 publications are acknowledged or timeout_ms passed. Returns True if all are.
+        """
+        return self.drain(0, timeout_ms)
+
+    def drain(self, max_pending: int, timeout_ms: int) -> bool:
+        """
+        Polls until at most max_pending QoS 1 publications are unacknowledged or timeout_ms passed
+        """
+        start = time.ticks_ms()
+        while self.pending() > max_pending and time.ticks_diff(time.ticks_ms(), start) < timeout_ms:
+            self.poll()
+            if self.watchdog:
+                self.watchdog.feed()
+            if self.pending() > max_pending:
+                time.sleep_ms(10)
+        return self.pending() <= max_pending
+
+    def __receive(self):
+        length = mqtt_packet.packet_length(self.__buffer)
+        while length is not None and len(self.__buffer) >= length:
+            packet = self.__buffer[:length]
+            self.__buffer = self.__buffer[length:]
+            first_byte, header_length, remaining = mqtt_packet.decode_header(packet)
+            packet_type = first_byte & 0xf0
+            if packet_type == mqtt_packet.PUBACK:
+                self.__in_flight.pop(int.from_bytes(packet[header_length:header_length + 2], 'big'), None)
+            elif packet_type == mqtt_packet.PINGRESP:
+                self.__ping_sent = None
+            elif packet_type == mqtt_packet.PUBLISH:
+                topic, payload, qos, packet_id = mqtt_packet.parse_publish(first_byte, packet[header_length:])
+                if qos:
+                    self.__send(mqtt_packet.puback_packet(packet_id))
+                callback = self.__subscriptions.get(topic)
+                if callback:
+                    callback(topic, payload)
+            length = mqtt_packet.packet_length(self.__buffer)
+
+    def __fill_window(self):
+        while self.__socket and self.__queue and len(self.__in_flight) < self.config.inflight_window:
+            topic, payload, retain = self.__queue.pop(0)
+            packet_id = self.__next_packet_id()
+            packet = mqtt_packet.publish_packet(topic, payload, 1, retain, packet_id)
+            self.__in_flight[packet_id] = [packet, time.ticks_ms()]
+            self.__send(packet)
+
+    def __retransmit(self, entry):
+        # Set the DUP flag, the broker may have received the first copy
+        entry[0][0] |= 0x08
+        entry[1] = time.ticks_ms()
+        self.__send(entry[0])
+
+    def __next_packet_id(self) -> int:
+        while True:
+            self.__packet_id = self.__packet_id % 0xffff + 1
+            if self.__packet_id not in self.__in_flight:
+                return self.__packet_id
+
+    def __send(self, data) -> bool:
+        if not self.__socket:
+            return False
+        try:
+            self.__socket.sendall(data)
+        except OSError as e:
+            self.__drop(e)
+            return False
+        self.__last_sent = time.ticks_ms()
+        return True
+
+    def __drop(self, reason):
+        if self.__socket:
+            if reason:
+                log.warning("MQTT connection lost: {}", reason)
+            self.__poller.unregister(self.__socket)
+            self.__socket.close()
+            self.__socket = None
+            self.reconnects += 1
+        # The first reconnect is attempted right away, the backoff grows with failed attempts
+        self.__next_connect = time.ticks_ms()
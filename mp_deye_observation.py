@@ -21,15 +21,51 @@ import time
 
 class Observation():
     """
-    Models Solar Inverter sensor reading.
+    Models Solar Inverter sensor reading, stamped with the monotonic DeyeClock.ticks_ms() of its poll cycle.
     """
 
-    def __init__(self, sensor: Sensor, timestamp: tuple, value):
+    def __init__(self, sensor: Sensor, ticks_ms: int, value):
         self.sensor = sensor
-        self.timestamp = timestamp
+        self.ticks_ms = ticks_ms
         self.value = value
 
     def value_as_str(self):
         return self.sensor.format_value(self.value)
 
 
+
+
+class ObservationSlots():
+    """
+    One reusable Observation per sensor, allocated at startup.
+
+    decode() overwrites the slots in place with the values of a poll cycle, iterating yields the slots
+    holding a value. All consumers (publisher, aggregator, derived metrics, HTTP server) read the same
+    objects, so a poll cycle allocates no observations and no list, and the HTTP server keeping the last
+    cycle does not keep a second generation alive while the next one is decoded.
+    """
+
+    def __init__(self, sensors: list):
+        self.slots = [Observation(sensor, 0, None) for sensor in sensors]
+        self.count = 0
+
+    def decode(self, registers: dict, ticks_ms: int) -> int:
+        """
+        Decodes all sensors from the registers of a poll cycle, returns the number of values
+        """
+        count = 0
+        for slot in self.slots:
+            slot.value = slot.sensor.read_value(registers)
+            slot.ticks_ms = ticks_ms
+            if slot.value is not None:
+                count += 1
+        self.count = count
+        return count
+
+    def __iter__(self):
+        for slot in self.slots:
+            if slot.value is not None:
+                yield slot
+
+    def __len__(self) -> int:
+        return self.count
@@ -0,0 +1,98 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+import json
+import time
+
+from mp_deye_config import DeyeConfig
+from mp_deye_error import DeyeError
+from mp_deye_modbus import DeyeModbus
+from mp_deye_sensors import ac_active_power_sensor
+from mp_deye_log import log
+
+class DeyePowerController():
+    """
+    Closed loop zero export control.
+
+    Each grid meter reading is compared with the export setpoint. If the deviation exceeds the
+    hysteresis, the fast path reads only the AC active power of the inverter and writes a new
+    active power limit (percent of rated power). The fast path is rate limited to protect the EEPROM
+    and the Modbus link, and skipped while the limit already sits at the bound the deviation pushes to.
+    """
+
+    def __init__(self, config: DeyeConfig, modbus: DeyeModbus):
+        self.config = config.power_control
+        self.modbus = modbus
+        self.limit_percent = None
+        self.writes = 0
+        self.last_latency_ms = None
+        self.__last_attempt = None
+
+    def on_grid_message(self, topic, msg):
+        """
+        MQTT callback of the grid meter topic
+        """
+        try:
+            value = json.loads(msg)
+            if self.config.grid_json_key:
+                for key in self.config.grid_json_key.split('.'):
+                    value = value[key]
+            grid_power = float(value)
+        except (ValueError, KeyError, TypeError):
+            log.warning("Power control: unexpected grid meter payload {}", str(msg))
+            return
+        self.on_grid_power(grid_power)
+
+    def on_grid_power(self, grid_power: float) -> bool:
+        """
+        Reacts to a grid power reading (W, positive = import, negative = export).
+        Returns True if a new limit was written.
+        """
+        start = time.ticks_ms()
+        error = -grid_power - self.config.export_setpoint
+        if abs(error) <= self.config.hysteresis:
+            return False
+        if (error < 0 and self.limit_percent == 100) or (error > 0 and self.limit_percent == 0):
+            return False
+        if self.__last_attempt is not None and \
+                time.ticks_diff(start, self.__last_attempt) < self.config.min_write_interval * 1000:
+            log.debug("Power control: skipped, rate limit")
+            return False
+        self.__last_attempt = start
+        try:
+            if self.limit_percent is None:
+                self.limit_percent = self.__read_limit()
+            registers = self.modbus.read_registers(ac_active_power_sensor.reg_address, ac_active_power_sensor.reg_address + 1)
+            ac_power = ac_active_power_sensor.read_value(registers)
+            limit_percent = int(max(0, min(100, (ac_power - error) * 100 / self.config.rated_power + 0.5)))
+            if limit_percent == self.limit_percent:
+                return False
+            self.modbus.write_register(self.config.limit_register, limit_percent * self.config.limit_scale)
+        except DeyeError as e:
+            log.warning("Power control: inverter not reachable ({}: {})", e.kind, e)
+            return False
+        self.last_latency_ms = time.ticks_diff(time.ticks_ms(), start)
+        self.limit_percent = limit_percent
+        self.writes += 1
+        log.info("Power control: grid {:.0f} W, inverter {:.0f} W, limit set to {} % in {} ms", grid_power, ac_power, limit_percent, self.last_latency_ms)
+        return True
+
+    def __read_limit(self) -> int:
+        reg = self.config.limit_register
+        registers = self.modbus.read_registers(reg, reg)
+        return int.from_bytes(registers[reg], 'big') // self.config.limit_scale
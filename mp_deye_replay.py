@@ -0,0 +1,150 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+# Replays a capture file (DEYE_CAPTURE_FILE) through the Modbus parsing and the sensor stack at full speed,
+# on a PC (CPython or MicroPython unix port) or on the device:
+#   python3 mp_deye_replay.py <capture file> [golden file]
+# Prints frames/s and the decode time per frame. With a golden file the decoded values of every poll cycle are
+# compared against it and the exit code tells the result. A golden file that does not exist yet is written.
+
+import sys
+
+import mp_deye_host
+mp_deye_host.install()
+
+import time
+
+from mp_deye_capture import read_capture_header, read_capture_records
+from mp_deye_config import DeyeConfig
+from mp_deye_error import DeyeError
+from mp_deye_modbus import DeyeModbus
+from mp_deye_sensors import sensor_list
+
+class DeyeReplay():
+    """
+    Feeds captured read responses through DeyeModbus parsing and decodes all sensors once per poll cycle.
+    A poll cycle ends when a register block is read the second time.
+    """
+
+    def __init__(self, config: DeyeConfig, sensors: list = sensor_list):
+        self.config = config
+        # sensor_list is a set, a fixed order keeps the golden output stable
+        self.sensors = sorted(sensors, key=lambda s: s.name)
+        self.frames = 0
+        self.errors = 0
+        self.cycles = 0
+        self.parse_us = 0
+        self.decode_us = 0
+        self.elapsed_us = 0
+
+    def replay(self, path: str) -> list:
+        """
+        Replays a capture file, returns one line with the decoded sensor values per poll cycle
+        """
+        lines = []
+        start = time.ticks_us()
+        with open(path, 'rb') as f:
+            self.config.logger.protocol = read_capture_header(f)
+            modbus = DeyeModbus(self.config, None)
+            registers = {}
+            blocks = set()
+            timestamp = 0
+            for ticks_ms, record_time, req_frame, resp_frame in read_capture_records(f):
+                request = modbus.transport.extract_request(req_frame)
+                if len(request) < 6 or request[1] != 0x03:
+                    # Only reads are decoded, writes are part of the traffic but carry no readings
+                    continue
+                first_reg = int.from_bytes(request[2:4], 'big')
+                last_reg = first_reg + int.from_bytes(request[4:6], 'big') - 1
+                if (first_reg, last_reg) in blocks:
+                    lines.append(self.__decode(timestamp, registers))
+                    registers = {}
+                    blocks = set()
+                blocks.add((first_reg, last_reg))
+                timestamp = record_time
+                self.frames += 1
+                parse_start = time.ticks_us()
+                try:
+                    registers.update(modbus.parse_read_response(resp_frame, first_reg, last_reg))
+                except DeyeError:
+                    self.errors += 1
+                self.parse_us += time.ticks_diff(time.ticks_us(), parse_start)
+            if blocks:
+                lines.append(self.__decode(timestamp, registers))
+        self.elapsed_us = time.ticks_diff(time.ticks_us(), start)
+        return lines
+
+    def __decode(self, timestamp: int, registers: dict) -> str:
+        decode_start = time.ticks_us()
+        values = []
+        for sensor in self.sensors:
+            value = sensor.read_value(registers)
+            if value is not None:
+                values.append(f'{sensor.name}={sensor.format_value(value)}')
+        self.decode_us += time.ticks_diff(time.ticks_us(), decode_start)
+        self.cycles += 1
+        return f'{timestamp} ' + ';'.join(values)
+
+    def print_stats(self):
+        elapsed_s = max(1, self.elapsed_us) / 1000000
+        frames = max(1, self.frames)
+        print(f"{self.frames} frames ({self.errors} invalid) in {self.cycles} poll cycles, {self.elapsed_us / 1000:.1f} ms")
+        print(f"{self.frames / elapsed_s:.0f} frames/s, parse {self.parse_us / frames:.1f} us/frame, "
+              f"sensor decode {self.decode_us / max(1, self.cycles):.1f} us/cycle")
+
+
+def compare_golden(lines: list, golden_path: str) -> bool:
+    """
+    Compares the replayed lines with a golden file, writes the golden file if it does not exist
+    """
+    try:
+        with open(golden_path) as f:
+            golden = [line.rstrip('\n') for line in f]
+    except OSError:
+        with open(golden_path, 'w') as f:
+            for line in lines:
+                f.write(line + '\n')
+        print(f"Golden file {golden_path} written, {len(lines)} poll cycles")
+        return True
+    for i, line in enumerate(lines):
+        if i >= len(golden) or golden[i] != line:
+            print(f"Poll cycle {i} differs from golden file:")
+            print(f"  golden:   {golden[i] if i < len(golden) else '<missing>'}")
+            print(f"  replayed: {line}")
+            return False
+    if len(golden) != len(lines):
+        print(f"Golden file has {len(golden)} poll cycles, replayed {len(lines)}")
+        return False
+    print(f"Golden file {golden_path} matches, {len(lines)} poll cycles")
+    return True
+
+
+def main(args):
+    if not args:
+        print("Usage: mp_deye_replay.py <capture file> [golden file]")
+        sys.exit(1)
+    config = DeyeConfig.from_env()
+    replay = DeyeReplay(config)
+    lines = replay.replay(args[0])
+    replay.print_stats()
+    if len(args) > 1 and not compare_golden(lines, args[1]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
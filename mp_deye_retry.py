@@ -0,0 +1,107 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+import random
+import time
+
+from mp_deye_error import DeyeError, DeyeCircuitOpenError
+from mp_deye_log import log
+
+class DeyeRetryPolicy():
+    """
+    Retries a logger request on retryable errors, waiting a jittered exponential backoff in between.
+
+    The backoff before retry n is a random value between 0 and min(backoff_max_ms, backoff_base_ms * 2^n)
+    ("full jitter"), so several devices restarting together do not hit their loggers in lockstep.
+    """
+
+    def __init__(self, attempts: int, backoff_base_ms: int, backoff_max_ms: int):
+        self.attempts = max(1, attempts)
+        self.backoff_base_ms = backoff_base_ms
+        self.backoff_max_ms = backoff_max_ms
+
+    def backoff_ms(self, retry: int) -> int:
+        cap = min(self.backoff_max_ms, self.backoff_base_ms << retry)
+        return cap * random.getrandbits(16) // 65536
+
+    def run(self, request, watchdog):
+        """
+        Calls request() until it succeeds, fails with a non-retryable error or attempts are exhausted.
+        The last error is raised.
+        """
+        retry = 0
+        while True:
+            try:
+                return request()
+            except DeyeError as e:
+                retry += 1
+                if not e.retryable or retry >= self.attempts:
+                    raise
+                delay_ms = self.backoff_ms(retry - 1)
+                log.warning("Request failed ({}: {}), retry {} in {} ms", e.kind, e, retry, delay_ms)
+                while delay_ms > 0:
+                    watchdog.feed()
+                    time.sleep_ms(min(delay_ms, 500))
+                    delay_ms -= 500
+
+
+class DeyeCircuitBreaker():
+    """
+    Stops sending requests to a logger that failed repeatedly.
+
+    After failure_threshold consecutive failed requests the circuit opens and requests are rejected
+    without network traffic. Once probe_interval seconds have passed a single probe request is let
+    through (half-open). A successful probe closes the circuit, a failed one opens it again.
+    """
+
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+    def __init__(self, failure_threshold: int, probe_interval: int):
+        self.failure_threshold = failure_threshold
+        self.probe_interval_ms = probe_interval * 1000
+        self.state = DeyeCircuitBreaker.CLOSED
+        self.failures = 0
+        self.__opened_at = 0
+
+    def check(self):
+        """
+        Raises DeyeCircuitOpenError if the request must not be sent
+        """
+        if self.state == DeyeCircuitBreaker.OPEN:
+            if time.ticks_diff(time.ticks_ms(), self.__opened_at) < self.probe_interval_ms:
+                raise DeyeCircuitOpenError("Circuit open, logger is not probed before the probe interval passed")
+            self.state = DeyeCircuitBreaker.HALF_OPEN
+
+    def record_success(self):
+        self.state = DeyeCircuitBreaker.CLOSED
+        self.failures = 0
+
+    def reset(self):
+        """
+        Forgets the failures, e.g. when they were caused by a Wi-Fi outage rather than the logger
+        """
+        self.state = DeyeCircuitBreaker.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == DeyeCircuitBreaker.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = DeyeCircuitBreaker.OPEN
+            self.__opened_at = time.ticks_ms()
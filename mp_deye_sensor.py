@@ -23,13 +23,16 @@ class Sensor():
     Models solar inverter sensor.
 
     This is an abstract class. Method 'read_value' must be provided by the extending subclass. 
+    unit and device_class describe the value for Home Assistant, e.g. 'W' and 'power'.
     """
 
-    def __init__(self, name: str, mqtt_topic_suffix='', print_format='{:s}', groups={}):
+    def __init__(self, name: str, mqtt_topic_suffix='', print_format='{:s}', groups={}, unit='', device_class=''):
         self.name = name
         self.mqtt_topic_suffix = mqtt_topic_suffix
         self.print_format = print_format
         self.groups = groups
+        self.unit = unit
+        self.device_class = device_class
 
     # @abstractmethod
     def read_value(self, registers: dict[int, int]):
@@ -44,6 +47,24 @@ class Sensor():
         """
         return self.print_format.format(value)
 
+    def registers(self) -> list[int]:
+        """
+        Returns the addresses of the Modbus registers this sensor reads
+        """
+        return []
+
+    def is_status(self) -> bool:
+        """
+        Checks if this sensor reports an operating state or alarm flags rather than a measurement
+        """
+        return False
+
+    def is_fault(self, value) -> bool:
+        """
+        Checks if the given value of this sensor signals an active inverter fault
+        """
+        return False
+
     def in_any_group(self, active_groups: set[str]) -> bool:
         """
         Checks if this sensor is included in at least one of the given active_groups.
@@ -55,37 +76,47 @@ class Sensor():
 
 class SingleRegisterSensor(Sensor):
     """
-    Solar inverter sensor with value stored as 32-bit integer in a single Modbus register.
+    Solar inverter sensor with value stored as 16-bit integer in a single Modbus register.
+    With signed=True the register holds a two's complement value, e.g. the battery power of hybrid inverters.
     """
 
     def __init__(
             self, name: str, reg_address: int, factor: float, offset: float = 0,
-            mqtt_topic_suffix='', print_format='{:0.1f}', groups={}):
-        super().__init__(name, mqtt_topic_suffix, print_format, groups)
+            mqtt_topic_suffix='', print_format='{:0.1f}', groups={}, signed=False, unit='', device_class=''):
+        super().__init__(name, mqtt_topic_suffix, print_format, groups, unit, device_class)
         self.reg_address = reg_address
         self.factor = factor
         self.offset = offset
+        self.signed = signed
 
     def read_value(self, registers: dict[int, int]):
         if self.reg_address in registers:
-            reg_value = registers[self.reg_address]
-            return int.from_bytes(reg_value, 'big') * self.factor + self.offset
+            value = int.from_bytes(registers[self.reg_address], 'big')
+            # int.from_bytes of MicroPython has no 'signed' argument
+            if self.signed and value & 0x8000:
+                value -= 0x10000
+            return value * self.factor + self.offset
         else:
             return None
 
+    def registers(self) -> list[int]:
+        return [self.reg_address]
+
 
 class DoubleRegisterSensor(Sensor):
     """
-    Solar inverter sensor with value stored as 64-bit integer in two Modbus registers.
+    Solar inverter sensor with value stored as 32-bit integer in two Modbus registers, low word first.
+    With signed=True the registers hold a two's complement value.
     """
 
     def __init__(
             self, name: str, reg_address: int, factor: float, offset: float = 0,
-            mqtt_topic_suffix='', print_format='{:0.1f}', groups={}):
-        super().__init__(name, mqtt_topic_suffix, print_format, groups)
+            mqtt_topic_suffix='', print_format='{:0.1f}', groups={}, signed=False, unit='', device_class=''):
+        super().__init__(name, mqtt_topic_suffix, print_format, groups, unit, device_class)
         self.reg_address = reg_address
         self.factor = factor
         self.offset = offset
+        self.signed = signed
 
     def read_value(self, registers: dict[int, int]):
         low_word_reg_address = self.reg_address
@@ -93,10 +124,16 @@ class DoubleRegisterSensor(Sensor):
         if low_word_reg_address in registers and high_word_reg_address in registers:
             low_word = registers[low_word_reg_address]
             high_word = registers[high_word_reg_address]
-            return (int.from_bytes(high_word, 'big') * 65536 + int.from_bytes(low_word, 'big')) * self.factor + self.offset
+            value = int.from_bytes(high_word, 'big') * 65536 + int.from_bytes(low_word, 'big')
+            if self.signed and value & 0x80000000:
+                value -= 0x100000000
+            return value * self.factor + self.offset
         else:
             return None
 
+    def registers(self) -> list[int]:
+        return [self.reg_address, self.reg_address + 1]
+
 
 class ComputedPowerSensor(Sensor):
     """
@@ -105,8 +142,8 @@ class ComputedPowerSensor(Sensor):
 
     def __init__(
             self, name: str, voltage_sensor: Sensor, current_sensor: Sensor, mqtt_topic_suffix='',
-            print_format='{:0.1f}', groups={}):
-        super().__init__(name, mqtt_topic_suffix, print_format, groups)
+            print_format='{:0.1f}', groups={}, unit='', device_class=''):
+        super().__init__(name, mqtt_topic_suffix, print_format, groups, unit, device_class)
         self.voltage_sensor = voltage_sensor
         self.current_sensor = current_sensor
 
@@ -118,6 +155,9 @@ class ComputedPowerSensor(Sensor):
         else:
             return None
 
+    def registers(self) -> list[int]:
+        return self.voltage_sensor.registers() + self.current_sensor.registers()
+
 class ComputedSumSensor(Sensor):
     """
     Computes a sum of values read by given list of sensors.
@@ -125,8 +165,8 @@ class ComputedSumSensor(Sensor):
 
     def __init__(
             self, name: str, sensors: list[Sensor], mqtt_topic_suffix='',
-            print_format='{:0.1f}', groups={}):
-        super().__init__(name, mqtt_topic_suffix, print_format, groups)
+            print_format='{:0.1f}', groups={}, unit='', device_class=''):
+        super().__init__(name, mqtt_topic_suffix, print_format, groups, unit, device_class)
         self.sensors = sensors
 
     def read_value(self, registers: dict[int, int]):
@@ -137,3 +177,99 @@ class ComputedSumSensor(Sensor):
                 return None
             result += value
         return result
+
+    def registers(self) -> list[int]:
+        return [reg for s in self.sensors for reg in s.registers()]
+
+
+class StatusSensor(Sensor):
+    """
+    Operating state of the inverter stored as an enumeration in a single Modbus register.
+    """
+
+    def __init__(
+            self, name: str, reg_address: int, states: dict[int, str], fault_states: set[int] = set(),
+            mqtt_topic_suffix='', groups={}):
+        super().__init__(name, mqtt_topic_suffix, '{:d}', groups)
+        self.reg_address = reg_address
+        self.states = states
+        self.fault_states = fault_states
+
+    def read_value(self, registers: dict[int, int]):
+        if self.reg_address in registers:
+            return int.from_bytes(registers[self.reg_address], 'big')
+        else:
+            return None
+
+    def registers(self) -> list[int]:
+        return [self.reg_address]
+
+    def format_value(self, value):
+        return self.states.get(value, 'unknown({:d})'.format(value))
+
+    def is_status(self) -> bool:
+        return True
+
+    def is_fault(self, value) -> bool:
+        return value in self.fault_states
+
+    def format_change(self, old_value, new_value) -> str:
+        return '{} -> {}'.format(self.format_value(old_value), self.format_value(new_value))
+
+
+class BitFieldSensor(Sensor):
+    """
+    Warning or fault words stored in consecutive Modbus registers, decoded into named flags.
+
+    Bit n of the first register is flag n, bit 0 of the second register is flag 16 and so on.
+    Flags missing in 'flags' are named after the inverter display codes: flag_prefix followed by n + 1,
+    e.g. 'F01' for bit 0 of the fault words.
+    """
+
+    def __init__(
+            self, name: str, reg_address: int, count: int, flag_prefix: str, flags: dict[int, str] = {},
+            fault=False, mqtt_topic_suffix='', groups={}):
+        super().__init__(name, mqtt_topic_suffix, '{:d}', groups)
+        self.reg_address = reg_address
+        self.count = count
+        self.flag_prefix = flag_prefix
+        self.flags = flags
+        self.fault = fault
+
+    def read_value(self, registers: dict[int, int]):
+        value = 0
+        for i in range(self.count):
+            reg_address = self.reg_address + i
+            if reg_address not in registers:
+                return None
+            value |= int.from_bytes(registers[reg_address], 'big') << (16 * i)
+        return value
+
+    def registers(self) -> list[int]:
+        return list(range(self.reg_address, self.reg_address + self.count))
+
+    def flag_name(self, bit: int) -> str:
+        return self.flags.get(bit) or '{}{:02d}'.format(self.flag_prefix, bit + 1)
+
+    def active_flags(self, value: int) -> list[str]:
+        """
+        Returns the names of the flags set in value
+        """
+        return [self.flag_name(bit) for bit in range(16 * self.count) if value & (1 << bit)]
+
+    def format_value(self, value):
+        return ','.join(self.active_flags(value)) or 'none'
+
+    def is_status(self) -> bool:
+        return True
+
+    def is_fault(self, value) -> bool:
+        return self.fault and value != 0
+
+    def format_change(self, old_value, new_value) -> str:
+        """
+        Lists the flags raised (+) and cleared (-) between old_value and new_value, e.g. '+F35 -F13'
+        """
+        raised = ['+' + name for name in self.active_flags(new_value & ~old_value)]
+        cleared = ['-' + name for name in self.active_flags(old_value & ~new_value)]
+        return ' '.join(raised + cleared)
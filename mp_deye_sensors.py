@@ -15,104 +15,266 @@
 # specific language governing permissions and limitations
 # under the License.
 
-from mp_deye_sensor import SingleRegisterSensor, ComputedPowerSensor, DoubleRegisterSensor, ComputedSumSensor
+from mp_deye_sensor import SingleRegisterSensor, ComputedPowerSensor, DoubleRegisterSensor, ComputedSumSensor, \
+    StatusSensor, BitFieldSensor
 
 # AC Phase 1
 phase1_voltage_sensor = SingleRegisterSensor(
-    "Phase1 Voltage", 0x49, 0.1, mqtt_topic_suffix='ac/l1_voltage', groups={'string', 'micro'})
+    "Phase1 Voltage", 0x49, 0.1, mqtt_topic_suffix='ac/l1_voltage',
+    unit='V', device_class='voltage', groups={'string', 'micro'})
 phase1_current_sensor = SingleRegisterSensor(
-    "Phase1 Current", 0x4c, 0.1, mqtt_topic_suffix='ac/l1_current', groups={'string', 'micro'})
+    "Phase1 Current", 0x4c, 0.1, mqtt_topic_suffix='ac/l1_current',
+    unit='A', device_class='current', groups={'string', 'micro'})
 phase1_power_sensor = ComputedPowerSensor(
     "Phase1 Power", phase1_voltage_sensor, phase1_current_sensor, mqtt_topic_suffix='ac/l1_power',
-    groups={'string', 'micro'})
+    unit='W', device_class='power', groups={'string', 'micro'})
 
 # AC Phase 2
 phase2_voltage_sensor = SingleRegisterSensor(
-    "Phase2 Voltage", 0x4a, 0.1, mqtt_topic_suffix='ac/l2_voltage', groups={'string'})
+    "Phase2 Voltage", 0x4a, 0.1, mqtt_topic_suffix='ac/l2_voltage',
+    unit='V', device_class='voltage', groups={'string'})
 phase2_current_sensor = SingleRegisterSensor(
-    "Phase2 Current", 0x4d, 0.1, mqtt_topic_suffix='ac/l2_current', groups={'string'})
+    "Phase2 Current", 0x4d, 0.1, mqtt_topic_suffix='ac/l2_current',
+    unit='A', device_class='current', groups={'string'})
 phase2_power_sensor = ComputedPowerSensor("Phase2 Power", phase2_voltage_sensor,
-                                          phase2_current_sensor, mqtt_topic_suffix='ac/l2_power', groups={'string'})
+                                          phase2_current_sensor, mqtt_topic_suffix='ac/l2_power',
+                                          unit='W', device_class='power', groups={'string'})
 
 # AC Phase 3
 phase3_voltage_sensor = SingleRegisterSensor(
-    "Phase3 Voltage", 0x4b, 0.1, mqtt_topic_suffix='ac/l3_voltage', groups={'string'})
+    "Phase3 Voltage", 0x4b, 0.1, mqtt_topic_suffix='ac/l3_voltage',
+    unit='V', device_class='voltage', groups={'string'})
 phase3_current_sensor = SingleRegisterSensor(
-    "Phase3 Current", 0x4e, 0.1, mqtt_topic_suffix='ac/l3_current', groups={'string'})
+    "Phase3 Current", 0x4e, 0.1, mqtt_topic_suffix='ac/l3_current',
+    unit='A', device_class='current', groups={'string'})
 phase3_power_sensor = ComputedPowerSensor("Phase3 Power", phase3_voltage_sensor,
-                                          phase3_current_sensor, mqtt_topic_suffix='ac/l3_power', groups={'string'})
+                                          phase3_current_sensor, mqtt_topic_suffix='ac/l3_power',
+                                          unit='W', device_class='power', groups={'string'})
 
 # AC Freq
-ac_freq_sensor = SingleRegisterSensor("AC Freq", 0x4f, 0.01, mqtt_topic_suffix='ac/ac_freq')
+ac_freq_sensor = SingleRegisterSensor("AC Freq", 0x4f, 0.01, mqtt_topic_suffix='ac/ac_freq',
+                                      unit='Hz', device_class='frequency', groups={'string', 'micro'})
 
 # Production today
-production_today_sensor = SingleRegisterSensor("Production today", 0x3c, 0.1, mqtt_topic_suffix='day_energy')
-uptime_sensor = SingleRegisterSensor("Uptime", 0x3e, 1, mqtt_topic_suffix='uptime')
+production_today_sensor = SingleRegisterSensor("Production today", 0x3c, 0.1, mqtt_topic_suffix='day_energy',
+                                               unit='kWh', device_class='energy', groups={'string', 'micro'})
+uptime_sensor = SingleRegisterSensor("Uptime", 0x3e, 1, mqtt_topic_suffix='uptime',
+                                     unit='min', device_class='duration', groups={'string', 'micro'})
 
 # DC PV1
-pv1_voltage_sensor = SingleRegisterSensor("PV1 Voltage", 0x6d, 0.1, mqtt_topic_suffix='dc/pv1_voltage')
-pv1_current_sensor = SingleRegisterSensor("PV1 Current", 0x6e, 0.1, mqtt_topic_suffix='dc/pv1_current')
+pv1_voltage_sensor = SingleRegisterSensor("PV1 Voltage", 0x6d, 0.1, mqtt_topic_suffix='dc/pv1_voltage',
+                                          unit='V', device_class='voltage', groups={'string', 'micro'})
+pv1_current_sensor = SingleRegisterSensor("PV1 Current", 0x6e, 0.1, mqtt_topic_suffix='dc/pv1_current',
+                                          unit='A', device_class='current', groups={'string', 'micro'})
 pv1_power_sensor = ComputedPowerSensor("PV1 Power", pv1_voltage_sensor,
-                                       pv1_current_sensor, mqtt_topic_suffix='dc/pv1_power')
+                                       pv1_current_sensor, mqtt_topic_suffix='dc/pv1_power',
+                                       unit='W', device_class='power', groups={'string', 'micro'})
 pv1_daily_sensor = SingleRegisterSensor("PV1 Production today", 0x41, 0.1,
-                                        mqtt_topic_suffix='dc/pv1_day_energy', groups={'micro'})
+                                        mqtt_topic_suffix='dc/pv1_day_energy',
+                                        unit='kWh', device_class='energy', groups={'micro'})
 pv1_total_sensor = DoubleRegisterSensor(
-    "PV1 Total", 0x45, 0.1, mqtt_topic_suffix='dc/pv1_total_energy', groups={'micro'})
+    "PV1 Total", 0x45, 0.1, mqtt_topic_suffix='dc/pv1_total_energy',
+    unit='kWh', device_class='energy', groups={'micro'})
 
 # DC PV2
-pv2_voltage_sensor = SingleRegisterSensor("PV2 Voltage", 0x6f, 0.1, mqtt_topic_suffix='dc/pv2_voltage')
-pv2_current_sensor = SingleRegisterSensor("PV2 Current", 0x70, 0.1, mqtt_topic_suffix='dc/pv2_current')
+pv2_voltage_sensor = SingleRegisterSensor("PV2 Voltage", 0x6f, 0.1, mqtt_topic_suffix='dc/pv2_voltage',
+                                          unit='V', device_class='voltage', groups={'string', 'micro'})
+pv2_current_sensor = SingleRegisterSensor("PV2 Current", 0x70, 0.1, mqtt_topic_suffix='dc/pv2_current',
+                                          unit='A', device_class='current', groups={'string', 'micro'})
 pv2_power_sensor = ComputedPowerSensor("PV2 Power", pv2_voltage_sensor,
-                                       pv2_current_sensor, mqtt_topic_suffix='dc/pv2_power')
+                                       pv2_current_sensor, mqtt_topic_suffix='dc/pv2_power',
+                                       unit='W', device_class='power', groups={'string', 'micro'})
 pv2_daily_sensor = SingleRegisterSensor("PV2 Production today", 0x42, 0.1,
-                                        mqtt_topic_suffix='dc/pv2_day_energy', groups={'micro'})
+                                        mqtt_topic_suffix='dc/pv2_day_energy',
+                                        unit='kWh', device_class='energy', groups={'micro'})
 pv2_total_sensor = DoubleRegisterSensor(
-    "PV2 Total", 0x47, 0.1, mqtt_topic_suffix='dc/pv2_total_energy', groups={'micro'})
+    "PV2 Total", 0x47, 0.1, mqtt_topic_suffix='dc/pv2_total_energy',
+    unit='kWh', device_class='energy', groups={'micro'})
 
 # DC PV3
-pv3_voltage_sensor = SingleRegisterSensor("PV3 Voltage", 0x71, 0.1, mqtt_topic_suffix='dc/pv3_voltage')
-pv3_current_sensor = SingleRegisterSensor("PV3 Current", 0x72, 0.1, mqtt_topic_suffix='dc/pv3_current')
+pv3_voltage_sensor = SingleRegisterSensor("PV3 Voltage", 0x71, 0.1, mqtt_topic_suffix='dc/pv3_voltage',
+                                          unit='V', device_class='voltage', groups={'string', 'micro'})
+pv3_current_sensor = SingleRegisterSensor("PV3 Current", 0x72, 0.1, mqtt_topic_suffix='dc/pv3_current',
+                                          unit='A', device_class='current', groups={'string', 'micro'})
 pv3_power_sensor = ComputedPowerSensor("PV3 Power", pv3_voltage_sensor,
-                                       pv3_current_sensor, mqtt_topic_suffix='dc/pv3_power')
+                                       pv3_current_sensor, mqtt_topic_suffix='dc/pv3_power',
+                                       unit='W', device_class='power', groups={'string', 'micro'})
 pv3_daily_sensor = SingleRegisterSensor("PV3 Production today", 0x43, 0.1,
-                                        mqtt_topic_suffix='dc/pv3_day_energy', groups={'micro'})
+                                        mqtt_topic_suffix='dc/pv3_day_energy',
+                                        unit='kWh', device_class='energy', groups={'micro'})
 pv3_total_sensor = DoubleRegisterSensor(
-    "PV3 Total", 0x4a, 0.1, mqtt_topic_suffix='dc/pv3_total_energy', groups={'micro'})
+    "PV3 Total", 0x4a, 0.1, mqtt_topic_suffix='dc/pv3_total_energy',
+    unit='kWh', device_class='energy', groups={'micro'})
 
 # DC PV4
-pv4_voltage_sensor = SingleRegisterSensor("PV4 Voltage", 0x73, 0.1, mqtt_topic_suffix='dc/pv4_voltage')
-pv4_current_sensor = SingleRegisterSensor("PV4 Current", 0x74, 0.1, mqtt_topic_suffix='dc/pv4_current')
+pv4_voltage_sensor = SingleRegisterSensor("PV4 Voltage", 0x73, 0.1, mqtt_topic_suffix='dc/pv4_voltage',
+                                          unit='V', device_class='voltage', groups={'string', 'micro'})
+pv4_current_sensor = SingleRegisterSensor("PV4 Current", 0x74, 0.1, mqtt_topic_suffix='dc/pv4_current',
+                                          unit='A', device_class='current', groups={'string', 'micro'})
 pv4_power_sensor = ComputedPowerSensor("PV4 Power", pv4_voltage_sensor,
-                                       pv4_current_sensor, mqtt_topic_suffix='dc/pv4_power')
+                                       pv4_current_sensor, mqtt_topic_suffix='dc/pv4_power',
+                                       unit='W', device_class='power', groups={'string', 'micro'})
 pv4_daily_sensor = SingleRegisterSensor("PV4 Production today", 0x44, 0.1,
-                                        mqtt_topic_suffix='dc/pv4_day_energy', groups={'micro'})
+                                        mqtt_topic_suffix='dc/pv4_day_energy',
+                                        unit='kWh', device_class='energy', groups={'micro'})
 pv4_total_sensor = DoubleRegisterSensor(
-    "PV4 Total", 0x4d, 0.1, mqtt_topic_suffix='dc/pv4_total_energy', groups={'micro'})
+    "PV4 Total", 0x4d, 0.1, mqtt_topic_suffix='dc/pv4_total_energy',
+    unit='kWh', device_class='energy', groups={'micro'})
 
 # Power sensors
 operating_power_sensor = SingleRegisterSensor(
-    "Operating Power", 0x50, 0.1, mqtt_topic_suffix='operating_power', groups={'string', 'micro'})
+    "Operating Power", 0x50, 0.1, mqtt_topic_suffix='operating_power',
+    unit='W', device_class='power', groups={'string', 'micro'})
 string_dc_power_sensor = SingleRegisterSensor(
-    "DC Total Power", 0x52, 0.1, mqtt_topic_suffix='dc/dc_total_power', groups={'string'})
+    "DC Total Power", 0x52, 0.1, mqtt_topic_suffix='dc/dc_total_power',
+    unit='W', device_class='power', groups={'string'})
 micro_dc_power_sensor = ComputedSumSensor(
     "DC Total Power", {pv1_power_sensor, pv2_power_sensor, pv3_power_sensor, pv4_power_sensor},
-    mqtt_topic_suffix='dc/dc_total_power', groups={'micro'})
+    mqtt_topic_suffix='dc/dc_total_power', unit='W', device_class='power', groups={'micro'})
 ac_apparent_power_sensor = SingleRegisterSensor(
-    "AC Apparent Power", 0x54, 0.1, mqtt_topic_suffix='ac/ac_apparent_power', groups={'string'})
+    "AC Apparent Power", 0x54, 0.1, mqtt_topic_suffix='ac/ac_apparent_power',
+    unit='VA', device_class='apparent_power', groups={'string'})
 ac_active_power_sensor = DoubleRegisterSensor(
-    "AC Active Power", 0x56, 0.1, mqtt_topic_suffix='ac/ac_active_power', groups={'string', 'micro'})
+    "AC Active Power", 0x56, 0.1, mqtt_topic_suffix='ac/ac_active_power',
+    unit='W', device_class='power', groups={'string', 'micro'})
 ac_reactive_power_sensor = SingleRegisterSensor(
-    "AC Reactive Power", 0x58, 0.1, mqtt_topic_suffix='ac/ac_reactive_power', groups={'string'})
+    "AC Reactive Power", 0x58, 0.1, mqtt_topic_suffix='ac/ac_reactive_power',
+    unit='var', device_class='reactive_power', groups={'string'})
 production_total_sensor = DoubleRegisterSensor(
-    "Production Total", 0x3f, 0.1, mqtt_topic_suffix='total_energy', groups={'string', 'micro'})
+    "Production Total", 0x3f, 0.1, mqtt_topic_suffix='total_energy',
+    unit='kWh', device_class='energy', groups={'string', 'micro'})
 
 # Temperature sensors
 string_radiator_temp_sensor = SingleRegisterSensor("Radiator temperature", 0x5a, 0.1,
-                                            offset=-100, mqtt_topic_suffix='radiator_temp', groups={'string'})
+                                            offset=-100, mqtt_topic_suffix='radiator_temp',
+                                            unit='°C', device_class='temperature', groups={'string'})
 micro_radiator_temp_sensor = SingleRegisterSensor("Radiator temperature", 0x5a, 0.01,
-                                            offset=-10, mqtt_topic_suffix='radiator_temp', groups={'micro'})
+                                            offset=-10, mqtt_topic_suffix='radiator_temp',
+                                            unit='°C', device_class='temperature', groups={'micro'})
 igbt_temp_sensor = SingleRegisterSensor("IGBT temperature", 0x5b, 0.1, offset=-100,
-                                        mqtt_topic_suffix='igbt_temp', groups={'string'})
+                                        mqtt_topic_suffix='igbt_temp',
+                                        unit='°C', device_class='temperature', groups={'string'})
+
+# Status and alarm sensors
+running_status_sensor = StatusSensor("Running status", 0x3b,
+                                     {0: 'standby', 1: 'self-check', 2: 'normal', 3: 'warning', 4: 'fault'},
+                                     fault_states={4}, mqtt_topic_suffix='status/running', groups={'string', 'micro'})
+warning_sensor = BitFieldSensor("Warnings", 0x65, 2, 'W', mqtt_topic_suffix='status/warnings',
+                                groups={'string', 'micro'})
+fault_sensor = BitFieldSensor("Faults", 0x67, 4, 'F', fault=True, mqtt_topic_suffix='status/faults',
+                              groups={'string', 'micro'})
+
+# Hybrid inverters: battery, grid CT, load and BMS registers
+# Powers are signed: battery power is positive while discharging, grid power is positive while importing
+battery_temp_sensor = SingleRegisterSensor("Battery temperature", 586, 0.1, offset=-100,
+                                           mqtt_topic_suffix='battery/temperature',
+                                           unit='°C', device_class='temperature', groups={'hybrid'})
+battery_voltage_sensor = SingleRegisterSensor("Battery voltage", 587, 0.01,
+                                              mqtt_topic_suffix='battery/voltage',
+                                              unit='V', device_class='voltage', print_format='{:0.2f}',
+                                              groups={'hybrid'})
+battery_soc_sensor = SingleRegisterSensor("Battery SOC", 588, 1, mqtt_topic_suffix='battery/soc',
+                                          unit='%', device_class='battery',
+                                          print_format='{:0.0f}', groups={'hybrid'})
+battery_power_sensor = SingleRegisterSensor("Battery power", 590, 1, mqtt_topic_suffix='battery/power',
+                                            unit='W', device_class='power',
+                                            print_format='{:0.0f}', groups={'hybrid'}, signed=True)
+battery_current_sensor = SingleRegisterSensor("Battery current", 591, 0.01, mqtt_topic_suffix='battery/current',
+                                              unit='A', device_class='current',
+                                              print_format='{:0.2f}', groups={'hybrid'}, signed=True)
+battery_daily_charge_sensor = SingleRegisterSensor("Battery daily charge", 514, 0.1,
+                                                   mqtt_topic_suffix='battery/day_charge_energy',
+                                                   unit='kWh', device_class='energy', groups={'hybrid'})
+battery_daily_discharge_sensor = SingleRegisterSensor("Battery daily discharge", 515, 0.1,
+                                                      mqtt_topic_suffix='battery/day_discharge_energy',
+                                                      unit='kWh', device_class='energy', groups={'hybrid'})
+grid_internal_ct_l1_power_sensor = SingleRegisterSensor(
+    "Grid internal CT L1 power", 604, 1, mqtt_topic_suffix='grid/internal_ct_l1_power',
+    unit='W', device_class='power', print_format='{:0.0f}', groups={'hybrid'}, signed=True)
+grid_internal_ct_l2_power_sensor = SingleRegisterSensor(
+    "Grid internal CT L2 power", 605, 1, mqtt_topic_suffix='grid/internal_ct_l2_power',
+    unit='W', device_class='power', print_format='{:0.0f}', groups={'hybrid'}, signed=True)
+grid_internal_ct_l3_power_sensor = SingleRegisterSensor(
+    "Grid internal CT L3 power", 606, 1, mqtt_topic_suffix='grid/internal_ct_l3_power',
+    unit='W', device_class='power', print_format='{:0.0f}', groups={'hybrid'}, signed=True)
+grid_internal_ct_power_sensor = SingleRegisterSensor(
+    "Grid internal CT power", 607, 1, mqtt_topic_suffix='grid/internal_ct_power',
+    unit='W', device_class='power', print_format='{:0.0f}', groups={'hybrid'}, signed=True)
+grid_external_ct_l1_power_sensor = SingleRegisterSensor(
+    "Grid external CT L1 power", 616, 1, mqtt_topic_suffix='grid/external_ct_l1_power',
+    unit='W', device_class='power', print_format='{:0.0f}', groups={'hybrid'}, signed=True)
+grid_external_ct_l2_power_sensor = SingleRegisterSensor(
+    "Grid external CT L2 power", 617, 1, mqtt_topic_suffix='grid/external_ct_l2_power',
+    unit='W', device_class='power', print_format='{:0.0f}', groups={'hybrid'}, signed=True)
+grid_external_ct_l3_power_sensor = SingleRegisterSensor(
+    "Grid external CT L3 power", 618, 1, mqtt_topic_suffix='grid/external_ct_l3_power',
+    unit='W', device_class='power', print_format='{:0.0f}', groups={'hybrid'}, signed=True)
+grid_external_ct_power_sensor = SingleRegisterSensor(
+    "Grid external CT power", 619, 1, mqtt_topic_suffix='grid/external_ct_power',
+    unit='W', device_class='power', print_format='{:0.0f}', groups={'hybrid'}, signed=True)
+grid_power_sensor = SingleRegisterSensor("Grid power", 625, 1, mqtt_topic_suffix='grid/power',
+                                         unit='W', device_class='power',
+                                         print_format='{:0.0f}', groups={'hybrid'}, signed=True)
+grid_daily_import_sensor = SingleRegisterSensor("Grid daily import", 520, 0.1,
+                                                mqtt_topic_suffix='grid/day_import_energy',
+                                                unit='kWh', device_class='energy', groups={'hybrid'})
+grid_daily_export_sensor = SingleRegisterSensor("Grid daily export", 521, 0.1,
+                                                mqtt_topic_suffix='grid/day_export_energy',
+                                                unit='kWh', device_class='energy', groups={'hybrid'})
+load_l1_power_sensor = SingleRegisterSensor("Load L1 power", 650, 1, mqtt_topic_suffix='load/l1_power',
+                                            unit='W', device_class='power',
+                                            print_format='{:0.0f}', groups={'hybrid'}, signed=True)
+load_l2_power_sensor = SingleRegisterSensor("Load L2 power", 651, 1, mqtt_topic_suffix='load/l2_power',
+                                            unit='W', device_class='power',
+                                            print_format='{:0.0f}', groups={'hybrid'}, signed=True)
+load_l3_power_sensor = SingleRegisterSensor("Load L3 power", 652, 1, mqtt_topic_suffix='load/l3_power',
+                                            unit='W', device_class='power',
+                                            print_format='{:0.0f}', groups={'hybrid'}, signed=True)
+load_power_sensor = SingleRegisterSensor("Load power", 653, 1, mqtt_topic_suffix='load/power',
+                                         unit='W', device_class='power',
+                                         print_format='{:0.0f}', groups={'hybrid'}, signed=True)
+load_daily_sensor = SingleRegisterSensor("Load daily consumption", 526, 0.1,
+                                         mqtt_topic_suffix='load/day_energy',
+                                         unit='kWh', device_class='energy', groups={'hybrid'})
+bms_charge_voltage_sensor = SingleRegisterSensor("BMS charge voltage", 312, 0.01,
+                                                 mqtt_topic_suffix='bms/charge_voltage',
+                                                 unit='V', device_class='voltage', print_format='{:0.2f}',
+                                                 groups={'hybrid'})
+bms_discharge_voltage_sensor = SingleRegisterSensor("BMS discharge voltage", 313, 0.01,
+                                                    mqtt_topic_suffix='bms/discharge_voltage',
+                                                    unit='V', device_class='voltage', print_format='{:0.2f}',
+                                                    groups={'hybrid'})
+bms_charge_current_limit_sensor = SingleRegisterSensor("BMS charge current limit", 314, 1,
+                                                       mqtt_topic_suffix='bms/charge_current_limit',
+                                                       unit='A', device_class='current',
+                                                       print_format='{:0.0f}', groups={'hybrid'})
+bms_discharge_current_limit_sensor = SingleRegisterSensor("BMS discharge current limit", 315, 1,
+                                                          mqtt_topic_suffix='bms/discharge_current_limit',
+                                                          unit='A', device_class='current',
+                                                          print_format='{:0.0f}', groups={'hybrid'})
+
+# Hybrid PV inputs, production and grid frequency (the string/micro registers 0x3c - 0x74 mean other things here)
+hybrid_production_today_sensor = SingleRegisterSensor("Production today", 529, 0.1, mqtt_topic_suffix='day_energy',
+                                                      unit='kWh', device_class='energy', groups={'hybrid'})
+hybrid_production_total_sensor = DoubleRegisterSensor("Production Total", 534, 0.1, mqtt_topic_suffix='total_energy',
+                                                      unit='kWh', device_class='energy', groups={'hybrid'})
+hybrid_ac_freq_sensor = SingleRegisterSensor("AC Freq", 609, 0.01, mqtt_topic_suffix='ac/ac_freq',
+                                             unit='Hz', device_class='frequency', print_format='{:0.2f}',
+                                             groups={'hybrid'})
+hybrid_pv1_power_sensor = SingleRegisterSensor("PV1 Power", 672, 1, mqtt_topic_suffix='dc/pv1_power',
+                                               unit='W', device_class='power', print_format='{:0.0f}',
+                                               groups={'hybrid'})
+hybrid_pv2_power_sensor = SingleRegisterSensor("PV2 Power", 673, 1, mqtt_topic_suffix='dc/pv2_power',
+                                               unit='W', device_class='power', print_format='{:0.0f}',
+                                               groups={'hybrid'})
+hybrid_pv1_voltage_sensor = SingleRegisterSensor("PV1 Voltage", 676, 0.1, mqtt_topic_suffix='dc/pv1_voltage',
+                                                 unit='V', device_class='voltage', groups={'hybrid'})
+hybrid_pv1_current_sensor = SingleRegisterSensor("PV1 Current", 677, 0.1, mqtt_topic_suffix='dc/pv1_current',
+                                                 unit='A', device_class='current', groups={'hybrid'})
+hybrid_pv2_voltage_sensor = SingleRegisterSensor("PV2 Voltage", 678, 0.1, mqtt_topic_suffix='dc/pv2_voltage',
+                                                 unit='V', device_class='voltage', groups={'hybrid'})
+hybrid_pv2_current_sensor = SingleRegisterSensor("PV2 Current", 679, 0.1, mqtt_topic_suffix='dc/pv2_current',
+                                                 unit='A', device_class='current', groups={'hybrid'})
 
 sensor_list = {
     production_today_sensor,
@@ -156,5 +318,71 @@ sensor_list = {
     ac_reactive_power_sensor,
     string_radiator_temp_sensor,
     micro_radiator_temp_sensor,
-    igbt_temp_sensor
+    igbt_temp_sensor,
+    running_status_sensor,
+    warning_sensor,
+    fault_sensor,
+    battery_temp_sensor,
+    battery_voltage_sensor,
+    battery_soc_sensor,
+    battery_power_sensor,
+    battery_current_sensor,
+    battery_daily_charge_sensor,
+    battery_daily_discharge_sensor,
+    grid_internal_ct_l1_power_sensor,
+    grid_internal_ct_l2_power_sensor,
+    grid_internal_ct_l3_power_sensor,
+    grid_internal_ct_power_sensor,
+    grid_external_ct_l1_power_sensor,
+    grid_external_ct_l2_power_sensor,
+    grid_external_ct_l3_power_sensor,
+    grid_external_ct_power_sensor,
+    grid_power_sensor,
+    grid_daily_import_sensor,
+    grid_daily_export_sensor,
+    load_l1_power_sensor,
+    load_l2_power_sensor,
+    load_l3_power_sensor,
+    load_power_sensor,
+    load_daily_sensor,
+    bms_charge_voltage_sensor,
+    bms_discharge_voltage_sensor,
+    bms_charge_current_limit_sensor,
+    bms_discharge_current_limit_sensor,
+    hybrid_production_today_sensor,
+    hybrid_production_total_sensor,
+    hybrid_ac_freq_sensor,
+    hybrid_pv1_power_sensor,
+    hybrid_pv2_power_sensor,
+    hybrid_pv1_voltage_sensor,
+    hybrid_pv1_current_sensor,
+    hybrid_pv2_voltage_sensor,
+    hybrid_pv2_current_sensor
 }
+
+# Fixed register blocks of the string and micro sensors, as (first_reg, last_reg), used by the benchmarks.
+# The daemon and the gateway read the blocks planned for their sensors by plan_register_blocks().
+register_blocks = [(0x3b, 0x3f), (0x40, 0x4f), (0x50, 0x5f), (0x65, 0x74)]
+
+
+def plan_register_blocks(sensors, max_gap: int = 16, max_registers: int = 64) -> list:
+    """
+    Groups the registers of the given sensors into (first_reg, last_reg) blocks, so a sparse register map is
+    read with few requests. Unused registers between two sensors are read along as long as the gap is at
+    most max_gap registers. A block never spans more than max_registers registers (the logger frame size).
+    """
+    addresses = set()
+    for sensor in sensors:
+        addresses.update(sensor.registers())
+    blocks = []
+    first_reg = last_reg = None
+    for address in sorted(addresses):
+        if first_reg is not None and address - last_reg - 1 <= max_gap and address - first_reg < max_registers:
+            last_reg = address
+            continue
+        if first_reg is not None:
+            blocks.append((first_reg, last_reg))
+        first_reg = last_reg = address
+    if first_reg is not None:
+        blocks.append((first_reg, last_reg))
+    return blocks
@@ -0,0 +1,388 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+# Stand-ins for a Deye logger and an MQTT broker, used to try the code and to benchmark it without an inverter.
+# Runs on CPython and on the MicroPython unix port:
+#   python3 mp_deye_simulator.py [protocol] [port] [delay_ms] [serial_number|any]
+# where protocol is one of 'solarman_v5', 'modbus_tcp', 'rtu_over_tcp', or 'mqtt' for the broker.
+#   python3 mp_deye_simulator.py discovery [udp_port] [serial_number]
+# answers the Solarman UDP discovery probe for a logger on this host.
+
+import socket
+import select
+import sys
+import time
+
+from mp_deye_discovery import DISCOVERY_UDP_MESSAGE, DISCOVERY_UDP_PORT
+from mp_deye_transport import crc16_bytes
+import mp_deye_mqtt_packet as mqtt_packet
+
+# Plausible readings of a micro inverter producing about 280 W
+DEFAULT_REGISTERS = {
+    0x3b: 2, 0x3c: 25, 0x3e: 480, 0x3f: 12345, 0x40: 0,
+    0x41: 7, 0x42: 6, 0x43: 6, 0x44: 6,
+    0x45: 3100, 0x47: 3050, 0x49: 2301, 0x4a: 3020, 0x4c: 12, 0x4d: 3010, 0x4f: 5001,
+    0x50: 2800, 0x56: 2800, 0x57: 0, 0x5a: 3500,
+    0x6d: 345, 0x6e: 21, 0x6f: 341, 0x70: 20, 0x71: 338, 0x72: 21, 0x73: 344, 0x74: 20,
+    # Hybrid inverter: BMS, daily energies, PV producing 2730 W, battery charging with 1500 W, exporting 450 W
+    312: 5760, 313: 4700, 314: 100, 315: 100, 514: 52, 515: 31, 520: 43, 521: 120, 526: 98,
+    586: 1250, 587: 5230, 588: 76, 590: 0x10000 - 1500, 591: 0x10000 - 2868,
+    604: 0x10000 - 150, 605: 0x10000 - 150, 606: 0x10000 - 150, 607: 0x10000 - 450,
+    616: 0x10000 - 150, 617: 0x10000 - 150, 618: 0x10000 - 150, 619: 0x10000 - 450, 625: 0x10000 - 450,
+    650: 410, 651: 380, 652: 260, 653: 1050,
+    529: 86, 534: 45678, 535: 0, 609: 5001, 672: 1410, 673: 1320, 676: 3870, 677: 36, 678: 3770, 679: 35,
+}
+
+def _ticks_ms():
+    return int(time.time() * 1000)
+
+
+class DeyeSimulatorServer():
+    """
+    Single threaded TCP server built on select.poll, base of the logger and MQTT broker simulators.
+
+    Subclasses split the received stream into requests with request_length() and answer them in handle().
+    Each response is sent delay_ms after its request arrived, independent of other requests.
+    """
+
+    def __init__(self, port: int, delay_ms: int = 0, host: str = '127.0.0.1'):
+        self.delay_ms = delay_ms
+        self.requests = 0
+        self.__clients = {}
+        self.__pending = []
+        self.__poll = select.poll()
+        self.__server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__server.bind(socket.getaddrinfo(host, port)[0][-1])
+        self.__server.listen(128)
+        self.__poll.register(self.__server, select.POLLIN)
+        self.__running = True
+
+    def serve_forever(self):
+        while self.__running:
+            self.poll(50)
+        for client, buffer in self.__clients.values():
+            client.close()
+        self.__server.close()
+
+    def start_in_thread(self):
+        import _thread
+        _thread.start_new_thread(self.serve_forever, ())
+
+    def stop(self):
+        self.__running = False
+
+    def poll(self, timeout_ms: int):
+        if self.__pending:
+            timeout_ms = max(0, min(timeout_ms, self.__pending[0][0] - _ticks_ms()))
+        for ev in self.__poll.poll(timeout_ms):
+            # MicroPython may append more elements to the tuple
+            obj, event = ev[0], ev[1]
+            # CPython reports file descriptors, MicroPython the registered objects
+            fd = obj if isinstance(obj, int) else obj.fileno()
+            if fd == self.__server.fileno():
+                client, addr = self.__server.accept()
+                self.__clients[client.fileno()] = [client, bytearray()]
+                self.__poll.register(client, select.POLLIN)
+            elif fd in self.__clients:
+                self.__receive(fd)
+        now = _ticks_ms()
+        while self.__pending and self.__pending[0][0] <= now:
+            due, client, response = self.__pending.pop(0)
+            self.send(client, response)
+
+    def send(self, client, data):
+        try:
+            client.sendall(data)
+        except OSError:
+            pass
+
+    def close(self, client):
+        fd = client.fileno()
+        if fd in self.__clients:
+            self.__poll.unregister(client)
+            del self.__clients[fd]
+            self.disconnected(client)
+        client.close()
+
+    def __receive(self, fd):
+        client, buffer = self.__clients[fd]
+        try:
+            data = client.recv(1024)
+        except OSError:
+            data = None
+        if not data:
+            self.close(client)
+            return
+        buffer.extend(data)
+        while True:
+            length = self.request_length(buffer)
+            if length is None or len(buffer) < length:
+                break
+            request = bytes(buffer[:length])
+            buffer = buffer[length:]
+            self.__clients[fd][1] = buffer
+            self.requests += 1
+            response = self.handle(client, request)
+            if response:
+                if self.delay_ms:
+                    self.__pending.append((_ticks_ms() + self.delay_ms, client, response))
+                else:
+                    self.send(client, response)
+            if fd not in self.__clients:
+                break
+
+    def request_length(self, buffer):
+        """
+        Total length of the request at the start of buffer, None if not enough bytes were received yet
+        """
+        pass
+
+    def handle(self, client, request: bytes) -> bytes:
+        """
+        Answers one complete request, returns the response or None
+        """
+        pass
+
+    def disconnected(self, client):
+        pass
+
+
+class DeyeLoggerSimulator(DeyeSimulatorServer):
+    """
+    Serves Modbus read-holding-registers (0x03) and write-multiple-registers (0x10) requests
+    from an in-memory register map over Solarman V5, Modbus TCP or RTU over TCP.
+
+    delay_ms models the processing latency of a real logger. With serial_number None the
+    simulator answers Solarman V5 requests for any logger serial, standing in for a whole fleet.
+    'fault' corrupts every response while set: 'exception' answers with a Modbus exception (illegal data
+    address), 'short' cuts the frame in half, 'crc' breaks the Modbus CRC (not on Modbus TCP), 'garbled'
+    flips the first byte (V5 start byte, MBAP transaction identifier).
+    """
+
+    def __init__(self, protocol='solarman_v5', serial_number=4175806782, port=8899, registers=None,
+                 delay_ms=0, host='127.0.0.1'):
+        super().__init__(port, delay_ms, host)
+        self.protocol = protocol
+        self.serial_number = serial_number
+        self.registers = dict(DEFAULT_REGISTERS) if registers is None else registers
+        self.fault = None
+        self.__counter = 0
+
+    def request_length(self, buffer):
+        if self.protocol == 'solarman_v5':
+            if len(buffer) < 3:
+                return None
+            return 13 + int.from_bytes(buffer[1:3], 'little')
+        elif self.protocol == 'modbus_tcp':
+            if len(buffer) < 6:
+                return None
+            return 6 + int.from_bytes(buffer[4:6], 'big')
+        if len(buffer) < 7:
+            return None
+        return 9 + buffer[6] if buffer[1] == 0x10 else 8
+
+    def handle(self, client, request: bytes) -> bytes:
+        response = self.__respond(request)
+        if self.fault == 'short':
+            return response[:len(response) // 2]
+        elif self.fault == 'garbled':
+            return bytes([response[0] ^ 0xff]) + response[1:]
+        return response
+
+    def __respond(self, request: bytes) -> bytes:
+        if self.protocol == 'solarman_v5':
+            serial = int.from_bytes(request[7:11], 'little')
+            if self.serial_number is not None and serial != self.serial_number:
+                return self.__v5_frame(request, bytes(14) + bytes([0x06, 0x00]))
+            modbus = request[26:-4]
+            return self.__v5_frame(request, bytes([0x02, 0x01]) + bytes(12) + self.__rtu(self.__modbus(modbus)))
+        elif self.protocol == 'modbus_tcp':
+            pdu = self.__modbus(request[6:])
+            return request[0:4] + len(pdu).to_bytes(2, 'big') + pdu
+        return self.__rtu(self.__modbus(request[:-2]))
+
+    def __rtu(self, modbus_frame):
+        crc = bytearray(crc16_bytes(modbus_frame))
+        if self.fault == 'crc':
+            crc[1] ^= 0xff
+        return bytes(modbus_frame) + bytes(crc)
+
+    def __v5_frame(self, request, payload):
+        self.__counter = (self.__counter + 1) & 0xff
+        serial = request[7:11] if self.serial_number is None else self.serial_number.to_bytes(4, 'little')
+        frame = bytearray(b'\xa5') + len(payload).to_bytes(2, 'little') + b'\x10\x15' \
+            + bytes([request[5], self.__counter]) + serial + payload + b'\x00\x15'
+        frame[-2] = sum(frame[1:-2]) & 0xff
+        return bytes(frame)
+
+    def __modbus(self, frame):
+        unit = frame[0]
+        function = frame[1]
+        first_reg = int.from_bytes(frame[2:4], 'big')
+        reg_count = int.from_bytes(frame[4:6], 'big')
+        if self.fault == 'exception':
+            return bytes([unit, function | 0x80, 0x02])
+        if function == 0x03:
+            data = bytearray()
+            for reg in range(first_reg, first_reg + reg_count):
+                data += (self.registers.get(reg, 0) & 0xffff).to_bytes(2, 'big')
+            return bytes([unit, function, len(data)]) + data
+        elif function == 0x10:
+            for i in range(reg_count):
+                self.registers[first_reg + i] = int.from_bytes(frame[7 + i * 2:9 + i * 2], 'big')
+            return bytes(frame[0:6])
+        # Illegal function
+        return bytes([unit, function | 0x80, 0x01])
+
+
+class DeyeMqttBrokerSimulator(DeyeSimulatorServer):
+    """
+    Minimal MQTT 3.1.1 broker: accepts any client, acknowledges QoS 1 publications and subscriptions,
+    answers pings and forwards publications to subscribers of the exact topic or of a 'prefix/#' filter.
+    Retained messages are kept in 'retained'. Subscribers receive everything with QoS 0.
+    With 'acknowledge' False QoS 1 publications are not acknowledged, to exercise retransmits. With 'silent'
+    True nothing but the CONNACK is answered, pings neither. With 'accept' False a CONNECT closes the
+    connection, like a broker that is not ready yet.
+    """
+
+    def __init__(self, port=1883, delay_ms=0, host='127.0.0.1'):
+        super().__init__(port, delay_ms, host)
+        self.acknowledge = True
+        self.silent = False
+        self.accept = True
+        self.connects = 0
+        self.pings = 0
+        self.published = 0
+        self.duplicates = 0
+        self.retained = {}
+        self.on_publish = None
+        self.__subscriptions = []
+
+    def request_length(self, buffer):
+        return mqtt_packet.packet_length(buffer)
+
+    def handle(self, client, request: bytes) -> bytes:
+        first_byte, header_length, remaining = mqtt_packet.decode_header(request)
+        body = request[header_length:]
+        packet_type = first_byte & 0xf0
+        if packet_type == mqtt_packet.CONNECT:
+            self.connects += 1
+            if not self.accept:
+                self.close(client)
+                return None
+            return bytes([mqtt_packet.CONNACK, 2, 0, 0])
+        elif packet_type == mqtt_packet.PUBLISH:
+            topic, payload, qos, packet_id = mqtt_packet.parse_publish(first_byte, body)
+            self.published += 1
+            if first_byte & 0x08:
+                self.duplicates += 1
+            if first_byte & 0x01:
+                self.retained[topic] = payload
+            if self.on_publish:
+                self.on_publish(topic, payload)
+            for subscriber, topic_filter in self.__subscriptions:
+                if subscriber is not client and self.__matches(topic_filter, topic):
+                    self.send(subscriber, mqtt_packet.publish_packet(topic, payload))
+            if qos and self.acknowledge and not self.silent:
+                return bytes(mqtt_packet.puback_packet(packet_id))
+        elif packet_type == mqtt_packet.SUBSCRIBE:
+            packet_id = body[0:2]
+            topic_length = int.from_bytes(body[2:4], 'big')
+            self.__subscriptions.append((client, bytes(body[4:4 + topic_length])))
+            return bytes([mqtt_packet.SUBACK, 3]) + packet_id + bytes([0])
+        elif packet_type == mqtt_packet.PINGREQ:
+            self.pings += 1
+            if not self.silent:
+                return bytes([mqtt_packet.PINGRESP, 0])
+        elif packet_type == mqtt_packet.DISCONNECT:
+            self.close(client)
+        return None
+
+    def disconnected(self, client):
+        self.__subscriptions = [s for s in self.__subscriptions if s[0] is not client]
+
+    def __matches(self, topic_filter, topic):
+        if topic_filter.endswith(b'#'):
+            return topic.startswith(topic_filter[:-1])
+        return topic_filter == topic
+
+
+class DeyeDiscoverySimulator():
+    """
+    Answers the Solarman UDP discovery probe with 'ip,mac,serial' for every logger in 'loggers' (serial -> IP).
+    'noise' is sent before the answers, standing in for other devices on the port.
+    """
+
+    def __init__(self, loggers: dict, port=48899, host='127.0.0.1'):
+        self.loggers = loggers
+        self.noise = []
+        self.probes = 0
+        self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__socket.bind(socket.getaddrinfo(host, port)[0][-1])
+        self.__socket.settimeout(0.05)
+        self.__running = True
+
+    def serve_forever(self):
+        while self.__running:
+            try:
+                data, address = self.__socket.recvfrom(128)
+            except OSError:
+                continue
+            if data != DISCOVERY_UDP_MESSAGE:
+                continue
+            self.probes += 1
+            for datagram in self.noise:
+                self.__socket.sendto(datagram, address)
+            for serial_number, ip_address in self.loggers.items():
+                mac = '{:012X}'.format(serial_number)
+                self.__socket.sendto(f'{ip_address},{mac},{serial_number}'.encode(), address)
+        self.__socket.close()
+
+    def start_in_thread(self):
+        import _thread
+        _thread.start_new_thread(self.serve_forever, ())
+
+    def stop(self):
+        self.__running = False
+
+
+def main(args):
+    protocol = args[0] if len(args) > 0 else 'solarman_v5'
+    port = int(args[1]) if len(args) > 1 else (1883 if protocol == 'mqtt' else 8899)
+    if protocol == 'discovery':
+        port = int(args[1]) if len(args) > 1 else DISCOVERY_UDP_PORT
+        serial_number = int(args[2]) if len(args) > 2 else 4175806782
+        print(f"Answering discovery probes on UDP port {port} for logger {serial_number}")
+        DeyeDiscoverySimulator({serial_number: '127.0.0.1'}, port=port).serve_forever()
+        return
+    delay_ms = int(args[2]) if len(args) > 2 else 0
+    if protocol == 'mqtt':
+        print(f"Simulating MQTT broker on port {port}")
+        DeyeMqttBrokerSimulator(port=port, delay_ms=delay_ms).serve_forever()
+        return
+    serial_number = 4175806782
+    if len(args) > 3:
+        serial_number = None if args[3] == 'any' else int(args[3])
+    print(f"Simulating {protocol} logger on port {port}, response delay {delay_ms} ms")
+    DeyeLoggerSimulator(protocol, serial_number=serial_number, port=port, delay_ms=delay_ms).serve_forever()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
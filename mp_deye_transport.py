@@ -0,0 +1,301 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+try:
+    import ubinascii
+except ImportError:
+    import binascii as ubinascii
+
+from mp_deye_error import DeyeFrameError, DeyeShortFrameError, DeyeCrcError, DeyeLoggerError
+
+def crc16(data: bytearray, poly: hex = 0xA001) -> str:
+    '''
+        CRC-16 MODBUS HASHING ALGORITHM
+        All the credits to [kalebu](https://github.com/kalebu)
+        
+        MIT License
+
+        Copyright (c) 2021 Jordan Kalebu
+
+        Permission is hereby granted, free of charge, to any person obtaining a copy
+        of this software and associated documentation files (the "Software"), to deal
+        in the Software without restriction, including without limitation the rights
+        to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+        copies of the Software, and to permit persons to whom the Software is
+        furnished to do so, subject to the following conditions:
+
+        The above copyright notice and this permission notice shall be included in all
+        copies or substantial portions of the Software.
+
+        THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+        IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+        FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+        AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+        LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+        OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+        SOFTWARE.
+    '''
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc >> 1) ^ poly
+                   if (crc & 0x0001)
+                   else crc >> 1)
+
+    hv = hex(crc).upper()[2:]
+    blueprint = '0000'
+    return (blueprint if len(hv) == 0 else blueprint[:-len(hv)] + hv)
+
+def crc16_bytes(data: bytearray) -> bytearray:
+    """
+    Modbus CRC of data in wire order (low byte first)
+    """
+    return bytearray(bytes(reversed(ubinascii.unhexlify(crc16(data)))))
+
+def rtu_response_length(frame: bytearray) -> int:
+    """
+    Length of a Modbus RTU response frame including CRC, derived from its function code.
+    Returns None if it cannot be told yet.
+    """
+    if len(frame) < 3:
+        return None
+    function = frame[1]
+    if function & 0x80:
+        return 5
+    elif function == 0x03 or function == 0x04:
+        return 5 + frame[2]
+    elif function == 0x06 or function == 0x10:
+        return 8
+    return None
+
+def check_crc(frame: bytearray) -> bytearray:
+    """
+    Validates the Modbus CRC of an RTU response frame and returns the frame without it.
+    Bytes following the frame (some loggers append padding) are ignored.
+    """
+    length = rtu_response_length(frame)
+    if length is not None:
+        if len(frame) < length:
+            raise DeyeShortFrameError(f"Modbus frame is too short. Expected {length} bytes, got {len(frame)}")
+        frame = frame[:length]
+    if len(frame) < 4:
+        raise DeyeShortFrameError("Modbus frame is too short or empty")
+    actual_crc = int.from_bytes(frame[-2:], 'little')
+    expected_crc = int.from_bytes(ubinascii.unhexlify(crc16(frame[:-2])), 'big')
+    if actual_crc != expected_crc:
+        raise DeyeCrcError("Modbus frame crc is not valid. Expected {:04x}, got {:04x}".format(
+            expected_crc, actual_crc))
+    return frame[:-2]
+
+
+class DeyeTransport():
+    """
+    Wraps Modbus requests into the envelope spoken by the logger and unwraps its responses.
+
+    This is an abstract class. Requests and responses are passed as Modbus frames without CRC:
+    unit address, function code and data. The transport adds and validates everything else.
+
+    Transports with supports_pipelining carry a sequence number, which the logger echoes in its
+    response. Several requests may then be in flight on one socket and are matched by sequence.
+    """
+
+    supports_pipelining = False
+
+    # @abstractmethod
+    def build_request(self, modbus_frame: bytearray, sequence: int = 0) -> bytearray:
+        """
+        Builds the request frame sent to the logger
+        """
+        pass
+
+    # @abstractmethod
+    def extract_response(self, frame: bytearray) -> bytearray:
+        """
+        Validates the response frame and returns the Modbus frame without CRC.
+        Raises DeyeError on invalid frames.
+        """
+        pass
+
+    # @abstractmethod
+    def response_length(self, buffer: bytearray) -> int:
+        """
+        Total length of the response frame at the start of buffer, None if not enough bytes were received yet
+        """
+        pass
+
+    def response_sequence(self, frame: bytearray) -> int:
+        """
+        Sequence number of a response frame, as set by build_request
+        """
+        return 0
+
+    # @abstractmethod
+    def extract_request(self, frame: bytearray) -> bytearray:
+        """
+        Returns the Modbus frame without CRC of a request built by build_request, e.g. to replay captured frames
+        """
+        pass
+
+
+class DeyeSolarmanV5Transport(DeyeTransport):
+    """
+    Solarman V5 protocol spoken by Deye Wi-Fi loggers, typically on port 8899.
+    The Modbus RTU frame is embedded in an envelope with logger serial number and checksum.
+    """
+
+    supports_pipelining = True
+
+    def __init__(self, serial_number: int):
+        self.serial_number = serial_number
+
+    def build_request(self, modbus_frame: bytearray, sequence: int = 0) -> bytearray:
+        start = bytearray(ubinascii.unhexlify('A5'))  # start
+        length = (15 + len(modbus_frame) + 2).to_bytes(2, 'little')  # datalength
+        controlcode = bytearray(ubinascii.unhexlify('1045'))  # controlCode
+        inverter_sn_prefix = bytearray(sequence.to_bytes(2, 'little'))  # sequence number
+        datafield = bytearray(ubinascii.unhexlify('020000000000000000000000000000'))
+        modbus_crc = crc16_bytes(modbus_frame)
+        checksum = bytearray(ubinascii.unhexlify('00'))  # checksum placeholder for outer frame
+        end_code = bytearray(ubinascii.unhexlify('15'))
+        inverter_sn = bytearray(self.serial_number.to_bytes(4, 'little'))
+        frame = start + length + controlcode + inverter_sn_prefix + inverter_sn + datafield \
+            + modbus_frame + modbus_crc + checksum + end_code
+
+        checksum = 0
+        for i in range(1, len(frame) - 2, 1):
+            checksum += frame[i] & 255
+        frame[len(frame) - 2] = int((checksum & 255))
+
+        return frame
+
+    def extract_response(self, frame: bytearray) -> bytearray:
+        # 29 - outer frame, 3 - modbus addr, command and exception code of the shortest (exception) response
+        if not frame:
+            raise DeyeShortFrameError("No response frame")
+        elif len(frame) == 29:
+            self.__parse_response_error_code(frame)
+        elif len(frame) < (29 + 3):
+            raise DeyeShortFrameError("Response frame is too short")
+        elif frame[0] != 0xa5:
+            raise DeyeFrameError("Response frame has invalid starting byte")
+        elif frame[-1] != 0x15:
+            raise DeyeFrameError("Response frame has invalid ending byte")
+
+        return check_crc(frame[25:-2])
+
+    def response_length(self, buffer: bytearray) -> int:
+        if len(buffer) < 3:
+            return None
+        elif buffer[0] != 0xa5:
+            raise DeyeFrameError("Response frame has invalid starting byte")
+        # start, length, control code, sequence, serial - payload - checksum, end
+        return 11 + int.from_bytes(buffer[1:3], 'little') + 2
+
+    def response_sequence(self, frame: bytearray) -> int:
+        # The logger echoes the low byte of the request sequence number
+        return frame[5]
+
+    def extract_request(self, frame: bytearray) -> bytearray:
+        # 26 - outer header and data field, 4 - modbus crc, checksum and end
+        return frame[26:-4]
+
+    def response_serial(self, frame: bytearray) -> int:
+        # The logger puts its own serial number into the header, also into error responses
+        return int.from_bytes(frame[7:11], 'little')
+
+    def __parse_response_error_code(self, frame):
+        error_frame = frame[25:-2]
+        error_code = error_frame[0]
+        if error_code == 0x05:
+            raise DeyeLoggerError(error_code, "Modbus device address does not match.")
+        elif error_code == 0x06:
+            raise DeyeLoggerError(error_code, "Logger Serial Number does not match. Check your configuration file.")
+        else:
+            raise DeyeLoggerError(error_code, "Unknown response error code {:02x}. Error frame: {}".format(
+                error_code, ubinascii.hexlify(error_frame)))
+
+
+class DeyeModbusTcpTransport(DeyeTransport):
+    """
+    Plain Modbus TCP (MBAP header, no CRC), typically on port 502.
+    The transaction identifier carries the request sequence number.
+    """
+
+    supports_pipelining = True
+
+    def build_request(self, modbus_frame: bytearray, sequence: int = 0) -> bytearray:
+        # transaction id, protocol id 0, length of unit id + pdu
+        return bytearray((sequence & 0xffff).to_bytes(2, 'big') + bytes(2)
+                         + len(modbus_frame).to_bytes(2, 'big')) + modbus_frame
+
+    def extract_response(self, frame: bytearray) -> bytearray:
+        # 7 - MBAP header, 2 - modbus function code and first data byte
+        if not frame or len(frame) < 7 + 2:
+            raise DeyeShortFrameError("Response frame is too short")
+        elif frame[2] != 0 or frame[3] != 0:
+            raise DeyeFrameError("Response frame has invalid protocol identifier")
+        length = int.from_bytes(frame[4:6], 'big')
+        if len(frame) < 6 + length:
+            raise DeyeShortFrameError("Response frame is shorter than its MBAP length")
+        return frame[6:6 + length]
+
+    def response_length(self, buffer: bytearray) -> int:
+        if len(buffer) < 6:
+            return None
+        return 6 + int.from_bytes(buffer[4:6], 'big')
+
+    def response_sequence(self, frame: bytearray) -> int:
+        return int.from_bytes(frame[0:2], 'big')
+
+    def extract_request(self, frame: bytearray) -> bytearray:
+        return frame[6:]
+
+
+class DeyeRtuOverTcpTransport(DeyeTransport):
+    """
+    Raw Modbus RTU frames (with CRC) tunnelled over a TCP socket, as offered by many RS485 gateways.
+    RTU frames have no sequence number, so requests can not be pipelined.
+    """
+
+    def build_request(self, modbus_frame: bytearray, sequence: int = 0) -> bytearray:
+        return modbus_frame + crc16_bytes(modbus_frame)
+
+    def extract_response(self, frame: bytearray) -> bytearray:
+        if not frame:
+            raise DeyeShortFrameError("No response frame")
+        return check_crc(frame)
+
+    def response_length(self, buffer: bytearray) -> int:
+        return rtu_response_length(buffer)
+
+    def extract_request(self, frame: bytearray) -> bytearray:
+        return frame[:-2]
+
+
+def create_transport(logger_config) -> DeyeTransport:
+    """
+    Creates the transport selected by the 'protocol' of a DeyeLoggerConfig
+    """
+    if logger_config.protocol == 'modbus_tcp':
+        return DeyeModbusTcpTransport()
+    elif logger_config.protocol == 'rtu_over_tcp':
+        return DeyeRtuOverTcpTransport()
+    elif logger_config.protocol == 'solarman_v5':
+        return DeyeSolarmanV5Transport(logger_config.serial_number)
+    raise ValueError(f"Unknown logger protocol {logger_config.protocol}")
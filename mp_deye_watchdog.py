@@ -0,0 +1,109 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+import time
+
+from mp_deye_config import DeyeConfig
+from mp_deye_log import log
+
+class DeyeWatchdog():
+    """
+    Owns the single hardware watchdog and supervises the stages of a poll cycle.
+
+    Every stage (connect, request, publish, sleep, discover) declares a deadline in WDT_STAGE_DEADLINES.
+    The hardware watchdog is only fed while all running stages are within their budget. A stage
+    that overruns its deadline is logged once and the watchdog is starved, so the device resets.
+    """
+
+    def __init__(self, config: DeyeConfig):
+        self.__deadlines = config.wdt_stage_deadlines
+        self.__stages = {}
+        self.__overdue_reported = None
+        self.__wdt = None
+        if config.wdt_enable:
+            from machine import WDT
+            self.__wdt = WDT()
+
+    def start(self, stage: str, extra_seconds: int = 0):
+        """
+        Marks the beginning of a stage. Its deadline is the configured budget plus extra_seconds
+        """
+        deadline_ms = (self.__deadlines[stage] + extra_seconds) * 1000
+        self.__stages[stage] = (time.ticks_ms(), deadline_ms)
+        self.feed()
+
+    def stop(self, stage: str):
+        """
+        Marks the end of a stage
+        """
+        if stage in self.__stages:
+            del self.__stages[stage]
+        self.feed()
+
+    def remaining_ms(self, stage: str) -> int:
+        """
+        Returns the time left in the budget of a running stage, 0 when the deadline has passed
+        """
+        if stage not in self.__stages:
+            return 0
+        started, deadline_ms = self.__stages[stage]
+        return max(0, deadline_ms - time.ticks_diff(time.ticks_ms(), started))
+
+    def expired(self, stage: str) -> bool:
+        return self.remaining_ms(stage) == 0
+
+    def overdue_stage(self):
+        """
+        Returns the name of the first running stage that exceeded its deadline, or None
+        """
+        now = time.ticks_ms()
+        for stage, (started, deadline_ms) in self.__stages.items():
+            if time.ticks_diff(now, started) > deadline_ms:
+                return stage
+        return None
+
+    def feed(self) -> bool:
+        """
+        Feeds the hardware watchdog if every running stage is within its budget
+        """
+        stage = self.overdue_stage()
+        if stage is not None:
+            if self.__overdue_reported != stage:
+                self.__overdue_reported = stage
+                log.error("Watchdog: stage '{}' exceeded its deadline of {} s", stage, self.__deadlines[stage])
+            return False
+        self.__overdue_reported = None
+        if self.__wdt: self.__wdt.feed()
+        return True
+
+    def sleep(self, seconds: int, idle=None):
+        """
+        Sleeps between poll cycles as a supervised stage, feeding the watchdog.
+        idle() is called every 100 ms, e.g. to handle incoming MQTT messages.
+        """
+        self.start('sleep', seconds)
+        try:
+            remaining_ms = seconds * 1000
+            step_ms = 100 if idle else 1000
+            while remaining_ms > 0:
+                remaining_ms -= step_ms
+                time.sleep_ms(step_ms)
+                if idle: idle()
+                self.feed()
+        finally:
+            self.stop('sleep')
@@ -0,0 +1,140 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+
+import network
+import time
+
+from mp_deye_config import DeyeConfig
+from mp_deye_watchdog import DeyeWatchdog
+from mp_deye_log import log
+
+
+class DeyeWifiSupervisor():
+    """
+    Keeps the Wi-Fi station connected without resetting the device.
+
+    After the first connect the BSSID and channel of the access point and the IP configuration are cached.
+    When the link drops, reconnects use the static cached IP configuration (no DHCP) and, in the first half of
+    the attempts, the cached BSSID (no AP selection). Between attempts the delay doubles up to
+    wifi_reconnect_backoff_max_ms. on_restored() is called after a successful reconnect, so the owner can
+    rebuild its sockets. Outages and their recovery time are counted.
+    """
+
+    def __init__(self, config: DeyeConfig, watchdog: DeyeWatchdog):
+        self.ssid = config.wifi_ssid
+        self.password = config.wifi_pwd
+        self.attempts = config.wifi_reconnect_attempts
+        self.attempt_timeout_ms = config.wifi_reconnect_timeout_ms
+        self.backoff_max_ms = config.wifi_reconnect_backoff_max_ms
+        self.watchdog = watchdog
+        self.station = network.WLAN(network.STA_IF)
+        self.on_restored = None
+        self.outages = 0
+        self.last_recovery_ms = 0
+        self.total_outage_ms = 0
+        self.bssid = None
+        self.channel = None
+        self.ifconfig = None
+
+    def is_connected(self) -> bool:
+        return self.station.isconnected()
+
+    def connect(self):
+        """
+        Connects at boot, waiting as long as it takes, and caches the link parameters
+        """
+        self.station.active(True)
+        self.station.connect(self.ssid, self.password)
+        log.info("Waiting for the Wifi link to {}", self.ssid)
+        while not self.station.isconnected():
+            self.watchdog.feed()
+            time.sleep(1)
+        self.__cache_link()
+
+    def check(self) -> bool:
+        """
+        Returns True if the link is up, reconnecting first if it dropped. False if all attempts failed.
+        """
+        if self.station.isconnected():
+            return True
+        self.outages += 1
+        log.warning("Wifi link lost (outage {})", self.outages)
+        start = time.ticks_ms()
+        if not self.reconnect():
+            log.error("Wifi reconnect failed after {} attempts", self.attempts)
+            return False
+        self.last_recovery_ms = time.ticks_diff(time.ticks_ms(), start)
+        self.total_outage_ms += self.last_recovery_ms
+        log.warning("Wifi link restored in {} ms", self.last_recovery_ms)
+        if self.on_restored:
+            self.on_restored()
+        return True
+
+    def reconnect(self) -> bool:
+        backoff_ms = 250
+        for attempt in range(self.attempts):
+            # Pinning the BSSID fails if the access point changed, so the second half lets the station choose
+            bssid = self.bssid if attempt < (self.attempts + 1) // 2 else None
+            if self.__attempt(bssid):
+                return True
+            if attempt == self.attempts - 1:
+                break
+            log.info("Wifi reconnect attempt {} failed, next in {} ms", attempt + 1, backoff_ms)
+            self.__sleep_ms(backoff_ms)
+            backoff_ms = min(self.backoff_max_ms, backoff_ms * 2)
+        return False
+
+    def __attempt(self, bssid) -> bool:
+        self.watchdog.start('wifi')
+        try:
+            self.station.disconnect()
+            if self.ifconfig:
+                self.station.ifconfig(self.ifconfig)
+            if bssid:
+                self.station.connect(self.ssid, self.password, bssid=bssid)
+            else:
+                self.station.connect(self.ssid, self.password)
+            start = time.ticks_ms()
+            while time.ticks_diff(time.ticks_ms(), start) < self.attempt_timeout_ms:
+                if self.station.isconnected():
+                    return True
+                self.__sleep_ms(50)
+            return False
+        finally:
+            self.watchdog.stop('wifi')
+
+    def __sleep_ms(self, delay_ms: int):
+        while delay_ms > 0:
+            time.sleep_ms(min(delay_ms, 100))
+            delay_ms -= 100
+            self.watchdog.feed()
+
+    def __cache_link(self):
+        self.ifconfig = self.station.ifconfig()
+        try:
+            # Strongest access point of our network, found by one scan while connected
+            best = None
+            for entry in self.station.scan():
+                if entry[0] == self.ssid.encode() and (best is None or entry[3] > best[3]):
+                    best = entry
+            if best:
+                self.bssid = best[1]
+                self.channel = best[2]
+        except OSError as e:
+            log.warning("Wifi scan failed: {}", e)
+        log.info("Wifi link: ip {}, channel {}", self.ifconfig[0], self.channel)